@@ -0,0 +1,302 @@
+import os
+import glob
+import fcntl
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+from config import ANN_MIN_TRAIN_SIZE, ANN_NPROBE
+from vector_index import normalize_rows
+
+# Rows scored at a time during k-means assignment, to bound temporary memory
+_ASSIGN_BLOCK_ROWS = 16384
+
+# Segment count above which the files are merged back into one segment
+_MAX_SEGMENTS = 64
+
+
+def _spherical_kmeans(vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Cluster unit vectors by cosine similarity and return nlist unit centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=nlist)
+
+        # Re-seed empty clusters with random points so every list stays in use
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), size=len(empty), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids.astype(np.float32)
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the nearest centroid for each vector."""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _ASSIGN_BLOCK_ROWS):
+        block = vectors[start:start + _ASSIGN_BLOCK_ROWS]
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFFlatIndex:
+    """Approximate nearest-neighbour index (IVF-flat) over chunk embeddings, in pure NumPy.
+
+    Vectors are grouped into inverted lists by their nearest k-means centroid; a
+    query scores only the vectors in its nprobe closest lists. Below min_train_size
+    vectors the index keeps a single list, so search is exact.
+
+    The index lives in a directory next to the vector store. Each add writes one
+    segment file and deletions are recorded as tombstones, so updates never rewrite
+    the whole index. Writers in every process serialize on a file lock and reload
+    the index under it; other processes pick up changes on their next search.
+    """
+
+    def __init__(self, path: str, nprobe: int = ANN_NPROBE, min_train_size: int = ANN_MIN_TRAIN_SIZE):
+        self.path = path
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self._lock = threading.Lock()
+        self._loaded_state = None
+        self._reset()
+        os.makedirs(path, exist_ok=True)
+        with self.file_lock(fcntl.LOCK_SH):
+            self._load()
+
+    def _reset(self) -> None:
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_size = 0
+        self.list_ids: List[np.ndarray] = []
+        self.list_vectors: List[np.ndarray] = []
+        self.tombstones = np.empty(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self.list_ids)
+
+    @property
+    def nlist(self) -> int:
+        return len(self.list_ids)
+
+    # ---------------------------------------------------------------- persistence
+
+    @contextmanager
+    def file_lock(self, operation: int = fcntl.LOCK_EX):
+        """Lock across worker processes: exclusive to change the index files, shared to load them."""
+        with open(os.path.join(self.path, "index.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _segment_paths(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.path, "segment-*.npz")))
+
+    @staticmethod
+    def _segment_number(segment_path: str) -> int:
+        return int(os.path.basename(segment_path)[len("segment-"):-len(".npz")])
+
+    def _disk_state(self) -> Tuple[Tuple[str, ...], int]:
+        """What is on disk: the segment files and the tombstone file size.
+
+        Segment numbers are never reused and tombstones only grow between
+        rewrites, so this changes with every write, unlike a directory mtime
+        that two writes within one clock tick can share.
+        """
+        tombstones_path = os.path.join(self.path, "tombstones.npy")
+        tombstones_size = os.path.getsize(tombstones_path) if os.path.exists(tombstones_path) else 0
+        return tuple(os.path.basename(p) for p in self._segment_paths()), tombstones_size
+
+    def _load(self) -> None:
+        """Load centroids, segments and tombstones from disk; call with the file lock held."""
+        self._reset()
+        centroids_path = os.path.join(self.path, "centroids.npz")
+        if os.path.exists(centroids_path):
+            with np.load(centroids_path) as data:
+                self.centroids = data["centroids"]
+                self.trained_size = int(data["trained_size"])
+
+        tombstones_path = os.path.join(self.path, "tombstones.npy")
+        if os.path.exists(tombstones_path):
+            self.tombstones = np.load(tombstones_path)
+
+        nlist = len(self.centroids) if self.centroids is not None else 1
+        self.list_ids = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self.list_vectors = [np.empty((0, 0), dtype=np.float32) for _ in range(nlist)]
+
+        for segment_path in self._segment_paths():
+            with np.load(segment_path) as data:
+                self._append(data["ids"], data["vectors"], data["lists"])
+
+        if len(self.tombstones):
+            self._drop(self.tombstones)
+        self._loaded_state = self._disk_state()
+
+    def _maybe_reload(self, operation: Optional[int] = fcntl.LOCK_SH) -> None:
+        """Reload if any process changed the index files since they were loaded.
+
+        Writers already hold the exclusive file lock and pass operation=None.
+        """
+        if self._disk_state() == self._loaded_state:
+            return
+        if operation is None:
+            self._load()
+        else:
+            with self.file_lock(operation):
+                self._load()
+
+    def _write_segment(self, ids: np.ndarray, vectors: np.ndarray, lists: np.ndarray) -> None:
+        """Write a segment numbered after every existing one; call with the exclusive file lock held."""
+        segment_paths = self._segment_paths()
+        number = self._segment_number(segment_paths[-1]) + 1 if segment_paths else 0
+        segment_path = os.path.join(self.path, f"segment-{number:08d}.npz")
+        tmp_path = os.path.join(self.path, f"tmp-segment-{number:08d}.npz")
+        np.savez(tmp_path, ids=ids, vectors=vectors, lists=lists)
+        os.replace(tmp_path, segment_path)
+
+    def _write_tombstones(self) -> None:
+        tmp_path = os.path.join(self.path, "tombstones.tmp.npy")
+        np.save(tmp_path, self.tombstones)
+        os.replace(tmp_path, os.path.join(self.path, "tombstones.npy"))
+
+    def _rewrite(self) -> None:
+        """Replace all files with the current centroids and one segment holding every vector."""
+        # The merged segment is written before the old ones are removed, so it takes a new number
+        old_segment_paths = self._segment_paths()
+        if self.centroids is not None:
+            tmp_path = os.path.join(self.path, "centroids.tmp.npz")
+            np.savez(tmp_path, centroids=self.centroids, trained_size=self.trained_size)
+            os.replace(tmp_path, os.path.join(self.path, "centroids.npz"))
+
+        self.tombstones = np.empty(0, dtype=np.int64)
+        self._write_tombstones()
+        if len(self):
+            ids = np.concatenate(self.list_ids)
+            vectors = np.concatenate([v for v in self.list_vectors if len(v)])
+            lists = np.concatenate([np.full(len(l), i, dtype=np.int32) for i, l in enumerate(self.list_ids)])
+        else:
+            ids, vectors, lists = np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.int32)
+        self._write_segment(ids, vectors, lists)
+        for segment_path in old_segment_paths:
+            os.remove(segment_path)
+
+    def _compact_if_needed(self) -> None:
+        """Merge segments once there are many of them or tombstones outnumber live vectors."""
+        if len(self._segment_paths()) > _MAX_SEGMENTS or len(self.tombstones) > len(self):
+            self._rewrite()
+
+    # ---------------------------------------------------------------- updates
+
+    def _append(self, ids: np.ndarray, vectors: np.ndarray, lists: np.ndarray) -> None:
+        for list_no in np.unique(lists):
+            members = lists == list_no
+            current = self.list_vectors[list_no]
+            self.list_ids[list_no] = np.concatenate([self.list_ids[list_no], ids[members]])
+            self.list_vectors[list_no] = vectors[members] if not len(current) else np.concatenate([current, vectors[members]])
+
+    def _drop(self, ids: np.ndarray) -> None:
+        for list_no in range(self.nlist):
+            keep = ~np.isin(self.list_ids[list_no], ids)
+            if not keep.all():
+                self.list_ids[list_no] = self.list_ids[list_no][keep]
+                self.list_vectors[list_no] = self.list_vectors[list_no][keep]
+
+    def _train(self) -> None:
+        """(Re)cluster every stored vector, with about sqrt(n) inverted lists."""
+        ids = np.concatenate(self.list_ids)
+        vectors = np.concatenate([v for v in self.list_vectors if len(v)])
+        nlist = int(np.clip(np.sqrt(len(vectors)), 1, 4096))
+
+        # A sample of ~256 points per list is plenty to place the centroids
+        rng = np.random.default_rng(0)
+        sample_size = min(len(vectors), 256 * nlist)
+        sample = vectors[rng.choice(len(vectors), size=sample_size, replace=False)]
+        self.centroids = _spherical_kmeans(sample, nlist)
+        self.trained_size = len(vectors)
+
+        self.list_ids = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self.list_vectors = [np.empty((0, 0), dtype=np.float32) for _ in range(nlist)]
+        self._append(ids, vectors, _assign(vectors, self.centroids))
+        print(f"Trained ANN index with {nlist} lists over {len(vectors)} vectors.")
+
+    def add(self, ids: List[int], embeddings: np.ndarray) -> None:
+        """Add chunk embeddings under their chunk ids and persist them as a new segment."""
+        if not len(ids):
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+
+        with self._lock, self.file_lock():
+            self._maybe_reload(operation=None)
+            lists = _assign(vectors, self.centroids) if self.centroids is not None else np.zeros(len(ids), dtype=np.int32)
+            self._append(ids, vectors, lists)
+
+            # Train once the corpus is large enough, and retrain after it grows 4x
+            untrained_and_large = self.centroids is None and len(self) >= self.min_train_size
+            if untrained_and_large or (self.trained_size and len(self) >= 4 * self.trained_size):
+                self._train()
+                self._rewrite()
+            else:
+                self._write_segment(ids, vectors, lists)
+                self._compact_if_needed()
+            self._loaded_state = self._disk_state()
+
+    def remove(self, ids: List[int]) -> None:
+        """Remove chunk ids from the index and persist the removal."""
+        if not len(ids):
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock, self.file_lock():
+            self._maybe_reload(operation=None)
+            self._drop(ids)
+            self.tombstones = np.union1d(self.tombstones, ids)
+            self._write_tombstones()
+            self._compact_if_needed()
+            self._loaded_state = self._disk_state()
+
+    # ---------------------------------------------------------------- search
+
+    def search(self, query_embedding: np.ndarray, k: int = 10, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Return up to k (chunk_id, cosine score) pairs, best first."""
+        query = normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+        with self._lock:
+            self._maybe_reload()
+            if not len(self) or k <= 0:
+                return []
+
+            if self.centroids is None:
+                probe = [0]
+            else:
+                nprobe = min(nprobe or self.nprobe, self.nlist)
+                probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+
+            candidate_ids, candidate_scores = [], []
+            for list_no in probe:
+                if len(self.list_ids[list_no]):
+                    candidate_ids.append(self.list_ids[list_no])
+                    candidate_scores.append(self.list_vectors[list_no] @ query)
+
+        if not candidate_ids:
+            return []
+        ids = np.concatenate(candidate_ids)
+        scores = np.concatenate(candidate_scores)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+
+_ann_indexes: Dict[str, IVFFlatIndex] = {}
+_ann_indexes_lock = threading.Lock()
+
+
+def get_ann_index(path: str) -> IVFFlatIndex:
+    """Process-wide ANN index for a path, loaded from disk on first use."""
+    path = os.path.abspath(path)
+    with _ann_indexes_lock:
+        if path not in _ann_indexes:
+            _ann_indexes[path] = IVFFlatIndex(path)
+        return _ann_indexes[path]
@@ -1,50 +1,230 @@
-from openai import AsyncOpenAI
-from typing import List, Dict
+from openai import AsyncOpenAI, BadRequestError
+from typing import List, Dict, Optional, Tuple
 from dotenv import load_dotenv
 import os
 import time
 import asyncio
 from chunking import CustomChunking
+from db_executor import run_db
+from embedding_cache import EmbeddingCache
+from hedging import hedger
+from deadline import Deadline
+from config import HEDGING
+from vector_index import embeddings_to_matrix
 
 load_dotenv()
 
+# Per-input token limit of the text-embedding-3 models
+MAX_INPUT_TOKENS = 8191
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a text locally, erring on the high side.
+
+    English prose averages ~4 characters per token; contracts are dense with
+    numbers, dates and punctuation, so ~3 characters per token is used.
+    """
+    return (len(text) + 2) // 3
+
+def split_oversized_chunk(chunk: Dict, max_tokens: int = MAX_INPUT_TOKENS) -> List[Dict]:
+    """Split a chunk whose text exceeds the model's input limit into word-aligned pieces."""
+    if estimate_tokens(chunk["text"]) <= max_tokens:
+        return [chunk]
+
+    pieces, words, size = [], [], 0
+    for word in chunk["text"].split():
+        word_tokens = estimate_tokens(word + " ")
+        if words and size + word_tokens > max_tokens:
+            pieces.append(" ".join(words))
+            words, size = [], 0
+        words.append(word)
+        size += word_tokens
+    if words:
+        pieces.append(" ".join(words))
+
+    return [{**chunk, "text": piece} for piece in pieces]
+
 class AsyncEmbeddingGenerator:
-    def __init__(self, model: str = "text-embedding-3-small", batch_size: int = 15):
-        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(self, model: str = "text-embedding-3-small", batch_size: int = 64,
+                 max_batch_tokens: int = 50000, max_concurrency: int = 4, use_cache: bool = True,
+                 client: Optional[AsyncOpenAI] = None, hedging: bool = HEDGING, deadline: Optional[Deadline] = None):
+        # The app's shared client when given, so connections are reused across uploads
+        self.client = client or AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         self.model = model
+        # Embeddings of previously seen chunk text, shared across uploads
+        self.cache = EmbeddingCache() if use_cache else None
+        # Maximum number of chunks per request
         self.batch_size = batch_size
+        # Maximum estimated tokens per request
+        self.max_batch_tokens = max_batch_tokens
+        # Maximum number of embedding requests in flight at once
+        self.max_concurrency = max_concurrency
+        # How many times a rejected chunk is split in two before giving up on it
+        self.max_split_depth = 3
+        # Send a duplicate of an embeddings request that runs unusually long
+        self.hedging = hedging
+        # Upload deadline that bounds every embeddings request
+        self.deadline = deadline
+        # Chunks that could not be embedded during the last embed_chunks call
+        self.failed_chunks: List[Dict] = []
+
+    def make_batches(self, chunked_document: List[Dict]) -> List[List[Dict]]:
+        """Pack chunks, in page order, into requests bounded by token budget and item count.
 
-    async def embed_batch(self, batch: List[Dict]) -> List[Dict]:
+        Chunks longer than the model's input limit are split into several pieces
+        that keep the original page number.
+        """
+        batches, batch, batch_tokens = [], [], 0
+        for chunk in chunked_document:
+            for piece in split_oversized_chunk(chunk):
+                tokens = estimate_tokens(piece["text"])
+                if batch and (len(batch) >= self.batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                    batches.append(batch)
+                    batch, batch_tokens = [], 0
+                batch.append(piece)
+                batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def embed_batch(self, batch: List[Dict], split_depth: int = 0) -> List[Dict]:
+        """Embed a batch, isolating inputs the API rejects instead of dropping the batch.
+
+        A rejected batch is bisected and each half retried, so only the offending
+        chunk is isolated. That chunk is then split in two and re-embedded, up to
+        max_split_depth times, before it is recorded in failed_chunks.
+        """
         texts = [chunk["text"] for chunk in batch]
         try:
-            response = await self.client.embeddings.create(
+            response = await hedger.create(
+                self.client, "embeddings", hedge=self.hedging, deadline=self.deadline,
                 input=texts,
-                model=self.model
+                model=self.model,
+                encoding_format="base64"
             )
+            # Decode straight into one float32 array; each chunk gets a row view of it
+            matrix = embeddings_to_matrix(response.data)
             return [
                 {
                     "page_number": batch[i]["page_number"],
+                    "piece_index": batch[i].get("piece_index", i),
                     "chunk": batch[i]["text"],
-                    "embedding": response.data[i].embedding
+                    "embedding": matrix[i]
                 }
                 for i in range(len(batch))
             ]
+        except BadRequestError as e:
+            if len(batch) > 1:
+                mid = len(batch) // 2
+                print(f"Embedding batch of {len(batch)} rejected, retrying halves: {str(e)}")
+                left = await self.embed_batch(batch[:mid], split_depth)
+                right = await self.embed_batch(batch[mid:], split_depth)
+                return left + right
+
+            chunk = batch[0]
+            words = chunk["text"].split()
+            if len(words) < 2 or split_depth >= self.max_split_depth:
+                self._record_failure(chunk, e)
+                return []
+
+            print(f"Embedding rejected for page {chunk['page_number']}, retrying as two pieces: {str(e)}")
+            mid = len(words) // 2
+            pieces = [
+                {**chunk, "text": " ".join(words[:mid])},
+                {**chunk, "text": " ".join(words[mid:])}
+            ]
+            return await self.embed_batch(pieces, split_depth + 1)
         except Exception as e:
             print(f"Error embedding batch: {str(e)}")
+            for chunk in batch:
+                self._record_failure(chunk, e)
             return []
 
+    def _record_failure(self, chunk: Dict, error: Exception) -> None:
+        """Record a chunk that could not be embedded."""
+        print(f"Failed to embed chunk from page {chunk['page_number']}: {str(error)}")
+        self.failed_chunks.append({
+            "page_number": chunk["page_number"],
+            "text_preview": chunk["text"][:100],
+            "error": str(error)
+        })
+
     async def embed_chunks(self, chunked_document: List[Dict]) -> List[Dict]:
-        embedded_document = []
-        for i in range(0, len(chunked_document), self.batch_size):
-            batch = chunked_document[i:i + self.batch_size]
+        """Embed all chunks, dispatching batches concurrently and keeping page order."""
+        self.failed_chunks = []
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run_batch(batch: List[Dict]) -> List[Dict]:
+            async with semaphore:
+                try:
+                    return await self.embed_batch(batch)
+                except Exception as e:
+                    print(f"Error processing batch: {str(e)}")
+                    return []
+
+        # Split oversized chunks up front so cache entries match what is actually embedded;
+        # piece_index records input order, which the pieces of a split page must keep
+        pieces = [
+            {**piece, "piece_index": i}
+            for i, piece in enumerate(piece for chunk in chunked_document for piece in split_oversized_chunk(chunk))
+        ]
+        embedded_document, misses = await run_db(self._lookup_cache, pieces)
+
+        batches = self.make_batches(misses)
+        results = await asyncio.gather(*(run_batch(batch) for batch in batches))
+
+        new_embeddings = []
+        for result in results:
+            new_embeddings.extend(result)
+
+        if self.cache is not None and new_embeddings:
             try:
-                result = await self.embed_batch(batch)
-                embedded_document.extend(result)
+                await run_db(
+                    self.cache.put_many,
+                    self.model,
+                    [item["chunk"] for item in new_embeddings],
+                    [item["embedding"] for item in new_embeddings]
+                )
             except Exception as e:
-                print(f"Error processing batch: {str(e)}")
-        
+                print(f"Error writing embedding cache: {str(e)}")
+
+        if embedded_document:
+            print(f"Embedding cache: {len(embedded_document)} hits, {len(misses)} misses")
+        # Pieces a rejected chunk was re-split into share its piece_index; the stable sort keeps them in order
+        embedded_document = [
+            {key: value for key, value in item.items() if key != "piece_index"}
+            for item in sorted(embedded_document + new_embeddings,
+                               key=lambda item: (item["page_number"], item["piece_index"]))
+        ]
+
+        if self.failed_chunks:
+            failed_pages = sorted({chunk["page_number"] for chunk in self.failed_chunks})
+            print(f"Failed to embed {len(self.failed_chunks)} chunks from pages {failed_pages}")
         return embedded_document
 
+    def _lookup_cache(self, chunks: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """Split chunks into already-embedded results from the cache and chunks still to embed."""
+        if self.cache is None or not chunks:
+            return [], chunks
+
+        try:
+            cached = self.cache.get_many(self.model, [chunk["text"] for chunk in chunks])
+        except Exception as e:
+            print(f"Error reading embedding cache: {str(e)}")
+            return [], chunks
+
+        hits, misses = [], []
+        for chunk, embedding in zip(chunks, cached):
+            if embedding is None:
+                misses.append(chunk)
+            else:
+                hits.append({
+                    "page_number": chunk["page_number"],
+                    "piece_index": chunk["piece_index"],
+                    "chunk": chunk["text"],
+                    "embedding": embedding
+                })
+        return hits, misses
+
     def print_embeddings(self, embedded_document: List[Dict], num_words: int = 10, num_embedding: int = 5) -> None:
         if not embedded_document:
             print("No embeddings to display.")
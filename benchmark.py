@@ -0,0 +1,546 @@
+"""Benchmarks for the retrieval and extraction paths.
+
+Usage:
+    python benchmark.py compact [--db vector_store.db] [--queries 200] [--k 3]
+    python benchmark.py ann [--db vector_store.db] [--queries 200] [--k 10] [--size 100000]
+    python benchmark.py hybrid [--db vector_store.db] [--document-id ID] [--doc-type SOW] [--k 3]
+    python benchmark.py event-loop [--chunks 5000]
+    python benchmark.py sqlite [--documents 2000] [--fields 30] [--reads 20000] [--threads 4]
+    python benchmark.py extraction [--db vector_store.db] [--document-id ID] [--doc-type SOW]
+    python benchmark.py clients [--calls 200] [--concurrency 8] [--handshake-ms 0]
+
+The compact and ann benchmarks run on the embeddings stored in the vector store
+when it has any, and otherwise on a synthetic corpus with a similar shape. The
+hybrid benchmark needs a stored document, since BM25 works on the chunk text,
+and the extraction benchmark also calls the OpenAI API (OPENAI_API_KEY).
+The event-loop and sqlite benchmarks use throwaway databases, and the clients
+benchmark runs against a local mock of the OpenAI API.
+"""
+import os
+import json
+import time
+import asyncio
+import shutil
+import tempfile
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from typing import Callable, List, Tuple
+from ann_index import IVFFlatIndex
+from batch_embedding import estimate_tokens
+from config import FIELD_KEYWORDS, MSA_FIELDS_TO_EXTRACT, SOW_FIELDS_TO_EXTRACT
+from database_handler import DatabaseHandler
+from db_executor import run_db
+from openai import AsyncOpenAI
+from openai_clients import OpenAIClients
+from query_embedding_cache import query_embedding_cache
+from sqlite_pool import SQLitePool
+from sqlite_rag import SQLiteOpenAIRAG, field_match_query, field_queries
+from vector_index import VectorIndex, CompactVectorIndex, normalize_rows, quantize_embeddings
+
+
+def load_stored_embeddings(db_path: str) -> np.ndarray:
+    """Load every stored full-precision chunk embedding, or an empty array."""
+    if not os.path.exists(db_path):
+        return np.empty((0, 0), dtype=np.float32)
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute('SELECT embedding FROM document_chunks WHERE embedding IS NOT NULL').fetchall()
+    except sqlite3.Error:
+        rows = []
+    finally:
+        conn.close()
+    if not rows:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.stack([np.frombuffer(row[0], dtype=np.float32) for row in rows])
+
+
+def synthetic_embeddings(n: int = 20000, dim: int = 1536, rank: int = 64, seed: int = 0) -> np.ndarray:
+    """Low-rank vectors plus noise, roughly shaped like text embeddings.
+
+    Variance decays along the dimensions, as in text-embedding-3 vectors whose
+    leading components carry most of the signal.
+    """
+    rng = np.random.default_rng(seed)
+    decay = 1.0 / np.sqrt(1.0 + np.arange(dim) / 64.0)
+    basis = rng.normal(size=(rank, dim)) * decay
+    vectors = rng.normal(size=(n, rank)) @ basis + 0.5 * rng.normal(size=(n, dim)) * decay
+    return normalize_rows(vectors.astype(np.float32))
+
+
+def corpus_and_queries(db_path: str, num_queries: int, seed: int = 1) -> Tuple[np.ndarray, np.ndarray, str]:
+    """Corpus embeddings plus queries made by perturbing randomly chosen corpus rows."""
+    corpus = load_stored_embeddings(db_path)
+    source = f"{len(corpus)} stored chunks from {db_path}"
+    if len(corpus) == 0:
+        corpus = synthetic_embeddings()
+        source = f"{len(corpus)} synthetic vectors (no stored chunks in {db_path})"
+
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(corpus), size=num_queries)
+    queries = corpus[picks] + 0.05 * rng.normal(size=(num_queries, corpus.shape[1])).astype(np.float32)
+    return corpus, normalize_rows(queries), source
+
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> List[set]:
+    scores = queries @ normalize_rows(corpus).T
+    return [set(np.argsort(-row)[:k].tolist()) for row in scores]
+
+
+def recall_at_k(results: List[List[dict]], truth: List[set], k: int) -> float:
+    hits = [len({int(item["chunk"]) for item in result} & expected) for result, expected in zip(results, truth)]
+    return sum(hits) / (k * len(truth))
+
+
+def time_search(search: Callable, queries: np.ndarray, k: int) -> Tuple[List[List[dict]], float]:
+    """Run one query at a time, as retrieval does per field. Returns results and ms/query."""
+    start = time.perf_counter()
+    results = [search(query, k) for query in queries]
+    return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def benchmark_compact(db_path: str, num_queries: int, k: int) -> None:
+    """Recall and latency of compact (truncated + int8) search against exact float32 search."""
+    corpus, queries, source = corpus_and_queries(db_path, num_queries)
+    labels = [str(i) for i in range(len(corpus))]
+    pages = list(range(len(corpus)))
+    truth = exact_top_k(corpus, queries, k)
+
+    print(f"Corpus: {source}, {corpus.shape[1]} dims, {len(queries)} queries, k={k}")
+    print(f"{'mode':<28}{'index MB':>10}{'ms/query':>10}{'recall@k':>10}")
+
+    full_index = VectorIndex(labels, pages, corpus)
+    results, ms = time_search(full_index.search, queries, k)
+    print(f"{'float32 full':<28}{full_index.matrix.nbytes / 1e6:>10.1f}{ms:>10.3f}{recall_at_k(results, truth, k):>10.3f}")
+
+    # Full vectors for rescoring come from memory here, so only the scan cost is compared
+    full_loader = lambda positions: corpus[positions]
+    for dimensions in (corpus.shape[1], 512, 256):
+        if dimensions > corpus.shape[1]:
+            continue
+        codes, scales = quantize_embeddings(corpus, dimensions)
+        for rescore_factor in (1, 4, 10):
+            index = CompactVectorIndex(labels, pages, codes, scales, full_loader, rescore_factor=rescore_factor)
+            results, ms = time_search(index.search, queries, k)
+            mode = f"int8 d={dimensions} rescore x{rescore_factor}"
+            print(f"{mode:<28}{(codes.nbytes + scales.nbytes) / 1e6:>10.1f}{ms:>10.3f}{recall_at_k(results, truth, k):>10.3f}")
+
+
+def benchmark_ann(db_path: str, num_queries: int, k: int, size: int) -> None:
+    """Recall and latency of the IVF-flat corpus index against exact search, per nprobe."""
+    corpus = load_stored_embeddings(db_path)
+    source = f"{len(corpus)} stored chunks from {db_path}"
+    if len(corpus) < size:
+        # Corpus search only pays off at portfolio scale, so default to a large synthetic set
+        corpus = synthetic_embeddings(n=size)
+        source = f"{len(corpus)} synthetic vectors"
+    rng = np.random.default_rng(1)
+    picks = rng.integers(0, len(corpus), size=num_queries)
+    queries = normalize_rows(corpus[picks] + 0.05 * rng.normal(size=(num_queries, corpus.shape[1])).astype(np.float32))
+    truth = exact_top_k(corpus, queries, k)
+
+    print(f"Corpus: {source}, {corpus.shape[1]} dims, {len(queries)} queries, k={k}")
+    print(f"{'mode':<28}{'ms/query':>10}{'recall@k':>10}")
+
+    exact = VectorIndex([str(i) for i in range(len(corpus))], list(range(len(corpus))), corpus)
+    results, ms = time_search(exact.search, queries, k)
+    print(f"{'exact float32':<28}{ms:>10.3f}{recall_at_k(results, truth, k):>10.3f}")
+
+    index_dir = tempfile.mkdtemp(prefix="ann-benchmark-")
+    try:
+        start = time.perf_counter()
+        index = IVFFlatIndex(index_dir, min_train_size=min(len(corpus), 10000))
+        # Added in document-sized batches, as uploads would
+        for i in range(0, len(corpus), 5000):
+            index.add(list(range(i, min(i + 5000, len(corpus)))), corpus[i:i + 5000])
+        print(f"Built {index.nlist}-list index in {time.perf_counter() - start:.1f}s")
+
+        for nprobe in (1, 4, 16, 64):
+            search = lambda query, k: [{"chunk": chunk_id} for chunk_id, _ in index.search(query, k, nprobe=nprobe)]
+            results, ms = time_search(search, queries, k)
+            print(f"{f'ivf-flat nprobe={nprobe}':<28}{ms:>10.3f}{recall_at_k(results, truth, k):>10.3f}")
+    finally:
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+
+def embed_benchmark_queries(queries: List[str]) -> dict:
+    """Embeddings for queries, from the static query cache or else from the API."""
+    query_embedding_cache.load()
+    embeddings = {query: query_embedding_cache.get(query) for query in queries}
+    missing = [query for query, embedding in embeddings.items() if embedding is None]
+    if missing:
+        from openai import OpenAI
+        from vector_index import embeddings_to_matrix
+        response = OpenAI().embeddings.create(input=missing, model="text-embedding-3-small", encoding_format="base64")
+        embeddings.update(zip(missing, embeddings_to_matrix(response.data)))
+    return embeddings
+
+
+def benchmark_hybrid(db_path: str, document_id: str, doc_type: str, k: int) -> None:
+    """Dense-only against hybrid (BM25-pruned, rank-fused) retrieval for every field of a document.
+
+    "keyword hit" only checks that a field's FIELD_KEYWORDS appear in its retrieved
+    chunks, which BM25 ensures by construction in hybrid mode. It is a sanity check,
+    not a recall measure; that needs chunks labelled with the true field values.
+    """
+    handler = DatabaseHandler(db_path)
+    document_id = document_id or handler.get_latest_document_id()
+    if not document_id:
+        print(f"No stored documents in {db_path}; upload a contract first.")
+        return
+    document_chunks = handler.get_chunks_count(document_id)
+    fields = MSA_FIELDS_TO_EXTRACT if doc_type == "MSA" else SOW_FIELDS_TO_EXTRACT
+    all_queries = list(dict.fromkeys(query for field in fields for query in field_queries(field, doc_type, "dense")))
+    embeddings = embed_benchmark_queries(all_queries)
+
+    print(f"Document {document_id[:12]} ({document_chunks} chunks), {doc_type}, k={k}")
+    print(f"{'mode':<8}{'queries':>9}{'scored':>9}{'ctx tokens':>12}{'ms':>9}{'keyword hit':>13}")
+    for mode in ("dense", "hybrid"):
+        queries = [(field, query) for field in fields for query in field_queries(field, doc_type, mode)]
+        match_queries = [field_match_query(field, mode) for field, _ in queries]
+
+        start = time.perf_counter()
+        hybrid = [i for i, match_query in enumerate(match_queries) if match_query]
+        dense = [i for i, match_query in enumerate(match_queries) if not match_query]
+        results = [None] * len(queries)
+        for i, chunks in zip(dense, handler.search([embeddings[queries[i][1]] for i in dense], k, document_id)):
+            results[i] = chunks
+        if hybrid:
+            hybrid_results = handler.hybrid_search(
+                [embeddings[queries[i][1]] for i in hybrid], [match_queries[i] for i in hybrid], k, document_id
+            )
+            for i, chunks in zip(hybrid, hybrid_results):
+                results[i] = chunks
+        ms = (time.perf_counter() - start) * 1000
+
+        # Chunks scored: the whole document per dense query, the BM25 candidates per hybrid query
+        scored = len(dense) * document_chunks + sum(
+            len(handler.lexical_search(match_queries[i], document_id=document_id)) for i in hybrid
+        )
+
+        context_tokens, hits, keyword_fields = 0, 0, 0
+        for field in fields:
+            field_chunks = {chunk["chunk"] for (f, _), chunks in zip(queries, results) if f == field for chunk in chunks}
+            context_tokens += sum(estimate_tokens(chunk) for chunk in field_chunks)
+            if field in FIELD_KEYWORDS:
+                keyword_fields += 1
+                text = " ".join(field_chunks).lower()
+                hits += any(keyword.lower() in text for keyword in FIELD_KEYWORDS[field])
+
+        hit_rate = f"{hits}/{keyword_fields}"
+        print(f"{mode:<8}{len(queries):>9}{scored:>9}{context_tokens:>12}{ms:>9.1f}{hit_rate:>13}")
+
+
+async def measure_event_loop(handler: DatabaseHandler, chunked_docs: List[dict], use_executor: bool) -> Tuple[List[float], List[float]]:
+    """Loop lag and small-request latency (ms) while a large upload is stored and searched."""
+    done = asyncio.Event()
+    lags, request_times = [], []
+
+    async def probe():
+        # A 5 ms sleep that wakes up late means the loop was blocked
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append((time.perf_counter() - start) * 1000 - 5)
+
+    async def small_requests():
+        # Stands in for concurrent /documents calls arriving every 10 ms; latency counts
+        # from arrival, so time spent waiting for a blocked loop is included
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            if use_executor:
+                await run_db(handler.list_documents)
+            else:
+                handler.list_documents()
+            request_times.append((time.perf_counter() - start) * 1000 - 10)
+
+    async def upload():
+        await asyncio.sleep(0.05)
+        queries = [doc["embedding"] for doc in chunked_docs[:64]]
+        if use_executor:
+            await run_db(handler.replace_document, "benchmark", chunked_docs, file_name="benchmark.pdf")
+            await run_db(handler.search, queries, 3, "benchmark")
+        else:
+            handler.replace_document("benchmark", chunked_docs, file_name="benchmark.pdf")
+            handler.search(queries, 3, "benchmark")
+        await asyncio.sleep(0.05)
+        done.set()
+
+    await asyncio.gather(probe(), small_requests(), upload())
+    return lags, request_times
+
+
+def benchmark_event_loop(num_chunks: int) -> None:
+    """Event-loop responsiveness during a large upload, with blocking calls vs the DB executor.
+
+    This is the latency check for the DB executor: with it, the max request time
+    should stay near the probe's 5 ms instead of growing with the upload.
+    """
+    embeddings = synthetic_embeddings(n=num_chunks)
+    chunked_docs = [
+        {"chunk": f"chunk {i} " * 50, "page_number": i, "embedding": embedding}
+        for i, embedding in enumerate(embeddings)
+    ]
+    print(f"Storing and searching {num_chunks} chunks while probing the event loop")
+    print(f"{'mode':<16}{'max lag ms':>12}{'p99 lag ms':>12}{'max request ms':>16}")
+
+    for use_executor in (False, True):
+        with tempfile.TemporaryDirectory(prefix="loop-benchmark-") as tmp_dir:
+            handler = DatabaseHandler(os.path.join(tmp_dir, "vector_store.db"))
+            lags, request_times = asyncio.run(measure_event_loop(handler, chunked_docs, use_executor))
+        mode = "DB executor" if use_executor else "blocking"
+        print(f"{mode:<16}{max(lags):>12.1f}{np.percentile(lags, 99):>12.1f}{max(request_times):>16.1f}")
+
+
+_RESULTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        db_id INTEGER NOT NULL,
+        field_name TEXT NOT NULL,
+        field_value TEXT,
+        confidence REAL
+    )"""
+_INSERT_RESULT = 'INSERT INTO results (db_id, field_name, field_value, confidence) VALUES (?, ?, ?, ?)'
+_SELECT_RESULTS = 'SELECT field_name, field_value, confidence FROM results WHERE db_id = ?'
+
+
+def result_rows(db_id: int, num_fields: int) -> List[tuple]:
+    return [(db_id, f"field_{i}", f"value {i} of document {db_id}" * 4, 0.9) for i in range(num_fields)]
+
+
+def sqlite_baseline(db_path: str, num_documents: int, num_fields: int, num_reads: int, threads: int) -> Tuple[float, float]:
+    """A new connection per call with default pragmas and one execute per row."""
+    conn = sqlite3.connect(db_path)
+    conn.execute(_RESULTS_TABLE)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_results_db_id ON results (db_id)')
+    conn.commit()
+    conn.close()
+
+    start = time.perf_counter()
+    for db_id in range(num_documents):
+        conn = sqlite3.connect(db_path)
+        for row in result_rows(db_id, num_fields):
+            conn.execute(_INSERT_RESULT, row)
+        conn.commit()
+        conn.close()
+    write_seconds = time.perf_counter() - start
+
+    def read(db_id: int) -> None:
+        conn = sqlite3.connect(db_path)
+        conn.execute(_SELECT_RESULTS, (db_id % num_documents,)).fetchall()
+        conn.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(read, range(num_reads)))
+    return write_seconds, time.perf_counter() - start
+
+
+def sqlite_pooled(db_path: str, num_documents: int, num_fields: int, num_reads: int, threads: int) -> Tuple[float, float]:
+    """Pooled per-thread connections with tuned pragmas, executemany and a prepared read."""
+    pool = SQLitePool(db_path)
+    with pool.transaction() as conn:
+        conn.execute(_RESULTS_TABLE)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_results_db_id ON results (db_id)')
+
+    start = time.perf_counter()
+    for db_id in range(num_documents):
+        with pool.transaction() as conn:
+            conn.executemany(_INSERT_RESULT, result_rows(db_id, num_fields))
+    write_seconds = time.perf_counter() - start
+
+    select_results = pool.prepare(_SELECT_RESULTS)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda db_id: select_results.fetchall((db_id % num_documents,)), range(num_reads)))
+    read_seconds = time.perf_counter() - start
+    pool.close_all()
+    return write_seconds, read_seconds
+
+
+def benchmark_sqlite(num_documents: int, num_fields: int, num_reads: int, threads: int) -> None:
+    """Write and read throughput of per-call connections vs the pooled, tuned connections."""
+    print(f"Writing {num_documents} documents x {num_fields} fields, then {num_reads} lookups on {threads} threads")
+    print(f"{'mode':<12}{'rows/s written':>16}{'queries/s read':>16}")
+    for name, run in (("baseline", sqlite_baseline), ("pooled", sqlite_pooled)):
+        with tempfile.TemporaryDirectory(prefix="sqlite-benchmark-") as tmp_dir:
+            write_seconds, read_seconds = run(os.path.join(tmp_dir, "results.db"), num_documents, num_fields, num_reads, threads)
+        print(f"{name:<12}{num_documents * num_fields / write_seconds:>16.0f}{num_reads / read_seconds:>16.0f}")
+
+
+def benchmark_extraction(db_path: str, document_id: str, doc_type: str) -> None:
+    """Per-field (with and without the model cascade), grouped and prefix-cached extraction of a stored document."""
+    handler = DatabaseHandler(db_path)
+    document_id = document_id or handler.get_latest_document_id()
+    if not document_id:
+        print(f"No stored documents in {db_path}; upload a contract first.")
+        return
+
+    print(f"Document {document_id[:12]}, {doc_type}")
+    rows, values = [], {}
+    cascade_summary = ""
+    for mode in ("per_field", "cascade", "grouped", "cached_prefix"):
+        # LLM cache and pre-extraction are off so every mode makes its own calls
+        rag = SQLiteOpenAIRAG(db_path, document_id=document_id, extraction_mode="per_field" if mode == "cascade" else mode,
+                              use_llm_cache=False, pre_extraction=False, cascade=mode == "cascade")
+        start = time.perf_counter()
+        results = asyncio.run(rag.extract_all_fields(doc_type))
+        seconds = time.perf_counter() - start
+        values[mode] = {result["field"]: str(result["value"]["field_value"]) for result in results}
+        if mode == "cascade":
+            cascade_summary = rag.cascade_summary()
+        usage = rag.usage
+        rows.append((mode, usage["calls"], usage["prompt_tokens"], usage["cached_tokens"], usage["completion_tokens"], seconds))
+
+    print(f"{'mode':<15}{'calls':>7}{'prompt tokens':>15}{'cached':>9}{'output tokens':>15}{'seconds':>9}")
+    for mode, calls, prompt_tokens, cached_tokens, completion_tokens, seconds in rows:
+        print(f"{mode:<15}{calls:>7}{prompt_tokens:>15}{cached_tokens:>9}{completion_tokens:>15}{seconds:>9.1f}")
+    print(f"Model cascade:\n{cascade_summary}")
+    for mode in ("cascade", "grouped", "cached_prefix"):
+        agreeing = sum(values["per_field"][field] == values[mode].get(field) for field in values["per_field"])
+        print(f"Fields with the same value in per_field and {mode}: {agreeing}/{len(values['per_field'])}")
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    """Answers every POST with a fixed embeddings response over keep-alive HTTP/1.1."""
+    protocol_version = "HTTP/1.1"
+    body = json.dumps({
+        "object": "list",
+        "data": [{"object": "embedding", "index": 0, "embedding": [0.0] * 8}],
+        "model": "text-embedding-3-small",
+        "usage": {"prompt_tokens": 1, "total_tokens": 1}
+    }).encode()
+
+    def setup(self):
+        # Once per TCP connection; the delay stands in for the TLS handshake of the real API
+        super().setup()
+        self.server.connections += 1
+        time.sleep(self.server.handshake_seconds)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+async def measure_clients(base_url: str, num_calls: int, concurrency: int, shared: bool) -> List[float]:
+    """Latency (ms) of embedding calls with a new client per call vs one shared client pool."""
+    clients = OpenAIClients(api_key="benchmark", base_url=base_url, max_retries=0) if shared else None
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def call():
+        async with semaphore:
+            start = time.perf_counter()
+            if shared:
+                await clients.async_client.embeddings.create(input="x", model="text-embedding-3-small")
+            else:
+                # What each request did before: build a client, call, and close it
+                client = AsyncOpenAI(api_key="benchmark", base_url=base_url, max_retries=0)
+                try:
+                    await client.embeddings.create(input="x", model="text-embedding-3-small")
+                finally:
+                    await client.close()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    try:
+        await asyncio.gather(*(call() for _ in range(num_calls)))
+    finally:
+        if clients:
+            await clients.aclose()
+    return latencies
+
+
+def benchmark_clients(num_calls: int, concurrency: int, handshake_ms: float) -> None:
+    """Per-call overhead of a new OpenAI client per call vs the shared keep-alive pool."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockOpenAIHandler)
+    server.daemon_threads = True
+    server.handshake_seconds = handshake_ms / 1000
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    print(f"{num_calls} embedding calls, {concurrency} concurrent, {handshake_ms} ms simulated handshake")
+    print(f"{'mode':<16}{'p50 ms':>9}{'p99 ms':>9}{'calls/s':>10}{'connections':>13}")
+
+    try:
+        for shared in (False, True):
+            server.connections = 0
+            start = time.perf_counter()
+            latencies = asyncio.run(measure_clients(base_url, num_calls, concurrency, shared))
+            seconds = time.perf_counter() - start
+            mode = "shared pool" if shared else "client per call"
+            print(f"{mode:<16}{np.percentile(latencies, 50):>9.2f}{np.percentile(latencies, 99):>9.2f}"
+                  f"{num_calls / seconds:>10.0f}{server.connections:>13}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    compact = subparsers.add_parser("compact", help="compact vector storage: recall vs speed")
+    compact.add_argument("--db", default="vector_store.db")
+    compact.add_argument("--queries", type=int, default=200)
+    compact.add_argument("--k", type=int, default=3)
+
+    ann = subparsers.add_parser("ann", help="corpus-wide ANN index: recall vs speed")
+    ann.add_argument("--db", default="vector_store.db")
+    ann.add_argument("--queries", type=int, default=200)
+    ann.add_argument("--k", type=int, default=10)
+    ann.add_argument("--size", type=int, default=100000, help="synthetic corpus size when the store is smaller")
+
+    hybrid = subparsers.add_parser("hybrid", help="hybrid BM25 + dense retrieval vs dense only")
+    hybrid.add_argument("--db", default="vector_store.db")
+    hybrid.add_argument("--document-id", default=None, help="defaults to the latest stored document")
+    hybrid.add_argument("--doc-type", default="SOW", choices=["SOW", "MSA"])
+    hybrid.add_argument("--k", type=int, default=3)
+
+    event_loop = subparsers.add_parser("event-loop", help="request latency during a large upload")
+    event_loop.add_argument("--chunks", type=int, default=5000)
+
+    sqlite = subparsers.add_parser("sqlite", help="SQLite write and read throughput, per-call vs pooled connections")
+    sqlite.add_argument("--documents", type=int, default=2000)
+    sqlite.add_argument("--fields", type=int, default=30)
+    sqlite.add_argument("--reads", type=int, default=20000)
+    sqlite.add_argument("--threads", type=int, default=4)
+
+    extraction = subparsers.add_parser("extraction", help="per-field vs cascade vs grouped vs prefix-cached LLM extraction")
+    extraction.add_argument("--db", default="vector_store.db")
+    extraction.add_argument("--document-id", default=None, help="defaults to the latest stored document")
+    extraction.add_argument("--doc-type", default="SOW", choices=["SOW", "MSA"])
+
+    clients = subparsers.add_parser("clients", help="OpenAI call overhead, client per call vs shared keep-alive pool")
+    clients.add_argument("--calls", type=int, default=200)
+    clients.add_argument("--concurrency", type=int, default=8)
+    clients.add_argument("--handshake-ms", type=float, default=0.0, help="delay per new connection, standing in for TLS")
+
+    args = parser.parse_args()
+    if args.benchmark == "compact":
+        benchmark_compact(args.db, args.queries, args.k)
+    elif args.benchmark == "ann":
+        benchmark_ann(args.db, args.queries, args.k, args.size)
+    elif args.benchmark == "hybrid":
+        benchmark_hybrid(args.db, args.document_id, args.doc_type, args.k)
+    elif args.benchmark == "event-loop":
+        benchmark_event_loop(args.chunks)
+    elif args.benchmark == "sqlite":
+        benchmark_sqlite(args.documents, args.fields, args.reads, args.threads)
+    elif args.benchmark == "extraction":
+        benchmark_extraction(args.db, args.document_id, args.doc_type)
+    elif args.benchmark == "clients":
+        benchmark_clients(args.calls, args.concurrency, args.handshake_ms)
+
+
+if __name__ == "__main__":
+    main()
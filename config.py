@@ -1,3 +1,46 @@
+import os
+
+# Upper bound on the memory used by cached per-document vector indexes
+VECTOR_INDEX_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Precomputed embeddings of the static SOW/MSA queries below
+QUERY_EMBEDDING_CACHE_PATH = "query_embeddings.npz"
+
+# Chunk embeddings reused across uploads (~6 KB per entry)
+EMBEDDING_CACHE_PATH = "embedding_cache.db"
+EMBEDDING_CACHE_MAX_ENTRIES = 50000
+EMBEDDING_CACHE_MAX_AGE_DAYS = 90
+
+# Parsed field-extraction results reused when the same prompt is sent again.
+# Bump EXTRACTION_PROMPT_VERSION whenever the extraction prompts change.
+LLM_CACHE_PATH = "llm_cache.db"
+LLM_CACHE_MAX_ENTRIES = 20000
+LLM_CACHE_MAX_AGE_DAYS = 30
+EXTRACTION_PROMPT_VERSION = 1
+
+# Opt-in compact vector storage: truncated dimensions, int8 codes, exact rescoring
+COMPACT_VECTOR_STORAGE = False
+COMPACT_VECTOR_DIMENSIONS = 512
+COMPACT_VECTOR_RESCORE_FACTOR = 4
+
+# Corpus-wide approximate nearest-neighbour (IVF-flat) index across all documents
+ANN_MIN_TRAIN_SIZE = 10000
+ANN_NPROBE = 32
+
+# Threads for blocking SQLite I/O and vector scoring called from async code
+DB_EXECUTOR_MAX_WORKERS = 4
+
+# Pragmas for the pooled SQLite connections of every database
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_CACHE_SIZE_KB = 64 * 1024
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+# Memory-mapped embedding matrix beside the vector store, shared by all uvicorn workers
+EMBEDDING_SIDECAR = True
+
+# Directory (e.g. a mounted bucket) holding a vector store snapshot to restore at startup
+VECTOR_STORE_SNAPSHOT_DIR = os.getenv("VECTOR_STORE_SNAPSHOT_DIR")
+
 SOW_QUERIES = {
     "client_company_name": [
         "Identify the name of the client company or recipient of services in the contract. The service provider is Next Wealth, so the other party is the client.",
@@ -173,3 +216,109 @@ MSA_POINTS_TO_REMEMBER = {
     "data_processing_agreement": "1. Verify if GDPR/compliance appendix exists\n2. Look for references to Exhibit/Attachment containing DPA\n 3. Just return 'Yes' or 'No' "
 }
 
+
+# Resolve sow_no, po_number, amendment_no, currency, credit_period and the dates by
+# pattern matching (pre_extractors.py) when the document states them unambiguously
+PRE_EXTRACTION = True
+# Minimum confidence for a pre-extracted value to be used; values whose matches
+# disagree come back below it and are extracted by the LLM instead
+PRE_EXTRACTION_MIN_CONFIDENCE = 7
+
+# Retrieval mode for extraction: "dense" (embeddings only) or "hybrid" (FTS5 BM25 +
+# embeddings). Hybrid is opt-in until it is compared against dense retrieval on
+# labelled chunks; benchmark.py hybrid measures cost, not recall.
+RETRIEVAL_MODE = "dense"
+HYBRID_BM25_CANDIDATES = 30
+HYBRID_RRF_K = 60
+
+# Literal labels for fields that dense retrieval ranks poorly. In hybrid mode these
+# fields embed only their first query and take BM25 candidates matching any label.
+FIELD_KEYWORDS = {
+    "sow_no": ["SOW No", "SOW Number", "SOW #", "Statement of Work No", "Statement of Work Number"],
+    "po_number": ["PO Number", "PO No", "PO #", "Purchase Order", "Purchase Order Number"],
+    "amendment_no": ["Amendment No", "Amendment Number", "Amendment #"],
+    "currency": ["USD", "INR", "US Dollars", "Indian Rupees"],
+    "inclusive_or_exclusive_gst": ["GST", "Goods and Services Tax", "exclusive of taxes", "inclusive of taxes"],
+    "cola": ["COLA", "Cost of Living Adjustment", "escalation"],
+    "credit_period": ["payment terms", "Net 30", "Net 45", "Net 60", "days from the date of invoice"]
+}
+
+# Extraction mode: "per_field" (one LLM call per field), "grouped" (fields whose
+# retrieved chunks overlap are extracted together, one call per group) or
+# "cached_prefix" (one call per field over a shared document context that the
+# provider's prompt cache serves after the first call)
+EXTRACTION_MODE = "per_field"
+# Share of a field's chunks that must already be in a group for the field to join it
+EXTRACTION_GROUP_MIN_OVERLAP = 0.5
+EXTRACTION_GROUP_MAX_FIELDS = 6
+
+# Model cascade for per-field extraction: a field is tried on its first tier and
+# moves to the next while its confidence is below its threshold. max_chunks caps
+# the retrieved chunks sent to a tier (None sends all of them).
+MODEL_CASCADE = False
+CASCADE_TIERS = {
+    "default": [
+        {"model": "gpt-4o-mini", "max_chunks": 3},
+        {"model": "gpt-4o-mini", "max_chunks": None},
+        {"model": "gpt-4o", "max_chunks": None}
+    ],
+    # Nested schemas need the whole context from the start
+    "insurance_required": [
+        {"model": "gpt-4o-mini", "max_chunks": None},
+        {"model": "gpt-4o", "max_chunks": None}
+    ],
+    "billing_unit_type_and_rate_cost": [
+        {"model": "gpt-4o-mini", "max_chunks": None},
+        {"model": "gpt-4o", "max_chunks": None}
+    ],
+    "particular_role_rate": [
+        {"model": "gpt-4o-mini", "max_chunks": None},
+        {"model": "gpt-4o", "max_chunks": None}
+    ]
+}
+CASCADE_CONFIDENCE_THRESHOLDS = {
+    "default": 7,
+    "sow_value": 8,
+    "insurance_required": 8,
+    "limitation_of_liability": 8
+}
+
+# Process-wide OpenAI scheduler (openai_scheduler.py). The per-minute limits are
+# starting points per model; the x-ratelimit-* response headers replace them.
+OPENAI_REQUESTS_PER_MINUTE = 5000
+OPENAI_TOKENS_PER_MINUTE = 2000000
+OPENAI_INITIAL_CONCURRENCY = 16
+OPENAI_MAX_CONCURRENCY = 64
+OPENAI_MIN_CONCURRENCY = 2
+OPENAI_MAX_RETRIES = 3
+# Output tokens assumed for a chat completion when reserving token budget
+OPENAI_COMPLETION_TOKEN_ESTIMATE = 500
+
+# Shared OpenAI HTTP clients (openai_clients.py). Keep-alive connections cover the
+# scheduler's maximum concurrency so admitted calls rarely open a new connection.
+OPENAI_MAX_CONNECTIONS = 100
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = OPENAI_MAX_CONCURRENCY
+OPENAI_KEEPALIVE_EXPIRY = 30.0
+OPENAI_TIMEOUT = 60.0
+OPENAI_CONNECT_TIMEOUT = 10.0
+# Multiplex requests over HTTP/2 connections; needs the h2 package (httpx[http2])
+OPENAI_HTTP2 = False
+
+# Hedged OpenAI requests (hedging.py): a call still running at the HEDGE_PERCENTILE
+# latency of its endpoint gets a duplicate, and the first response wins. Each call
+# earns HEDGE_BUDGET extra calls, banked up to HEDGE_MAX_BURST.
+HEDGING = False
+HEDGE_PERCENTILE = 95
+HEDGE_BUDGET = 0.05
+HEDGE_MAX_BURST = 5
+# Latencies kept per endpoint, and how many are needed before hedging starts
+HEDGE_WINDOW = 500
+HEDGE_MIN_SAMPLES = 20
+
+# Per-upload deadlines. /upload answers within UPLOAD_RESPONSE_DEADLINE_SECONDS with
+# the fields done by then; the rest keep running in the background until
+# UPLOAD_JOB_DEADLINE_SECONDS after the upload and are then cancelled.
+UPLOAD_RESPONSE_DEADLINE_SECONDS = 45.0
+UPLOAD_JOB_DEADLINE_SECONDS = 300.0
+# Finished upload jobs kept in the results database for GET /upload/{job_id}/pending
+UPLOAD_JOBS_MAX = 200
@@ -1,107 +1,569 @@
+import os
+import glob
+import shutil
+import hashlib
 import sqlite3
 import numpy as np
-from typing import List, Dict
+from contextlib import nullcontext
+from typing import List, Dict, Optional
+from ann_index import IVFFlatIndex, get_ann_index
+from db_executor import run_db
+from embedding_sidecar import EmbeddingSidecar
+from openai_scheduler import BULK
+from hedging import hedger
+from sqlite_pool import get_pool
+from query_embedding_cache import query_embedding_cache
+from vector_index import (
+    VectorIndex,
+    embeddings_to_matrix,
+    normalize_rows,
+    get_vector_index,
+    index_cache_key,
+    load_compact_vector_index,
+    load_vector_index,
+    quantize_embeddings,
+    vector_index_cache
+)
+from config import (
+    COMPACT_VECTOR_STORAGE,
+    COMPACT_VECTOR_DIMENSIONS,
+    EMBEDDING_SIDECAR,
+    HYBRID_BM25_CANDIDATES,
+    HYBRID_RRF_K
+)
 
 class DatabaseHandler:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, compact: bool = COMPACT_VECTOR_STORAGE, compact_dimensions: int = COMPACT_VECTOR_DIMENSIONS,
+                 sidecar: bool = EMBEDDING_SIDECAR):
         self.db_path = db_path
+        # Compact mode also stores truncated int8 codes and searches on them
+        self.compact = compact
+        self.compact_dimensions = compact_dimensions
+        # Corpus-wide ANN index, kept in a directory beside the SQLite file
+        self.ann_index_path = f"{os.path.splitext(db_path)[0]}.ann"
+        self.pool = get_pool(db_path)
         self._init_db()
+        # Run for every field of every upload, so they are kept compiled per connection
+        self._lexical_search = self.pool.prepare('''
+            SELECT rowid FROM document_chunks_fts WHERE document_chunks_fts MATCH ?
+            ORDER BY bm25(document_chunks_fts) LIMIT ?''')
+        self._lexical_search_document = self.pool.prepare('''
+            SELECT f.rowid FROM document_chunks_fts f JOIN document_chunks dc ON dc.id = f.rowid
+            WHERE document_chunks_fts MATCH ? AND dc.document_id = ?
+            ORDER BY bm25(document_chunks_fts) LIMIT ?''')
+        # Full-precision search reads a memory-mapped matrix shared by all worker processes
+        self.sidecar = EmbeddingSidecar(db_path) if sidecar and not compact else None
+        if self.sidecar:
+            self.sidecar.sync()
     
     def _init_db(self):
         """Initialize SQLite database with necessary tables."""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        
-        # Drop the table if it exists, Every time we start with a fresh database
-        c.execute('DROP TABLE IF EXISTS document_chunks')
-        
-        # Create a new empty table for document chunks
+        with self.pool.transaction() as conn:
+            self._create_schema(conn.cursor())
+
+    def _create_schema(self, c: sqlite3.Cursor) -> None:
+        # Older stores held a single document without a document_id and were wiped on
+        # every startup; drop such a table so it is recreated with the current layout
+        c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'document_chunks'")
+        if c.fetchone():
+            columns = [row[1] for row in c.execute('PRAGMA table_info(document_chunks)')]
+            if 'document_id' not in columns:
+                c.execute('DROP TABLE document_chunks')
+
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS documents (
+                document_id TEXT PRIMARY KEY,
+                file_name TEXT,
+                doc_type TEXT,
+                chunk_count INTEGER NOT NULL DEFAULT 0,
+                complete INTEGER NOT NULL DEFAULT 1,
+                created_at DATETIME DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+                updated_at DATETIME DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+            )''')
+
+        # complete is 0 when some chunks failed to embed, so the next upload re-embeds the file
+        columns = [row[1] for row in c.execute('PRAGMA table_info(documents)')]
+        if 'complete' not in columns:
+            c.execute('ALTER TABLE documents ADD COLUMN complete INTEGER NOT NULL DEFAULT 1')
+
         c.execute('''
-            CREATE TABLE document_chunks (
+            CREATE TABLE IF NOT EXISTS document_chunks (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                document_id TEXT NOT NULL,
                 chunk TEXT NOT NULL,
                 page_number INTEGER NOT NULL,
-                embedding BLOB
+                embedding BLOB,
+                embedding_q BLOB,
+                embedding_scale REAL,
+                sidecar_row INTEGER
             )''')
-        
-        conn.commit()
-        conn.close()
-    
-    def store_chunked_docs(self, chunked_docs: List[Dict]) -> None:
-        """Store document chunks and their embeddings in SQLite."""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        
-        for doc in chunked_docs:
-            embedding_bytes = np.array(doc["embedding"], dtype=np.float32).tobytes()
-            c.execute(
-                'INSERT INTO document_chunks (chunk, page_number, embedding) VALUES (?, ?, ?)',
-                (doc["chunk"], doc["page_number"], embedding_bytes)
+        columns = [row[1] for row in c.execute('PRAGMA table_info(document_chunks)')]
+        if 'sidecar_row' not in columns:
+            c.execute('ALTER TABLE document_chunks ADD COLUMN sidecar_row INTEGER')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_document_chunks_document_id ON document_chunks (document_id, page_number)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_document_chunks_sidecar_row ON document_chunks (sidecar_row)')
+
+        # store_version is bumped on every write so other worker processes can tell
+        # their cached indexes are stale; the embedding sidecar keeps its state here too
+        c.execute('CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value)')
+        c.execute("INSERT OR IGNORE INTO store_meta (key, value) VALUES ('store_version', 0)")
+
+        # Lexical (BM25) index over chunk text, kept in step with document_chunks by triggers
+        c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'document_chunks_fts'")
+        fts_exists = c.fetchone() is not None
+        c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS document_chunks_fts
+            USING fts5(chunk, content='document_chunks', content_rowid='id')''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS document_chunks_fts_insert AFTER INSERT ON document_chunks BEGIN
+                INSERT INTO document_chunks_fts (rowid, chunk) VALUES (new.id, new.chunk);
+            END''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS document_chunks_fts_delete AFTER DELETE ON document_chunks BEGIN
+                INSERT INTO document_chunks_fts (document_chunks_fts, rowid, chunk) VALUES ('delete', old.id, old.chunk);
+            END''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS document_chunks_fts_update AFTER UPDATE OF chunk ON document_chunks BEGIN
+                INSERT INTO document_chunks_fts (document_chunks_fts, rowid, chunk) VALUES ('delete', old.id, old.chunk);
+                INSERT INTO document_chunks_fts (rowid, chunk) VALUES (new.id, new.chunk);
+            END''')
+        if not fts_exists:
+            # Index chunks stored before the lexical index existed
+            c.execute("INSERT INTO document_chunks_fts (document_chunks_fts) VALUES ('rebuild')")
+
+    @staticmethod
+    def compute_document_id(file_bytes: bytes) -> str:
+        """Content-addressed document id, so re-uploading the same file reuses its vectors."""
+        return hashlib.sha256(file_bytes).hexdigest()
+
+    def _index_cache_key(self, document_id: Optional[str]) -> str:
+        return index_cache_key(self.db_path, document_id, self.compact, "sidecar" if self.sidecar else "")
+
+    def _invalidate_index(self, document_id: Optional[str]) -> None:
+        """Drop the cached indexes of a document and of the whole store, in every storage form."""
+        for compact, variant in ((False, ""), (True, ""), (False, "sidecar")):
+            vector_index_cache.invalidate(index_cache_key(self.db_path, document_id, compact, variant))
+            vector_index_cache.invalidate(index_cache_key(self.db_path, None, compact, variant))
+
+    def _index_version(self, document_id: Optional[str]) -> Optional[str]:
+        """Version token of a document's index (or the whole store's), changed by any worker's writes."""
+        store_version, generation, updated_at = self.pool.fetchone('''
+            SELECT (SELECT value FROM store_meta WHERE key = 'store_version'),
+                   (SELECT value FROM store_meta WHERE key = 'sidecar_generation'),
+                   (SELECT updated_at FROM documents WHERE document_id = ?)''', (document_id,))
+        if document_id is None:
+            return str(store_version)
+        return f"{updated_at}:{generation}"
+
+    def get_vector_index(self, document_id: Optional[str] = None):
+        """Get the in-memory vector index of a document (or of every document for None)."""
+        version = self._index_version(document_id)
+        if self.sidecar:
+            return vector_index_cache.get_or_load(
+                self._index_cache_key(document_id),
+                lambda: self.sidecar.load_index(document_id),
+                version
             )
-        
-        conn.commit()
-        conn.close()
-        print(f"Stored {len(chunked_docs)} chunks in SQLite database.")
-
-    def _cosine_similarity(self, query_embedding: List[float], doc_embedding: np.ndarray) -> float:
-        """Calculate cosine similarity between query and document embeddings."""
-        a = np.array(query_embedding)
-        b = doc_embedding
-        return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-    
-    def get_chunks_count(self) -> int:
-        """Get the number of chunks in the database."""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute('SELECT COUNT(*) FROM document_chunks')
-        count = c.fetchone()[0]
-        conn.close()
-        return count
-
-    async def get_relevant_chunks(self, query: str, k: int = 3, async_client=None) -> List[Dict]:
-        """Get top-k relevant chunks for a query using cosine similarity."""
-        # Get query embedding
-        try:
-            query_embedding = await async_client.embeddings.create(
-                input=query,
-                model="text-embedding-3-small"
+        return get_vector_index(self.db_path, document_id, self.compact, version)
+
+    def get_ann_index(self) -> IVFFlatIndex:
+        """Get the corpus-wide ANN index, building it from stored chunks if it is missing."""
+        index = get_ann_index(self.ann_index_path)
+        if len(index) == 0 and self.get_chunks_count() > 0:
+            rows = self.pool.fetchall('SELECT id, embedding FROM document_chunks WHERE embedding IS NOT NULL')
+            print(f"Building ANN index from {len(rows)} stored chunks...")
+            index.add([row[0] for row in rows], np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows]))
+        return index
+
+    def _document_chunk_ids(self, c: sqlite3.Cursor, document_id: str) -> List[int]:
+        c.execute('SELECT id FROM document_chunks WHERE document_id = ? ORDER BY id', (document_id,))
+        return [row[0] for row in c.fetchall()]
+
+    def has_document(self, document_id: str) -> bool:
+        """Check whether a document's chunks are already stored."""
+        row = self.pool.fetchone('SELECT chunk_count FROM documents WHERE document_id = ?', (document_id,))
+        return bool(row and row[0] > 0)
+
+    def has_complete_document(self, document_id: str) -> bool:
+        """Check whether a document is stored with every chunk embedded, so its vectors can be reused."""
+        row = self.pool.fetchone('SELECT chunk_count, complete FROM documents WHERE document_id = ?', (document_id,))
+        return bool(row and row[0] > 0 and row[1])
+
+    def get_document_chunks(self, document_id: str) -> List[Dict]:
+        """All chunks of a document with their page numbers, in document order."""
+        rows = self.pool.fetchall(
+            'SELECT chunk, page_number FROM document_chunks WHERE document_id = ? ORDER BY id', (document_id,))
+        return [{"chunk": chunk, "page_number": page_number} for chunk, page_number in rows]
+
+    def list_documents(self) -> List[Dict]:
+        """List stored documents, most recently updated first."""
+        c = self.pool.connection().cursor()
+        c.row_factory = sqlite3.Row
+        c.execute('SELECT * FROM documents ORDER BY updated_at DESC, rowid DESC')
+        return [dict(row) for row in c.fetchall()]
+
+    def get_latest_document_id(self) -> Optional[str]:
+        """Get the id of the most recently stored document, if any."""
+        documents = self.list_documents()
+        return documents[0]["document_id"] if documents else None
+
+    def add_document(self, document_id: str, chunked_docs: List[Dict], file_name: str = None, doc_type: str = None,
+                     complete: bool = True) -> None:
+        """Add a document's chunks. Use replace_document to overwrite an existing document."""
+        self.store_chunked_docs(chunked_docs, document_id, file_name=file_name, doc_type=doc_type, complete=complete)
+
+    def replace_document(self, document_id: str, chunked_docs: List[Dict], file_name: str = None, doc_type: str = None,
+                         complete: bool = True) -> None:
+        """Replace all chunks of a document with a new set."""
+        self.store_chunked_docs(chunked_docs, document_id, file_name=file_name, doc_type=doc_type, replace=True,
+                                complete=complete)
+
+    def touch_document(self, document_id: str) -> None:
+        """Mark a stored document as the most recently uploaded one, e.g. when its vectors are reused."""
+        with self.pool.transaction() as conn:
+            c = conn.cursor()
+            c.execute("UPDATE documents SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE document_id = ?",
+                      (document_id,))
+
+    def delete_document(self, document_id: str) -> None:
+        """Delete a document and all of its chunks."""
+        ann_index = self.get_ann_index()
+        with self.pool.transaction() as conn:
+            c = conn.cursor()
+            removed_ids = self._document_chunk_ids(c, document_id)
+            c.execute('DELETE FROM document_chunks WHERE document_id = ?', (document_id,))
+            c.execute('DELETE FROM documents WHERE document_id = ?', (document_id,))
+            c.execute("UPDATE store_meta SET value = value + 1 WHERE key = 'store_version'")
+        self._invalidate_index(document_id)
+        ann_index.remove(removed_ids)
+        if self.sidecar:
+            self.sidecar.compact_if_needed()
+
+    def store_chunked_docs(self, chunked_docs: List[Dict], document_id: str, file_name: str = None,
+                           doc_type: str = None, replace: bool = False, complete: bool = True) -> None:
+        """Store a document's chunks and their embeddings in SQLite.
+
+        complete=False records that some of the document's chunks are missing, so
+        has_complete_document is False and the next upload embeds it again.
+        """
+        ann_index = self.get_ann_index()
+        # Embeddings arrive as float32 arrays, so tobytes() writes them without conversion
+        embeddings = np.stack([np.asarray(doc["embedding"], dtype=np.float32) for doc in chunked_docs]) if chunked_docs else None
+        if self.compact and chunked_docs:
+            codes, scales = quantize_embeddings(embeddings, self.compact_dimensions)
+        else:
+            codes, scales = [None] * len(chunked_docs), [None] * len(chunked_docs)
+
+        # In sidecar mode the embedding rows are recorded in the same transaction that
+        # stores the chunks and bumps the document's updated_at, so no worker can cache
+        # an index without them under the new version
+        sidecar_lock = self.sidecar.file_lock() if self.sidecar and chunked_docs else nullcontext()
+        with sidecar_lock, self.pool.transaction() as conn:
+            c = conn.cursor()
+            removed_ids = []
+            if replace:
+                removed_ids = self._document_chunk_ids(c, document_id)
+                c.execute('DELETE FROM document_chunks WHERE document_id = ?', (document_id,))
+            c.execute('SELECT COUNT(*) FROM document_chunks WHERE document_id = ?', (document_id,))
+            existing_count = c.fetchone()[0]
+            c.executemany(
+                '''INSERT INTO document_chunks (document_id, chunk, page_number, embedding, embedding_q, embedding_scale)
+                   VALUES (?, ?, ?, ?, ?, ?)''',
+                (
+                    (
+                        document_id,
+                        doc["chunk"],
+                        doc["page_number"],
+                        embedding.tobytes(),
+                        code.tobytes() if code is not None else None,
+                        float(scale) if scale is not None else None
+                    )
+                    for doc, embedding, code, scale in zip(chunked_docs, embeddings if chunked_docs else [], codes, scales)
+                )
             )
-            query_embedding = query_embedding.data[0].embedding
-        except Exception as e:
-            print(f"Error getting embedding for query '{query}': {str(e)}")
-            return []
 
-        # Retrieve all chunks and their embeddings
+            c.execute('''
+                INSERT INTO documents (document_id, file_name, doc_type, chunk_count, complete)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(document_id) DO UPDATE SET
+                    file_name = COALESCE(excluded.file_name, file_name),
+                    doc_type = COALESCE(excluded.doc_type, doc_type),
+                    chunk_count = excluded.chunk_count,
+                    complete = excluded.complete,
+                    updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+            ''', (document_id, file_name, doc_type, existing_count + len(chunked_docs), int(complete)))
+            added_ids = self._document_chunk_ids(c, document_id)[existing_count:]
+            if self.sidecar and chunked_docs:
+                self.sidecar.append(added_ids, embeddings, cursor=c)
+            c.execute("UPDATE store_meta SET value = value + 1 WHERE key = 'store_version'")
+        print(f"Stored {len(chunked_docs)} chunks for document {document_id[:12]} in SQLite database.")
+
+        # Populate the cache once so every retrieval for this upload hits memory.
+        # A new document is indexed straight from the in-memory arrays; otherwise reload.
+        self._invalidate_index(document_id)
+        if self.sidecar and removed_ids:
+            self.sidecar.compact_if_needed()
+
+        if self.compact:
+            index = load_compact_vector_index(self.db_path, document_id)
+        elif self.sidecar:
+            index = self.sidecar.load_index(document_id)
+        elif existing_count == 0 and chunked_docs:
+            index = VectorIndex(
+                [doc["chunk"] for doc in chunked_docs],
+                [doc["page_number"] for doc in chunked_docs],
+                embeddings
+            )
+        else:
+            index = load_vector_index(self.db_path, document_id)
+        vector_index_cache.put(self._index_cache_key(document_id), index, self._index_version(document_id))
+
+        # Keep the corpus-wide ANN index in step; it persists only the changed rows
+        ann_index.remove(removed_ids)
+        if chunked_docs:
+            ann_index.add(added_ids, embeddings)
+
+    def _snapshot_files(self) -> List[str]:
+        """Paths of the embedding sidecar files and ANN index belonging to this store."""
+        base_path = os.path.splitext(self.db_path)[0]
+        return glob.glob(f"{base_path}.vectors-*.f32") + glob.glob(f"{base_path}.norms-*.f32") + glob.glob(self.ann_index_path)
+
+    def snapshot(self, dest_dir: str) -> None:
+        """Copy the store with its embedding sidecar and ANN index to dest_dir.
+
+        A new instance can restore_snapshot() from it and serve immediately instead of
+        re-embedding documents or rebuilding the indexes.
+        """
+        os.makedirs(dest_dir, exist_ok=True)
+        # Holding the sidecar lock keeps the copied rows consistent with the copied database
+        with EmbeddingSidecar(self.db_path).file_lock():
+            for path in self._snapshot_files():
+                target = os.path.join(dest_dir, os.path.basename(path))
+                if os.path.isdir(path):
+                    shutil.rmtree(target, ignore_errors=True)
+                    shutil.copytree(path, target)
+                else:
+                    shutil.copyfile(path, target)
+
+            # The database goes last; its presence marks a complete snapshot
+            tmp_path = os.path.join(dest_dir, f"{os.path.basename(self.db_path)}.tmp")
+            target = sqlite3.connect(tmp_path)
+            self.pool.connection().backup(target)
+            target.close()
+            os.replace(tmp_path, os.path.join(dest_dir, os.path.basename(self.db_path)))
+        print(f"Snapshot of {self.db_path} written to {dest_dir}")
+
+    @staticmethod
+    def restore_snapshot(src_dir: str, db_path: str) -> bool:
+        """Restore a snapshot into db_path unless a store already exists there. Returns True if restored."""
+        snapshot_db = os.path.join(src_dir, os.path.basename(db_path))
+        if not os.path.exists(snapshot_db):
+            return False
+
+        # Workers start together; the lock makes exactly one of them copy the files
+        with EmbeddingSidecar(db_path).file_lock():
+            if os.path.exists(db_path):
+                return False
+
+            db_dir = os.path.dirname(os.path.abspath(db_path))
+            base_name = os.path.splitext(os.path.basename(db_path))[0]
+            for name in os.listdir(src_dir):
+                path = os.path.join(src_dir, name)
+                if not name.startswith(f"{base_name}.") or path == snapshot_db:
+                    continue
+                if os.path.isdir(path):
+                    shutil.copytree(path, os.path.join(db_dir, name), dirs_exist_ok=True)
+                else:
+                    shutil.copyfile(path, os.path.join(db_dir, name))
+
+            tmp_path = f"{db_path}.tmp"
+            shutil.copyfile(snapshot_db, tmp_path)
+            os.replace(tmp_path, db_path)
+        print(f"Restored {db_path} from snapshot in {src_dir}")
+        return True
+
+    def get_chunks_count(self, document_id: Optional[str] = None) -> int:
+        """Get the number of chunks stored for a document, or in the whole database."""
+        if document_id is None:
+            return self.pool.fetchone('SELECT COUNT(*) FROM document_chunks')[0]
+        return self.pool.fetchone('SELECT COUNT(*) FROM document_chunks WHERE document_id = ?', (document_id,))[0]
+
+    def search(self, query_embeddings: List, k: int = 3, document_id: Optional[str] = None) -> List[List[Dict]]:
+        """Get top-k chunks of a document (or of every document for None) for each query embedding."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            c = conn.cursor()
-            c.execute('SELECT chunk, page_number, embedding FROM document_chunks')
-            chunks = c.fetchall()
-            conn.close()
+            index = self.get_vector_index(document_id)
         except Exception as e:
             print(f"Error retrieving chunks from database: {str(e)}")
-            return []
+            return [[] for _ in query_embeddings]
 
-        # Calculate similarities
         try:
-            similarities = []
-            for chunk, page_number, embedding_bytes in chunks:
-                doc_embedding = np.frombuffer(embedding_bytes, dtype=np.float32)
-                similarity = self._cosine_similarity(query_embedding, doc_embedding)
-                similarities.append((similarity, chunk, page_number))
+            return index.search_batch(query_embeddings, k)
+        except Exception as e:
+            print(f"Error calculating similarities: {str(e)}")
+            return [[] for _ in query_embeddings]
 
-            # Sort by similarity and get top-k
-            similarities.sort(reverse=True)
-            top_k = similarities[:k]
+    def search_corpus(self, query_embeddings: List, k: int = 5) -> List[List[Dict]]:
+        """Get approximate top-k chunks across every stored document for each query embedding.
 
-            return [
+        Results carry the document_id and file_name of each chunk.
+        """
+        try:
+            index = self.get_ann_index()
+            hits = [index.search(query_embedding, k) for query_embedding in query_embeddings]
+        except Exception as e:
+            print(f"Error searching ANN index: {str(e)}")
+            return [[] for _ in query_embeddings]
+
+        chunk_ids = list({chunk_id for result in hits for chunk_id, _ in result})
+        if not chunk_ids:
+            return [[] for _ in query_embeddings]
+
+        placeholders = ','.join('?' * len(chunk_ids))
+        rows = {row[0]: row[1:] for row in self.pool.fetchall(f'''
+            SELECT dc.id, dc.chunk, dc.page_number, dc.document_id, d.file_name
+            FROM document_chunks dc LEFT JOIN documents d ON d.document_id = dc.document_id
+            WHERE dc.id IN ({placeholders})''', chunk_ids)}
+
+        return [
+            [
                 {
-                    "chunk": chunk,
-                    "page_number": page_number,
-                    "score": float(score)
+                    "chunk": rows[chunk_id][0],
+                    "page_number": rows[chunk_id][1],
+                    "score": score,
+                    "document_id": rows[chunk_id][2],
+                    "file_name": rows[chunk_id][3]
                 }
-                for score, chunk, page_number in top_k
+                for chunk_id, score in result if chunk_id in rows
             ]
-        except Exception as e:
-            print(f"Error calculating similarities: {str(e)}")
+            for result in hits
+        ]
+
+    @staticmethod
+    def keyword_match_query(keywords: List[str]) -> str:
+        """FTS5 MATCH expression matching any of the keywords as a phrase."""
+        return ' OR '.join('"{}"'.format(keyword.replace('"', '""')) for keyword in keywords)
+
+    def lexical_search(self, match_query: str, limit: int = HYBRID_BM25_CANDIDATES,
+                       document_id: Optional[str] = None) -> List[int]:
+        """Ids of the chunks best matching an FTS5 query by BM25, best first."""
+        try:
+            if document_id is None:
+                rows = self._lexical_search.fetchall((match_query, limit))
+            else:
+                rows = self._lexical_search_document.fetchall((match_query, document_id, limit))
+            return [row[0] for row in rows]
+        except sqlite3.OperationalError as e:
+            print(f"Error in lexical search for {match_query!r}: {str(e)}")
             return []
+
+    def hybrid_search(self, query_embeddings: List, match_queries: List[str], k: int = 3,
+                      document_id: Optional[str] = None) -> List[List[Dict]]:
+        """Get top-k chunks for each query by BM25 candidate pruning and rank fusion.
+
+        Only the BM25 candidates of each match query are scored against its embedding;
+        the lexical and dense rankings are then combined by reciprocal rank fusion.
+        Queries with fewer than k lexical matches are topped up from dense search.
+        """
+        candidates = [self.lexical_search(match_query, document_id=document_id) for match_query in match_queries]
+        chunk_ids = list({chunk_id for ids in candidates for chunk_id in ids})
+        rows = {}
+        if chunk_ids:
+            placeholders = ','.join('?' * len(chunk_ids))
+            rows = {row[0]: row[1:] for row in self.pool.fetchall(
+                f'SELECT id, chunk, page_number, embedding FROM document_chunks WHERE id IN ({placeholders})', chunk_ids)}
+
+        results = []
+        shortfall = []
+        for i, (query_embedding, ids) in enumerate(zip(query_embeddings, candidates)):
+            ids = [chunk_id for chunk_id in ids if chunk_id in rows]
+            if not ids:
+                results.append([])
+                shortfall.append(i)
+                continue
+
+            query = normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+            matrix = normalize_rows(np.stack([np.frombuffer(rows[chunk_id][2], dtype=np.float32) for chunk_id in ids]))
+            dense_scores = matrix @ query
+            dense_rank = np.empty(len(ids), dtype=np.int64)
+            dense_rank[np.argsort(-dense_scores, kind="stable")] = np.arange(len(ids))
+
+            # ids are in BM25 order, so a candidate's position is its lexical rank
+            fused = [
+                (1.0 / (HYBRID_RRF_K + lexical_rank + 1) + 1.0 / (HYBRID_RRF_K + dense_rank[lexical_rank] + 1), lexical_rank)
+                for lexical_rank in range(len(ids))
+            ]
+            fused.sort(key=lambda item: -item[0])
+            results.append([
+                {
+                    "chunk": rows[ids[position]][0],
+                    "page_number": rows[ids[position]][1],
+                    "score": float(dense_scores[position]),
+                    "rrf_score": score
+                }
+                for score, position in fused[:k]
+            ])
+            if len(results[-1]) < k:
+                shortfall.append(i)
+
+        if shortfall:
+            dense_results = self.search([query_embeddings[i] for i in shortfall], k, document_id)
+            for i, dense in zip(shortfall, dense_results):
+                seen = {chunk["chunk"] for chunk in results[i]}
+                results[i].extend(chunk for chunk in dense if chunk["chunk"] not in seen)
+                results[i] = results[i][:k]
+        return results
+
+    async def get_relevant_chunks(self, query: str, k: int = 3, async_client=None, document_id: Optional[str] = None) -> List[Dict]:
+        """Get top-k relevant chunks for a query using cosine similarity."""
+        results = await self.get_relevant_chunks_batch([query], k=k, async_client=async_client, document_id=document_id)
+        return results[0]
+
+    async def get_relevant_chunks_batch(self, queries: List[str], k: int = 3, async_client=None,
+                                        document_id: Optional[str] = None,
+                                        match_queries: Optional[List[Optional[str]]] = None,
+                                        lane: str = BULK, hedge: bool = False, deadline=None) -> List[List[Dict]]:
+        """Get top-k relevant chunks of a document for each query with one embeddings call and one matrix multiply.
+
+        match_queries optionally gives an FTS5 query per query; those queries use
+        hybrid_search, the rest plain dense search. hedge sends a duplicate
+        embeddings call if the first is slow; deadline bounds the embeddings call.
+        """
+        if not queries:
+            return []
+
+        # Static config queries are precomputed; embed only the rest, in a single request
+        query_embeddings = [query_embedding_cache.get(query) for query in queries]
+        missing = [i for i, embedding in enumerate(query_embeddings) if embedding is None]
+        if missing:
+            try:
+                response = await hedger.create(
+                    async_client, "embeddings", lane, hedge=hedge, deadline=deadline,
+                    input=[queries[i] for i in missing],
+                    model="text-embedding-3-small",
+                    encoding_format="base64"
+                )
+                for i, embedding in zip(missing, embeddings_to_matrix(response.data)):
+                    query_embeddings[i] = embedding
+            except Exception as e:
+                print(f"Error getting embeddings for {len(missing)} queries: {str(e)}")
+                return [[] for _ in queries]
+
+        # Score against the cached normalized embedding matrix in one pass, off the event loop
+        return await run_db(self._search_mixed, query_embeddings, match_queries, k, document_id)
+
+    def _search_mixed(self, query_embeddings: List, match_queries: Optional[List[Optional[str]]], k: int,
+                      document_id: Optional[str]) -> List[List[Dict]]:
+        """Hybrid search for queries with a match query, dense search for the rest."""
+        hybrid = [i for i, match_query in enumerate(match_queries or []) if match_query]
+        if not hybrid:
+            return self.search(query_embeddings, k, document_id)
+
+        dense = sorted(set(range(len(query_embeddings))) - set(hybrid))
+        results = [[] for _ in query_embeddings]
+        for i, chunks in zip(hybrid, self.hybrid_search([query_embeddings[i] for i in hybrid],
+                                                        [match_queries[i] for i in hybrid], k, document_id)):
+            results[i] = chunks
+        if dense:
+            for i, chunks in zip(dense, self.search([query_embeddings[i] for i in dense], k, document_id)):
+                results[i] = chunks
+        return results
@@ -86,6 +86,22 @@ DOCUMENT_METADATA_SCHEMA = {
     'PRIMARY KEY': '(db_id, doc_type, file_name)'  # Modified primary key to include db_id
 }
 
+# Upload jobs whose fields may finish after /upload responded, so any worker can
+# answer GET /upload/{job_id}/pending
+UPLOAD_JOBS_SCHEMA = {
+    'job_id': 'TEXT NOT NULL',
+    'db_id': 'INTEGER',
+    'document_id': 'TEXT',
+    'doc_type': 'TEXT NOT NULL',
+    'file_name': 'TEXT',
+    'status': 'TEXT NOT NULL',
+    'error': 'TEXT',
+    'pending_fields': 'TEXT',  # JSON list of the fields pending when /upload responded
+    'field_values': 'TEXT',  # JSON object of their extraction results once finished
+    'created_at': 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP',
+    'PRIMARY KEY': '(job_id)'
+}
+
 def get_create_table_sql(table_name: str, schema: Dict[str, str]) -> str:
     """Generate CREATE TABLE SQL statement from schema dictionary."""
     columns = [f"{col_name} {col_type}" for col_name, col_type in schema.items() if col_name != 'PRIMARY KEY']
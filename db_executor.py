@@ -0,0 +1,15 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+from config import DB_EXECUTOR_MAX_WORKERS
+
+# Dedicated pool for blocking SQLite I/O and vector scoring, so async endpoints never
+# run them on the event loop and they cannot be starved by other to_thread work
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_MAX_WORKERS, thread_name_prefix="sqlite")
+
+
+async def run_db(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking database call on the DB executor and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
@@ -0,0 +1,35 @@
+import time
+import asyncio
+from typing import Any, Awaitable
+
+
+class DeadlineExceeded(Exception):
+    """Raised when awaited work does not finish before its deadline."""
+
+
+class Deadline:
+    """The time by which a request's work must finish, passed down to every stage that waits."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: float) -> float:
+        """Timeout for one call: cap, or less if the deadline comes sooner."""
+        return max(0.001, min(cap, self.remaining()))
+
+    async def run(self, awaitable: Awaitable[Any]) -> Any:
+        """Await within the remaining time; on expiry the awaitable is cancelled.
+
+        Wrap the awaitable in asyncio.shield to stop waiting without cancelling it.
+        """
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Deadline of {self.seconds:.0f}s exceeded") from None
@@ -0,0 +1,103 @@
+import time
+import hashlib
+import sqlite3
+import numpy as np
+from typing import List, Optional
+from sqlite_pool import get_pool
+from config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_MAX_AGE_DAYS
+
+# SQLite limits the number of bound parameters per statement
+_LOOKUP_BATCH_SIZE = 500
+
+
+class EmbeddingCache:
+    """SQLite-backed embedding cache keyed by (model, SHA-256 of the normalized chunk text)."""
+
+    def __init__(self, db_path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+                 max_age_days: float = EMBEDDING_CACHE_MAX_AGE_DAYS):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 24 * 60 * 60
+        self.pool = get_pool(db_path)
+        self._init_db()
+
+    def _init_db(self):
+        """Create the cache table if it doesn't exist."""
+        with self.pool.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache (last_used_at)')
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """Collapse whitespace so layout-only differences map to the same entry."""
+        return ' '.join(text.split())
+
+    @classmethod
+    def text_hash(cls, text: str) -> str:
+        return hashlib.sha256(cls.normalize_text(text).encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Look up embeddings for texts, returning None for each cache miss."""
+        hashes = [self.text_hash(text) for text in texts]
+        found = {}
+
+        c = self.pool.connection().cursor()
+        unique_hashes = list(dict.fromkeys(hashes))
+        for i in range(0, len(unique_hashes), _LOOKUP_BATCH_SIZE):
+            batch = unique_hashes[i:i + _LOOKUP_BATCH_SIZE]
+            placeholders = ','.join('?' * len(batch))
+            c.execute(
+                f'SELECT text_hash, embedding FROM embedding_cache WHERE model = ? AND text_hash IN ({placeholders})',
+                [model] + batch
+            )
+            for text_hash, embedding_bytes in c.fetchall():
+                found[text_hash] = np.frombuffer(embedding_bytes, dtype=np.float32)
+
+        # Refresh recency so frequently reused boilerplate survives eviction
+        if found:
+            now = time.time()
+            with self.pool.transaction() as conn:
+                conn.executemany(
+                    'UPDATE embedding_cache SET last_used_at = ? WHERE model = ? AND text_hash = ?',
+                    [(now, model, text_hash) for text_hash in found]
+                )
+
+        return [found.get(text_hash) for text_hash in hashes]
+
+    def put_many(self, model: str, texts: List[str], embeddings: List) -> None:
+        """Store embeddings for texts, then evict expired and least recently used entries."""
+        if not texts:
+            return
+
+        now = time.time()
+        rows = [
+            (model, self.text_hash(text), np.asarray(embedding, dtype=np.float32).tobytes(), now, now)
+            for text, embedding in zip(texts, embeddings)
+        ]
+
+        with self.pool.transaction() as conn:
+            c = conn.cursor()
+            c.executemany(
+                'INSERT OR REPLACE INTO embedding_cache (model, text_hash, embedding, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+            self._evict(c, now)
+
+    def _evict(self, c: sqlite3.Cursor, now: float) -> None:
+        """Delete entries older than max_age, then the least recently used beyond max_entries."""
+        c.execute('DELETE FROM embedding_cache WHERE created_at < ?', (now - self.max_age_seconds,))
+        c.execute('SELECT COUNT(*) FROM embedding_cache')
+        excess = c.fetchone()[0] - self.max_entries
+        if excess > 0:
+            c.execute('''
+                DELETE FROM embedding_cache WHERE rowid IN (
+                    SELECT rowid FROM embedding_cache ORDER BY last_used_at ASC LIMIT ?
+                )''', (excess,))
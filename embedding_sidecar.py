@@ -0,0 +1,307 @@
+import os
+import fcntl
+import sqlite3
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+from sqlite_pool import get_pool
+from vector_index import _document_filter, normalize_rows, top_k_indices
+
+# Rows read from SQLite at a time while (re)writing the sidecar files
+_COPY_BATCH_ROWS = 4096
+
+# Rebuild once orphaned rows (from replaced or deleted documents) outnumber live ones
+_COMPACT_MIN_ROWS = 10000
+
+
+class EmbeddingSidecar:
+    """Append-only float32 embedding matrix beside the SQLite store, shared through np.memmap.
+
+    Chunk embeddings are written as raw rows to <db>.vectors-<generation>.f32 and their
+    norms to <db>.norms-<generation>.f32. document_chunks.sidecar_row maps each chunk
+    to its row, and the generation and dimension are kept in store_meta. Every worker
+    maps the same files, so the vectors live once in the page cache and are never
+    deserialized. Writers serialize on a file lock; a rebuild writes a new generation,
+    so readers holding the old one keep a valid mapping until they reload.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.base_path = os.path.splitext(db_path)[0]
+        self._maps: Dict[int, Tuple[np.memmap, np.memmap]] = {}
+        self._lock = threading.Lock()
+
+    def vectors_path(self, generation: int) -> str:
+        return f"{self.base_path}.vectors-{generation}.f32"
+
+    def norms_path(self, generation: int) -> str:
+        return f"{self.base_path}.norms-{generation}.f32"
+
+    @contextmanager
+    def file_lock(self):
+        """Exclusive lock across worker processes for writes to the sidecar files."""
+        with open(f"{self.base_path}.sidecar.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _meta(c: sqlite3.Cursor) -> Tuple[int, Optional[int]]:
+        """Current (generation, dimension) of the sidecar; dimension is None before the first row."""
+        c.execute("SELECT key, value FROM store_meta WHERE key IN ('sidecar_generation', 'sidecar_dim')")
+        meta = dict(c.fetchall())
+        dim = meta.get('sidecar_dim')
+        return int(meta.get('sidecar_generation', 0)), int(dim) if dim is not None else None
+
+    @staticmethod
+    def _set_meta(c: sqlite3.Cursor, key: str, value) -> None:
+        c.execute('INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)', (key, value))
+
+    def _file_rows(self, generation: int, dim: int) -> int:
+        """Number of complete rows present in both sidecar files."""
+        rows = []
+        for path, row_bytes in ((self.vectors_path(generation), dim * 4), (self.norms_path(generation), 4)):
+            rows.append(os.path.getsize(path) // row_bytes if os.path.exists(path) else 0)
+        return min(rows)
+
+    def _write_rows(self, generation: int, start: int, embeddings: np.ndarray) -> None:
+        """Write embeddings and their norms at row `start`, dropping any partial tail."""
+        dim = embeddings.shape[1]
+        norms = np.linalg.norm(embeddings, axis=1).astype(np.float32)
+        for path, data, row_bytes in ((self.vectors_path(generation), embeddings, dim * 4),
+                                      (self.norms_path(generation), norms, 4)):
+            with open(path, "ab") as f:
+                f.truncate(start * row_bytes)
+                f.write(np.ascontiguousarray(data, dtype=np.float32).tobytes())
+
+    def _append_locked(self, c: sqlite3.Cursor, chunk_ids: Sequence[int], embeddings: np.ndarray) -> None:
+        generation, dim = self._meta(c)
+        if dim is None:
+            dim = embeddings.shape[1]
+            self._set_meta(c, 'sidecar_dim', dim)
+        elif dim != embeddings.shape[1]:
+            raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match sidecar dimension {dim}")
+
+        start = self._file_rows(generation, dim)
+        self._write_rows(generation, start, embeddings)
+        c.executemany(
+            'UPDATE document_chunks SET sidecar_row = ? WHERE id = ?',
+            zip(range(start, start + len(chunk_ids)), chunk_ids)
+        )
+
+    def append(self, chunk_ids: Sequence[int], embeddings: np.ndarray, cursor: Optional[sqlite3.Cursor] = None) -> None:
+        """Append embeddings for newly stored chunks and record their rows.
+
+        With a cursor, the rows are recorded in the caller's transaction, and the
+        caller must already hold file_lock().
+        """
+        if not len(chunk_ids):
+            return
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if cursor is not None:
+            self._append_locked(cursor, chunk_ids, embeddings)
+            return
+        with self.file_lock():
+            with get_pool(self.db_path).transaction() as conn:
+                self._append_locked(conn.cursor(), chunk_ids, embeddings)
+
+    @staticmethod
+    def _stored_embeddings(c: sqlite3.Cursor, condition: str):
+        """Yield (chunk ids, embedding matrix) batches of chunks matching condition, in id order.
+
+        Pages by id rather than holding a cursor open, since the caller updates the same rows.
+        """
+        last_id = -1
+        while True:
+            c.execute(
+                f'SELECT id, embedding FROM document_chunks WHERE embedding IS NOT NULL AND {condition} '
+                'AND id > ? ORDER BY id LIMIT ?',
+                (last_id, _COPY_BATCH_ROWS)
+            )
+            rows = c.fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [row[0] for row in rows], np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+
+    def _sync_state(self, c: sqlite3.Cursor) -> Tuple[int, bool, bool]:
+        """(generation, whether the files are missing rows chunks point to, whether chunks have no row)."""
+        generation, dim = self._meta(c)
+        c.execute('SELECT MAX(sidecar_row) FROM document_chunks')
+        max_row = c.fetchone()[0]
+        missing_rows = max_row is not None and (dim is None or self._file_rows(generation, dim) <= max_row)
+        c.execute('SELECT 1 FROM document_chunks WHERE sidecar_row IS NULL AND embedding IS NOT NULL LIMIT 1')
+        return generation, missing_rows, c.fetchone() is not None
+
+    def sync(self) -> None:
+        """Bring the sidecar in line with SQLite.
+
+        Rebuilds it when the files are missing rows that chunks point to (e.g. on a
+        fresh disk), then appends chunks stored before the sidecar existed. Every
+        DatabaseHandler syncs, so the lock and write transaction are only taken when
+        a read-only check finds something to do.
+        """
+        _, missing_rows, unsynced = self._sync_state(get_pool(self.db_path).connection().cursor())
+        if not (missing_rows or unsynced):
+            return
+
+        with self.file_lock():
+            with get_pool(self.db_path).transaction() as conn:
+                c = conn.cursor()
+                generation, rebuilt, unsynced = self._sync_state(c)
+                if rebuilt:
+                    print("Embedding sidecar is missing rows; rebuilding it from SQLite...")
+                    self._rebuild_locked(c)
+                elif unsynced:
+                    for chunk_ids, embeddings in self._stored_embeddings(c, 'sidecar_row IS NULL'):
+                        self._append_locked(c, chunk_ids, embeddings)
+            if rebuilt:
+                self._remove_generation(generation)
+
+    def _rebuild_locked(self, c: sqlite3.Cursor) -> None:
+        """Write every stored embedding to a new generation and repoint all chunks at it."""
+        generation, _ = self._meta(c)
+        new_generation = generation + 1
+        self._remove_generation(new_generation)
+
+        c.execute('UPDATE document_chunks SET sidecar_row = NULL')
+        written = 0
+        for chunk_ids, embeddings in self._stored_embeddings(c, '1 = 1'):
+            if written == 0:
+                self._set_meta(c, 'sidecar_dim', embeddings.shape[1])
+            self._write_rows(new_generation, written, embeddings)
+            c.executemany(
+                'UPDATE document_chunks SET sidecar_row = ? WHERE id = ?',
+                zip(range(written, written + len(chunk_ids)), chunk_ids)
+            )
+            written += len(chunk_ids)
+
+        self._set_meta(c, 'sidecar_generation', new_generation)
+        c.execute("UPDATE store_meta SET value = value + 1 WHERE key = 'store_version'")
+        print(f"Rebuilt embedding sidecar generation {new_generation} with {written} rows.")
+
+    def _remove_generation(self, generation: int) -> None:
+        """Delete a generation's files; workers still mapping them keep reading until they reload."""
+        for path in (self.vectors_path(generation), self.norms_path(generation)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def rebuild(self) -> None:
+        """Rewrite the sidecar from SQLite, dropping rows of replaced or deleted chunks."""
+        with self.file_lock():
+            with get_pool(self.db_path).transaction() as conn:
+                c = conn.cursor()
+                generation, _ = self._meta(c)
+                self._rebuild_locked(c)
+            self._remove_generation(generation)
+
+    def compact_if_needed(self) -> None:
+        """Rebuild when most sidecar rows are orphaned by replaced or deleted documents."""
+        c = get_pool(self.db_path).connection().cursor()
+        generation, dim = self._meta(c)
+        if dim is None:
+            return
+        file_rows = self._file_rows(generation, dim)
+        c.execute('SELECT COUNT(sidecar_row) FROM document_chunks')
+        live_rows = c.fetchone()[0]
+        if file_rows >= _COMPACT_MIN_ROWS and live_rows < file_rows // 2:
+            self.rebuild()
+
+    def mapped(self, generation: int, dim: int, min_rows: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Read-only (vectors, norms) maps of a generation covering at least min_rows rows."""
+        with self._lock:
+            mapped = self._maps.get(generation)
+            if mapped is None or len(mapped[1]) < min_rows:
+                rows = self._file_rows(generation, dim)
+                if rows < min_rows:
+                    raise ValueError(f"Embedding sidecar has {rows} rows, expected at least {min_rows}")
+                mapped = (
+                    np.memmap(self.vectors_path(generation), dtype=np.float32, mode="r", shape=(rows, dim)),
+                    np.memmap(self.norms_path(generation), dtype=np.float32, mode="r", shape=(rows,))
+                )
+                # Only the current generation is kept; older maps close with their last index
+                self._maps = {generation: mapped}
+            return mapped
+
+    def load_index(self, document_id: Optional[str] = None) -> "SidecarVectorIndex":
+        """Load chunk text and row numbers of a document, or of every document, over the shared maps."""
+        condition, params = _document_filter(document_id)
+        c = get_pool(self.db_path).connection().cursor()
+        generation, dim = self._meta(c)
+        c.execute(
+            f'SELECT chunk, page_number, sidecar_row FROM document_chunks '
+            f'WHERE sidecar_row IS NOT NULL AND {condition} ORDER BY id',
+            params
+        )
+        rows = c.fetchall()
+        return SidecarVectorIndex(
+            [row[0] for row in rows],
+            [row[1] for row in rows],
+            np.array([row[2] for row in rows], dtype=np.int64),
+            self,
+            generation,
+            dim or 0
+        )
+
+
+class SidecarVectorIndex:
+    """Chunk text and sidecar row numbers; the embeddings stay in the shared memory-mapped files."""
+
+    def __init__(self, chunks: List[str], page_numbers: List[int], rows: np.ndarray,
+                 sidecar: EmbeddingSidecar, generation: int, dim: int):
+        self.chunks = chunks
+        self.page_numbers = page_numbers
+        self.rows = rows
+        self.sidecar = sidecar
+        self.generation = generation
+        self.dim = dim
+        # A document's rows are appended together, so they can usually be sliced without copying
+        self.contiguous = len(rows) > 0 and rows[-1] - rows[0] + 1 == len(rows) and bool(np.all(np.diff(rows) == 1))
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate private memory held by the index (row numbers plus chunk text)."""
+        return self.rows.nbytes + sum(len(chunk) for chunk in self.chunks)
+
+    def search(self, query_embedding: Sequence[float], k: int = 3) -> List[Dict]:
+        """Return the top-k chunks for a query embedding, best first."""
+        return self.search_batch([query_embedding], k)[0]
+
+    def search_batch(self, query_embeddings: Sequence[Sequence[float]], k: int = 3) -> List[List[Dict]]:
+        """Return the top-k chunks for each query embedding, scored against the mapped matrix."""
+        if len(self) == 0 or k <= 0:
+            return [[] for _ in query_embeddings]
+
+        vectors, norms = self.sidecar.mapped(self.generation, self.dim, int(self.rows.max()) + 1)
+        queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32))
+        if self.contiguous:
+            start, stop = int(self.rows[0]), int(self.rows[-1]) + 1
+            scores = queries @ vectors[start:stop].T
+            row_norms = norms[start:stop]
+        elif len(self.rows) * 4 >= len(vectors):
+            # Mostly the whole file: scanning it beats gathering a private copy
+            scores = (queries @ vectors.T)[:, self.rows]
+            row_norms = norms[self.rows]
+        else:
+            scores = queries @ vectors[self.rows].T
+            row_norms = norms[self.rows]
+        scores /= np.where(row_norms == 0, 1.0, row_norms)
+        top = top_k_indices(scores, k)
+
+        return [
+            [
+                {
+                    "chunk": self.chunks[i],
+                    "page_number": self.page_numbers[i],
+                    "score": float(row_scores[i])
+                }
+                for i in row_top
+            ]
+            for row_top, row_scores in zip(top, scores)
+        ]
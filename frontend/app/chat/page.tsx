@@ -101,7 +101,8 @@ export default function RagChatPage() {
         },
         body: JSON.stringify({ 
           query: currentInput,
-          session_id: sessionId || "default-session"
+          session_id: sessionId || "default-session",
+          document_id: localStorage.getItem('documentId') || undefined
         }),
         signal: controller.signal,
         mode: "cors",
@@ -102,6 +102,7 @@ export default function ContractPage() {
         setLoading(true);
 
         window.localStorage.removeItem('dbId');
+        window.localStorage.removeItem('documentId');
 
         console.log("Processing Contract file");
 
@@ -127,6 +128,11 @@ export default function ContractPage() {
         if (result.db_id) {
           window.localStorage.setItem('dbId', result.db_id.toString());
         }
+
+        // Store documentId so chat answers about this contract
+        if (result.document_id) {
+          window.localStorage.setItem('documentId', result.document_id);
+        }
         
         const extractedData = result.extracted_data as ExtractedDataItem[];
         
@@ -0,0 +1,127 @@
+import time
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+from openai_scheduler import BULK, openai_scheduler
+from config import HEDGE_PERCENTILE, HEDGE_BUDGET, HEDGE_MAX_BURST, HEDGE_WINDOW, HEDGE_MIN_SAMPLES
+
+
+class LatencyTracker:
+    """Latencies of the most recent calls to one endpoint."""
+
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+    def expected_beyond(self, seconds: float) -> float:
+        """Mean latency of the calls slower than seconds, or seconds if there were none."""
+        slower = [sample for sample in self.samples if sample > seconds]
+        return sum(slower) / len(slower) if slower else seconds
+
+
+class Hedger:
+    """Sends a duplicate of a call that is slower than usual; the first response wins.
+
+    A call still running at the HEDGE_PERCENTILE latency of its endpoint gets a
+    hedge, and whichever attempt succeeds first is returned while the other is
+    cancelled. Hedges are budgeted: each call earns HEDGE_BUDGET of an extra call,
+    banked up to HEDGE_MAX_BURST, so a slow API cannot double the load on itself.
+    """
+
+    def __init__(self, percentile: float = HEDGE_PERCENTILE, budget: float = HEDGE_BUDGET,
+                 max_burst: float = HEDGE_MAX_BURST, min_samples: int = HEDGE_MIN_SAMPLES):
+        self.percentile = percentile
+        self.budget = budget
+        self.max_burst = max_burst
+        self.min_samples = min_samples
+        self.trackers: Dict[str, LatencyTracker] = {}
+        self.tokens = 0.0
+        self.stats = {"calls": 0, "hedged": 0, "hedge_wins": 0, "over_budget": 0, "seconds_saved": 0.0}
+
+    def _tracker(self, key: str) -> LatencyTracker:
+        if key not in self.trackers:
+            self.trackers[key] = LatencyTracker()
+        return self.trackers[key]
+
+    def hedge_delay(self, key: str) -> Optional[float]:
+        """Seconds after which a call to key is hedged, or None until enough latencies are known."""
+        tracker = self._tracker(key)
+        if len(tracker.samples) < max(1, self.min_samples):
+            return None
+        return tracker.percentile(self.percentile)
+
+    async def _timed(self, key: str, make_call: Callable[[], Awaitable[Any]]) -> Any:
+        start = time.monotonic()
+        result = await make_call()
+        self._tracker(key).record(time.monotonic() - start)
+        return result
+
+    async def run(self, key: str, make_call: Callable[[], Awaitable[Any]]) -> Any:
+        """Await make_call(), hedging it with a second make_call() if it runs long."""
+        self.stats["calls"] += 1
+        self.tokens = min(self.max_burst, self.tokens + self.budget)
+        delay = self.hedge_delay(key)
+        start = time.monotonic()
+        primary = asyncio.ensure_future(self._timed(key, make_call))
+        if delay is None:
+            return await primary
+
+        attempts = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+            if self.tokens < 1:
+                self.stats["over_budget"] += 1
+                return await primary
+            self.tokens -= 1
+            self.stats["hedged"] += 1
+            hedge = asyncio.ensure_future(self._timed(key, make_call))
+            attempts.append(hedge)
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        if attempt is hedge:
+                            elapsed = time.monotonic() - start
+                            self.stats["hedge_wins"] += 1
+                            # The primary would have run at least this long; estimate by the
+                            # mean of the recorded calls that were slower still
+                            self.stats["seconds_saved"] += self._tracker(key).expected_beyond(elapsed) - elapsed
+                        return attempt.result()
+            # Both attempts failed: surface the primary's error
+            return primary.result()
+        finally:
+            # The losing attempt, or both if the caller was cancelled
+            for attempt in attempts:
+                if not attempt.done():
+                    attempt.cancel()
+
+    async def create(self, client, endpoint: str, lane: str = BULK, hedge: bool = True, deadline=None, **kwargs):
+        """openai_scheduler.create, hedged per endpoint and model when hedge is set."""
+        def make_call():
+            return openai_scheduler.create(client, endpoint, lane, deadline=deadline, **kwargs)
+
+        if not hedge:
+            return await make_call()
+        return await self.run(f"{endpoint}:{kwargs.get('model', '')}", make_call)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Hedge rate, wins and estimated latency saved, for the metrics endpoint."""
+        calls = max(1, self.stats["calls"])
+        return {
+            **self.stats,
+            "hedge_rate": self.stats["hedged"] / calls,
+            "hedge_win_rate": self.stats["hedge_wins"] / max(1, self.stats["hedged"]),
+            "hedge_delay_seconds": {key: self.hedge_delay(key) for key in self.trackers}
+        }
+
+
+hedger = Hedger()
@@ -0,0 +1,83 @@
+import json
+import time
+import hashlib
+import sqlite3
+from typing import Any, Dict, Optional
+from sqlite_pool import get_pool
+from config import LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_MAX_AGE_DAYS, EXTRACTION_PROMPT_VERSION
+
+
+class LLMResponseCache:
+    """SQLite-backed cache of parsed extraction results keyed by a prompt fingerprint.
+
+    The fingerprint covers everything that determines the response: the model, the
+    response schema, the field and its prompt version, and the formatted chunk XML.
+    Re-extracting an unchanged document, or one whose retrieved pages are identical
+    boilerplate, is then served without an API call.
+    """
+
+    def __init__(self, db_path: str = LLM_CACHE_PATH, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 max_age_days: float = LLM_CACHE_MAX_AGE_DAYS):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 24 * 60 * 60
+        self.pool = get_pool(db_path)
+        self._init_db()
+
+    def _init_db(self):
+        """Create the cache table if it doesn't exist."""
+        with self.pool.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    field TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used_at)')
+
+    @staticmethod
+    def key(model: str, schema: Dict[str, Any], field: str, doc_type: str, chunks_xml: str,
+            prompt_version: int = EXTRACTION_PROMPT_VERSION) -> str:
+        """Fingerprint of an extraction request: model, schema hash, field spec version and chunk XML hash."""
+        schema_hash = hashlib.sha256(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest()
+        chunks_hash = hashlib.sha256(chunks_xml.encode("utf-8")).hexdigest()
+        spec = f"{model}\n{schema_hash}\n{doc_type}:{field}:v{prompt_version}\n{chunks_hash}"
+        return hashlib.sha256(spec.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the stored result for key, or None on a miss or an expired entry."""
+        now = time.time()
+        row = self.pool.fetchone(
+            'SELECT result FROM llm_cache WHERE key = ? AND created_at >= ?',
+            (key, now - self.max_age_seconds)
+        )
+        if row is None:
+            return None
+        # Refresh recency so documents that are re-run often survive eviction
+        with self.pool.transaction() as conn:
+            conn.execute('UPDATE llm_cache SET last_used_at = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+
+    def put(self, key: str, field: str, result: Dict[str, Any]) -> None:
+        """Store a parsed result, then evict expired and least recently used entries."""
+        now = time.time()
+        with self.pool.transaction() as conn:
+            c = conn.cursor()
+            c.execute(
+                'INSERT OR REPLACE INTO llm_cache (key, field, result, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)',
+                (key, field, json.dumps(result), now, now)
+            )
+            self._evict(c, now)
+
+    def _evict(self, c: sqlite3.Cursor, now: float) -> None:
+        """Delete entries older than max_age, then the least recently used beyond max_entries."""
+        c.execute('DELETE FROM llm_cache WHERE created_at < ?', (now - self.max_age_seconds,))
+        c.execute('SELECT COUNT(*) FROM llm_cache')
+        excess = c.fetchone()[0] - self.max_entries
+        if excess > 0:
+            c.execute('''
+                DELETE FROM llm_cache WHERE rowid IN (
+                    SELECT rowid FROM llm_cache ORDER BY last_used_at ASC LIMIT ?
+                )''', (excess,))
@@ -15,9 +15,23 @@ from chunking import CustomChunking
 from batch_embedding import AsyncEmbeddingGenerator
 from result_database import ResultDatabase
 from rag_chatbot import RAGChatbot
-import sqlite3
 import glob
 from result_database import ResultDatabase
+from query_embedding_cache import warm_static_query_embeddings
+from config import (
+    VECTOR_STORE_SNAPSHOT_DIR,
+    SOW_FIELDS_TO_EXTRACT,
+    MSA_FIELDS_TO_EXTRACT,
+    UPLOAD_RESPONSE_DEADLINE_SECONDS,
+    UPLOAD_JOB_DEADLINE_SECONDS
+)
+from db_executor import run_db
+from openai_scheduler import openai_scheduler
+from hedging import hedger
+from contextlib import asynccontextmanager
+from openai_clients import OpenAIClients
+from deadline import Deadline, DeadlineExceeded
+from upload_jobs import UploadJob, register_job, release_job, get_running_job, COMPLETED, TIMED_OUT, FAILED
 import json
 
 # Configure logging
@@ -30,8 +44,35 @@ def get_cors_headers():
         "Access-Control-Allow-Headers": "*",
     }
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # A fresh instance starts from the latest vector store snapshot, with its indexes warm
+    if VECTOR_STORE_SNAPSHOT_DIR:
+        try:
+            await run_db(DatabaseHandler.restore_snapshot, VECTOR_STORE_SNAPSHOT_DIR, "vector_store.db")
+        except Exception as e:
+            logger.error(f"Error restoring vector store snapshot: {str(e)}")
+
+    # One set of OpenAI clients, and so one HTTP connection pool, serves every request
+    try:
+        app.state.openai_clients = OpenAIClients()
+    except Exception as e:
+        logger.error(f"Error creating OpenAI clients; components will create their own: {str(e)}")
+        app.state.openai_clients = None
+
+    # Load (or compute once) the embeddings of the static field queries before serving
+    if app.state.openai_clients is not None:
+        await warm_static_query_embeddings(app.state.openai_clients.async_client)
+    else:
+        logger.error("Skipping static query embedding warm-up: no OpenAI client")
+    try:
+        yield
+    finally:
+        if app.state.openai_clients is not None:
+            await app.state.openai_clients.aclose()
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS middleware
 app.add_middleware(
@@ -129,6 +170,8 @@ def sow_transform_response(response: list) -> list:
         confidence = value_dict.get('confidence', None)
         reasoning = value_dict.get('reasoning', None)
         proof = value_dict.get('proof', None)
+        # "pending" or "timed_out" for fields not extracted when the response was built
+        status = value_dict.get('status', 'completed')
 
         # -- Perform your custom transformations on `value` --
         if field == 'currency' and value == 'Rs':
@@ -164,7 +207,8 @@ def sow_transform_response(response: list) -> list:
             'page_number': page_number,
             'confidence': confidence,
             'reasoning': reasoning,
-            'proof': proof
+            'proof': proof,
+            'status': status
         })
     return transformed
     
@@ -255,6 +299,8 @@ def msa_transform_response(response: list) -> list:
         confidence = value_dict.get('confidence', None)
         reasoning = value_dict.get('reasoning', None)
         proof = value_dict.get('proof', None)
+        # "pending" or "timed_out" for fields not extracted when the response was built
+        status = value_dict.get('status', 'completed')
 
         # -- Perform your custom transformations on `value` --
         if field == 'currency' and value == 'Rs':
@@ -283,7 +329,8 @@ def msa_transform_response(response: list) -> list:
                 'page_number': page_number,
                 'confidence': confidence,
                 'reasoning': reasoning,
-                'proof': proof
+                'proof': proof,
+                'status': status
             })
             
             # Add all other insurance fields
@@ -295,7 +342,8 @@ def msa_transform_response(response: list) -> list:
                         'page_number': page_number,
                         'confidence': confidence,
                         'reasoning': reasoning,
-                        'proof': proof
+                        'proof': proof,
+                        'status': status
                     })
             continue
         elif value in ['', None]:
@@ -317,7 +365,8 @@ def msa_transform_response(response: list) -> list:
                 'page_number': page_number,
                 'confidence': confidence,
                 'reasoning': reasoning,
-                'proof': proof
+                'proof': proof,
+                'status': status
             })
     return transformed
 
@@ -329,6 +378,76 @@ async def root():
         headers=get_cors_headers()
     )
 
+async def run_upload_job(job: UploadJob, file_path: str, force_reextract: bool) -> list:
+    """Parse, embed and extract an upload within the job deadline; job.values fills in as fields finish."""
+    # Initialize components; retrieval is scoped to this document's chunks.
+    # SQLite work runs on the DB executor so other requests keep being served.
+    openai_clients = app.state.openai_clients
+    async_client = openai_clients.async_client if openai_clients else None
+    # force_reextract skips cached LLM results, e.g. after the prompts were corrected
+    rag = await run_db(SQLiteOpenAIRAG, document_id=job.document_id, bypass_llm_cache=force_reextract,
+                       async_client=async_client, deadline=job.deadline)
+    job.values = rag.completed
+    chunker = CustomChunking(overlap_words=50)
+
+    # Vectors are computed once per document and reused for every later upload and chat
+    if await run_db(rag.db_handler.has_complete_document, job.document_id):
+        count = await run_db(rag.db_handler.get_chunks_count, job.document_id)
+        logger.info(f"Reusing {count} stored chunks for document {job.document_id}")
+        # Chat without a document_id falls back to the latest upload, which this now is
+        await run_db(rag.db_handler.touch_document, job.document_id)
+    else:
+        # PDF parsing is CPU-bound; keep it off the event loop and out of the DB pool.
+        # A parse still running at the deadline is abandoned, not interrupted.
+        chunked_docs = await asyncio.to_thread(chunker.load_documents, file_path)
+        if not chunked_docs:
+            logger.error(f"Failed to load document: {file_path}")
+            print("Failed to load document: ", file_path)
+
+        if chunked_docs:
+            embedding_generator = await run_db(AsyncEmbeddingGenerator, client=async_client, deadline=job.deadline)
+            embedded_docs = await embedding_generator.embed_chunks(chunked_docs)
+            for failed_chunk in embedding_generator.failed_chunks:
+                logger.warning(f"Chunk from page {failed_chunk['page_number']} was not embedded: {failed_chunk['error']}")
+
+            # Stored so this upload can still be extracted, but marked incomplete so the
+            # next upload of the file embeds the missing pages instead of reusing these vectors
+            complete = not embedding_generator.failed_chunks
+            if not complete:
+                logger.warning(f"Storing document {job.document_id} as incomplete; it will be re-embedded on the next upload")
+            await run_db(rag.db_handler.replace_document, job.document_id, embedded_docs, file_name=job.file_name,
+                         doc_type=job.doc_type, complete=complete)
+            logger.info(f"Stored {len(embedded_docs)} chunks in SQLite database")
+            print(f"Stored {len(embedded_docs)} chunks in SQLite database.")
+        else:
+            logger.error("Embedding and chunk uploading failed. No chunks were loaded")
+            print("Embedding and chunk Uploading Failed. No chunks were loaded")
+
+    return await rag.extract_all_fields(doc_type=job.doc_type)
+
+async def finish_upload_job(job: UploadJob, db: ResultDatabase):
+    """Wait for an upload's pending fields until the job deadline, then store the ones that finished."""
+    try:
+        # Cancels the remaining retrieval and extraction calls at the deadline
+        await job.deadline.run(job.task)
+        job.finish(COMPLETED)
+    except DeadlineExceeded:
+        job.finish(TIMED_OUT)
+    except Exception as e:
+        logger.error(f"Error finishing upload job {job.job_id}: {str(e)}")
+        job.finish(FAILED, str(e))
+
+    finished = [field for field in job.stragglers if field in job.values]
+    logger.info(f"Upload job {job.job_id} {job.status}: {len(finished)}/{len(job.stragglers)} pending fields finished")
+    try:
+        if finished:
+            await run_db(db.update_results, job.db_id, job.results(finished), job.doc_type)
+        await run_db(db.save_upload_job, job.to_record())
+    except Exception as e:
+        logger.error(f"Error storing pending fields of upload job {job.job_id}: {str(e)}")
+    finally:
+        release_job(job)
+
 @app.options("/upload")
 async def options_upload():
     """Handle preflight requests for the upload endpoint"""
@@ -340,8 +459,10 @@ async def options_upload():
 @app.post("/upload")
 async def upload_file(
     file: UploadFile = File(...),
-    pdfType: str = Form(...)
+    pdfType: str = Form(...),
+    forceReextract: bool = Form(False)
 ):
+    response_deadline = Deadline(UPLOAD_RESPONSE_DEADLINE_SECONDS)
     try:
         # Create contract_file directory if it doesn't exist
         os.makedirs("contract_file", exist_ok=True)
@@ -354,62 +475,60 @@ async def upload_file(
         
         # Save uploaded file
         file_path = os.path.join("contract_file", file.filename)
+        file_bytes = await file.read()
         with open(file_path, "wb") as f:
-            f.write(await file.read())
-        
-        # Initialize components
-        rag = SQLiteOpenAIRAG()
-        chunker = CustomChunking(overlap_words=50)
-        db = ResultDatabase()
-
-        logger.info(f"Processing {pdfType} document: {file.filename}")
+            f.write(file_bytes)
         
-        chunked_docs = chunker.load_documents(file_path)
-        if not chunked_docs:
-            logger.error(f"Failed to load document: {file_path}")
-            print("Failed to load document: ", file_path)
-
-        conn = sqlite3.connect(rag.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM document_chunks')
-        count = cursor.fetchone()[0]
-        logger.info(f"Current document chunks in database: {count}")
-
-        # check if we are storing new documents else delete the document chunks from the database and store new ones
-        embedding_generator = AsyncEmbeddingGenerator();
-        embedded_docs = await embedding_generator.embed_chunks(chunked_docs)
-        
-        if count == 0 and chunked_docs:
-            logger.info("Storing first set of document chunks")
-            rag.db_handler.store_chunked_docs(embedded_docs)
-        elif chunked_docs:
-            logger.info("Replacing existing document chunks")
-            cursor.execute('DELETE FROM document_chunks;')
-            conn.commit()
-            rag.db_handler.store_chunked_docs(embedded_docs)
+        document_id = DatabaseHandler.compute_document_id(file_bytes)
+        fields = MSA_FIELDS_TO_EXTRACT if pdfType == "MSA" else SOW_FIELDS_TO_EXTRACT
+        job = UploadJob(fields, pdfType, file.filename, document_id, Deadline(UPLOAD_JOB_DEADLINE_SECONDS))
+        register_job(job)
+        logger.info(f"Processing {pdfType} document: {file.filename} (document_id: {document_id}, job_id: {job.job_id})")
+        job.task = asyncio.create_task(run_upload_job(job, file_path, forceReextract))
+
+        # Answer within the response deadline. Fields still running then are marked
+        # pending and keep running in the background until the job deadline.
+        try:
+            await response_deadline.run(asyncio.shield(job.task))
+        except DeadlineExceeded:
+            job.stragglers = job.pending_fields()
+            logger.warning(f"Response deadline reached with {len(job.stragglers)} fields pending (job_id: {job.job_id})")
+        except Exception as e:
+            job.finish(FAILED, str(e))
+            release_job(job)
+            raise
         else:
-            logger.error(f"Embedding and chunk uploading failed. Chunk count: {len(chunked_docs)}")
-            print(f"Embedding and chunk Uploading Failed. {len(chunked_docs)}")
-
-        conn.close()
-        logger.info(f"Stored {len(chunked_docs)} chunks in SQLite database")
-        print(f"Stored {len(chunked_docs)} chunks in SQLite database.")
-
-        results = await rag.extract_all_fields(doc_type=pdfType)
-        logger.info(f"Extracted {len(results)} fields from document")
+            job.finish(COMPLETED)
+        results = job.task.result() if job.task.done() else job.results()
+        logger.info(f"Extracted {len(results) - len(job.stragglers)} fields from document")
         print(results)
 
-        db_id = db.store_results(results, doc_type=pdfType, file_name=file.filename)
+        db = await run_db(ResultDatabase)
+        db_id = await run_db(db.store_results, results, doc_type=pdfType, file_name=file.filename)
+        job.db_id = db_id
         logger.info(f"Stored results in database with db_id: {db_id}")
-        
+        # Saved so that whichever worker gets the follow-up poll can answer it
+        await run_db(db.save_upload_job, job.to_record())
+        if job.stragglers:
+            job.finisher = asyncio.create_task(finish_upload_job(job, db))
+        else:
+            release_job(job)
+
         # Transform response based on document type
         if pdfType == "SOW":
             transformed_data = sow_transform_response(results)
         else:
             transformed_data = msa_transform_response(results)
 
-        # add db_id to the response
-        transformed_data = {'db_id': db_id, 'extracted_data': transformed_data}
+        # add db_id and document_id to the response, and the job to poll for pending fields
+        transformed_data = {
+            'db_id': db_id,
+            'document_id': document_id,
+            'job_id': job.job_id,
+            'status': job.status,
+            'pending_fields': job.stragglers,
+            'extracted_data': transformed_data
+        }
         logger.info(f"Returning transformed data with db_id: {db_id}")
 
         print(f"Final response: {transformed_data}")
@@ -430,12 +549,38 @@ async def upload_file(
         print(f"Error processing file: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
         
+@app.get("/upload/{job_id}/pending")
+async def get_pending_fields(job_id: str):
+    """Fields of an upload that were pending when it responded, with their values once finished."""
+    # Live values when this worker runs the job, else the state saved by the worker that does
+    job = get_running_job(job_id)
+    if job is None:
+        db = await run_db(ResultDatabase)
+        record = await run_db(db.get_upload_job, job_id)
+        if record is None:
+            raise HTTPException(status_code=404, detail="Upload job not found")
+        job = UploadJob.from_record(record)
+    transform = sow_transform_response if job.doc_type == "SOW" else msa_transform_response
+    return JSONResponse(
+        content={
+            'db_id': job.db_id,
+            'document_id': job.document_id,
+            'job_id': job.job_id,
+            'status': job.status,
+            'pending_fields': [field for field in job.stragglers if field not in job.values],
+            'error': job.error,
+            'extracted_data': transform(job.results(job.stragglers))
+        },
+        headers=get_cors_headers()
+    )
+
 @app.post("/update")
 async def update_field(request: UpdateFieldRequest):
     """Update a field value in both detailed and simple tables."""
     try:
-        db = ResultDatabase()
-        success = db.update_sow_msa_detailed_simple_table(            
+        db = await run_db(ResultDatabase)
+        success = await run_db(
+            db.update_sow_msa_detailed_simple_table,
             db_id=request.db_id,
             field=request.field,
             value=request.value,
@@ -462,6 +607,58 @@ async def update_field(request: UpdateFieldRequest):
 
 
 
+@app.get("/documents")
+async def list_documents():
+    """List documents whose vectors are stored."""
+    try:
+        db_handler = await run_db(DatabaseHandler, "vector_store.db")
+        documents = await run_db(db_handler.list_documents)
+        return JSONResponse(content={"documents": documents}, headers=get_cors_headers())
+    except Exception as e:
+        print(f"Error listing documents: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/documents/{document_id}")
+async def delete_document(document_id: str):
+    """Delete a document's stored chunks and vectors."""
+    try:
+        db_handler = await run_db(DatabaseHandler, "vector_store.db")
+        if not await run_db(db_handler.has_document, document_id):
+            raise HTTPException(status_code=404, detail="Document not found")
+        await run_db(db_handler.delete_document, document_id)
+        return JSONResponse(
+            content={"success": True, "message": "Document deleted successfully"},
+            headers=get_cors_headers()
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error deleting document: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metrics/openai")
+async def openai_metrics():
+    """Queue depth, wait times and adaptive limits of the OpenAI request scheduler, and hedging stats."""
+    metrics = {**openai_scheduler.metrics(), "hedging": hedger.metrics()}
+    return JSONResponse(content=metrics, headers=get_cors_headers())
+
+@app.post("/vector-store/snapshot")
+async def snapshot_vector_store():
+    """Write a snapshot of the vector store for new instances to restore at startup."""
+    if not VECTOR_STORE_SNAPSHOT_DIR:
+        raise HTTPException(status_code=400, detail="VECTOR_STORE_SNAPSHOT_DIR is not configured")
+    try:
+        db_handler = await run_db(DatabaseHandler, "vector_store.db")
+        await run_db(db_handler.snapshot, VECTOR_STORE_SNAPSHOT_DIR)
+        return JSONResponse(
+            content={"success": True, "message": f"Snapshot written to {VECTOR_STORE_SNAPSHOT_DIR}"},
+            headers=get_cors_headers()
+        )
+    except Exception as e:
+        print(f"Error writing vector store snapshot: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/rag-chat")
 async def rag_chat(request: Request):
     print("Received request to /rag-chat")
@@ -496,17 +693,31 @@ async def rag_chat(request: Request):
         
         query = data["query"]
         session_id = data.get("session_id")
+        # Chat about a specific uploaded document, defaulting to the latest one
+        document_id = data.get("document_id")
+        # "corpus" searches across every stored contract instead of one document
+        scope = data.get("scope", "document")
+        if scope not in ("document", "corpus"):
+            return JSONResponse(
+                content={"error": "scope must be 'document' or 'corpus'"},
+                status_code=400,
+                headers=cors_headers
+            )
         
-        print(f"Processing chat request - query: {query}, session_id: {session_id}")
+        print(f"Processing chat request - query: {query}, session_id: {session_id}, document_id: {document_id}, scope: {scope}")
         
-        chatbot = RAGChatbot()
+        openai_clients = app.state.openai_clients
+        chatbot = await run_db(RAGChatbot, document_id=document_id, scope=scope,
+                               client=openai_clients.client if openai_clients else None)
         
         if session_id == "first_session":
             print("First session, resetting conversation")
             session_id = None
-            chatbot._delete_conversation_db()
+            await run_db(chatbot._delete_conversation_db)
         
-        response = chatbot.chat(query)
+        # The chat pipeline is synchronous (OpenAI calls plus SQLite), so run it in a
+        # worker thread; it is kept off the DB pool since it mostly waits on the API
+        response = await asyncio.to_thread(chatbot.chat, query)
         print(f"Generated response: {response}")
         
         return JSONResponse(
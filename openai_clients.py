@@ -0,0 +1,62 @@
+import os
+import importlib.util
+from typing import Optional
+import httpx
+from openai import AsyncOpenAI, OpenAI
+from config import (
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    OPENAI_KEEPALIVE_EXPIRY,
+    OPENAI_TIMEOUT,
+    OPENAI_CONNECT_TIMEOUT,
+    OPENAI_HTTP2
+)
+
+
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+class OpenAIClients:
+    """Async and sync OpenAI clients shared by every request for the app's lifetime.
+
+    Each wraps one httpx connection pool, so calls reuse open keep-alive
+    connections instead of paying a TCP and TLS handshake per component per
+    request. Created in the FastAPI lifespan and closed on shutdown.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 http2: bool = OPENAI_HTTP2, max_connections: int = OPENAI_MAX_CONNECTIONS,
+                 max_keepalive_connections: int = OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry: float = OPENAI_KEEPALIVE_EXPIRY, timeout: float = OPENAI_TIMEOUT,
+                 max_retries: int = 3):
+        if http2 and not _http2_available():
+            print("HTTP/2 requested but the h2 package is not installed; using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        http_timeout = httpx.Timeout(timeout, connect=OPENAI_CONNECT_TIMEOUT)
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.async_client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=http_timeout,
+            max_retries=max_retries,
+            http_client=httpx.AsyncClient(limits=limits, timeout=http_timeout, http2=http2)
+        )
+        self.client = OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=http_timeout,
+            max_retries=max_retries,
+            http_client=httpx.Client(limits=limits, timeout=http_timeout, http2=http2)
+        )
+
+    async def aclose(self) -> None:
+        """Close both connection pools."""
+        await self.async_client.close()
+        self.client.close()
@@ -0,0 +1,323 @@
+import re
+import time
+import random
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from config import (
+    OPENAI_REQUESTS_PER_MINUTE,
+    OPENAI_TOKENS_PER_MINUTE,
+    OPENAI_INITIAL_CONCURRENCY,
+    OPENAI_MAX_CONCURRENCY,
+    OPENAI_MIN_CONCURRENCY,
+    OPENAI_MAX_RETRIES,
+    OPENAI_COMPLETION_TOKEN_ESTIMATE,
+    OPENAI_TIMEOUT
+)
+
+# Lanes in priority order: chat turns are served before queued bulk extraction
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+# Errors worth retrying after backing off; anything else goes straight to the caller
+_RETRYABLE = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+
+def estimate_request_tokens(endpoint: str, kwargs: Dict[str, Any]) -> int:
+    """Tokens a request counts against the per-minute limit: its input plus expected output.
+
+    Uses the same ~3 characters per token as the embedding batcher.
+    """
+    if endpoint == "embeddings":
+        inputs = kwargs.get("input", "")
+        text = inputs if isinstance(inputs, str) else "".join(inputs)
+        return (len(text) + 2) // 3
+    text = "".join(str(message.get("content", "")) for message in kwargs.get("messages", []))
+    return (len(text) + 2) // 3 + kwargs.get("max_tokens", OPENAI_COMPLETION_TOKEN_ESTIMATE)
+
+
+def _error_headers(error: Exception):
+    response = getattr(error, "response", None)
+    return response.headers if response is not None else None
+
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds in a rate-limit reset header such as "1s", "6m0s" or "20ms"."""
+    if not value:
+        return None
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|s|m|h)", value):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds
+
+
+class TokenBucket:
+    """Refills at per_minute / 60 per second up to one minute's worth."""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.available = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.per_minute, self.available + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount is available; 0 if it is available now."""
+        self._refill()
+        # A request larger than the whole bucket waits for a full bucket instead of forever
+        amount = min(amount, self.per_minute)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) * 60 / self.per_minute
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.available -= min(amount, self.per_minute)
+
+    def sync(self, limit: Optional[str], remaining: Optional[str]) -> None:
+        """Adopt the limit and remaining count the API reported."""
+        if limit and limit.isdigit():
+            self.per_minute = float(limit)
+        if remaining and remaining.isdigit():
+            self._refill()
+            self.available = min(self.available, float(remaining))
+
+
+class _Waiter:
+    def __init__(self, future: asyncio.Future, model: str, tokens: int):
+        self.future = future
+        self.model = model
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+
+
+class OpenAIScheduler:
+    """Process-wide admission control for every OpenAI API call.
+
+    Calls queue in priority lanes and are admitted while (1) fewer than the current
+    concurrency limit are in flight and (2) the model's request and token buckets
+    allow it. The buckets follow the x-ratelimit-* response headers. The
+    concurrency limit adapts by AIMD: +1 per limit's worth of successful calls,
+    halved on a rate-limit response. Rate limits, timeouts and server errors are
+    retried here with backoff, so the clients are used with their own retries off.
+    """
+
+    def __init__(self, requests_per_minute: int = OPENAI_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = OPENAI_TOKENS_PER_MINUTE,
+                 initial_concurrency: int = OPENAI_INITIAL_CONCURRENCY,
+                 max_concurrency: int = OPENAI_MAX_CONCURRENCY,
+                 min_concurrency: int = OPENAI_MIN_CONCURRENCY,
+                 max_retries: int = OPENAI_MAX_RETRIES):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self._reset(None)
+
+    def _reset(self, loop: Optional[asyncio.AbstractEventLoop]) -> None:
+        self._loop = loop
+        self.limit = float(self.initial_concurrency)
+        self.in_flight = 0
+        self._queues: Dict[str, Deque[_Waiter]] = {lane: deque() for lane in LANES}
+        self._buckets: Dict[str, Dict[str, TokenBucket]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._last_decrease = 0.0
+        self._stats = {
+            lane: {"submitted": 0, "completed": 0, "failed": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+            for lane in LANES
+        }
+        self._rate_limited = 0
+        self._retries = 0
+
+    def _bind_loop(self) -> None:
+        """Attach to the running loop; a new loop (e.g. another asyncio.run) starts afresh."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._reset(loop)
+
+    def _model_buckets(self, model: str) -> Dict[str, TokenBucket]:
+        if model not in self._buckets:
+            self._buckets[model] = {
+                "requests": TokenBucket(self.requests_per_minute),
+                "tokens": TokenBucket(self.tokens_per_minute)
+            }
+        return self._buckets[model]
+
+    # ---------------------------------------------------------------- admission
+
+    def _dispatch(self) -> None:
+        """Admit queued calls, highest-priority lane first, while capacity allows."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        retry_in = None
+        for lane in LANES:
+            queue = self._queues[lane]
+            while queue and self.in_flight < int(self.limit):
+                waiter = queue[0]
+                if waiter.future.done():
+                    queue.popleft()
+                    continue
+                buckets = self._model_buckets(waiter.model)
+                wait = max(buckets["requests"].wait_time(1), buckets["tokens"].wait_time(waiter.tokens))
+                if wait > 0:
+                    retry_in = wait if retry_in is None else min(retry_in, wait)
+                    break
+                queue.popleft()
+                buckets["requests"].take(1)
+                buckets["tokens"].take(waiter.tokens)
+                self.in_flight += 1
+                waited = time.monotonic() - waiter.enqueued_at
+                self._stats[lane]["wait_seconds"] += waited
+                self._stats[lane]["max_wait_seconds"] = max(self._stats[lane]["max_wait_seconds"], waited)
+                waiter.future.set_result(None)
+        if retry_in is not None:
+            self._timer = self._loop.call_later(retry_in, self._dispatch)
+
+    async def _acquire(self, lane: str, model: str, tokens: int) -> None:
+        self._bind_loop()
+        self._stats[lane]["submitted"] += 1
+        waiter = _Waiter(self._loop.create_future(), model, tokens)
+        self._queues[lane].append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            # Cancelled after admission: hand the slot back
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(lane, model, False)
+            raise
+
+    def _release(self, lane: str, model: str, succeeded: bool, rate_limited: bool = False, headers=None) -> None:
+        self.in_flight -= 1
+        self._stats[lane]["completed" if succeeded else "failed"] += 1
+        if headers is not None and model in self._buckets:
+            buckets = self._buckets[model]
+            buckets["requests"].sync(headers.get("x-ratelimit-limit-requests"), headers.get("x-ratelimit-remaining-requests"))
+            buckets["tokens"].sync(headers.get("x-ratelimit-limit-tokens"), headers.get("x-ratelimit-remaining-tokens"))
+        if rate_limited:
+            self._rate_limited += 1
+            # One decrease per second, so a burst of 429s does not collapse the limit
+            now = time.monotonic()
+            if now - self._last_decrease > 1.0:
+                self.limit = max(float(self.min_concurrency), self.limit / 2)
+                self._last_decrease = now
+        elif succeeded:
+            self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+        self._dispatch()
+
+    @staticmethod
+    def _backoff(attempt: int, error: Exception) -> float:
+        """Retry-After when the API sent one, else exponential backoff with jitter."""
+        response = getattr(error, "response", None)
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after and retry_after.replace(".", "", 1).isdigit():
+                return min(float(retry_after), 30.0)
+            reset = _parse_duration(response.headers.get("x-ratelimit-reset-requests"))
+            if reset:
+                return min(reset, 30.0)
+        return min(0.5 * 2 ** attempt, 8.0) * (0.5 + random.random())
+
+    # ---------------------------------------------------------------- calls
+
+    @staticmethod
+    def _resource(client, endpoint: str):
+        """The client's raw-response create method for an endpoint such as "chat.completions"."""
+        resource = client.with_options(max_retries=0)
+        for part in endpoint.split("."):
+            resource = getattr(resource, part)
+        return resource.with_raw_response.create
+
+    async def create(self, client, endpoint: str, lane: str = BULK, deadline=None, **kwargs):
+        """Make an async client call through the scheduler and return the parsed response.
+
+        With a deadline, each attempt's timeout is cut to the time left and no retry
+        is made that could not finish in time.
+        """
+        create = self._resource(client, endpoint)
+        model = kwargs.get("model", "")
+        tokens = estimate_request_tokens(endpoint, kwargs)
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(lane, model, tokens)
+            if deadline is not None:
+                kwargs["timeout"] = deadline.timeout(OPENAI_TIMEOUT)
+            try:
+                raw = await create(**kwargs)
+            except _RETRYABLE as e:
+                self._release(lane, model, False, isinstance(e, RateLimitError), _error_headers(e))
+                backoff = self._backoff(attempt, e)
+                if attempt == self.max_retries or (deadline is not None and backoff >= deadline.remaining()):
+                    raise
+                self._retries += 1
+                await asyncio.sleep(backoff)
+                continue
+            except BaseException:
+                self._release(lane, model, False)
+                raise
+            self._release(lane, model, True, headers=raw.headers)
+            return raw.parse()
+
+    def create_sync(self, client, endpoint: str, lane: str = INTERACTIVE, **kwargs):
+        """Make a sync client call from a worker thread, admitted by the scheduler's event loop.
+
+        Without a running scheduler loop (e.g. in a script) the call goes out directly.
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed() or not loop.is_running():
+            return self._resource(client, endpoint)(**kwargs).parse()
+
+        create = self._resource(client, endpoint)
+        model = kwargs.get("model", "")
+        tokens = estimate_request_tokens(endpoint, kwargs)
+        for attempt in range(self.max_retries + 1):
+            asyncio.run_coroutine_threadsafe(self._acquire(lane, model, tokens), loop).result()
+            try:
+                raw = create(**kwargs)
+            except _RETRYABLE as e:
+                loop.call_soon_threadsafe(self._release, lane, model, False, isinstance(e, RateLimitError), _error_headers(e))
+                if attempt == self.max_retries:
+                    raise
+                self._retries += 1
+                time.sleep(self._backoff(attempt, e))
+                continue
+            except BaseException:
+                loop.call_soon_threadsafe(self._release, lane, model, False)
+                raise
+            loop.call_soon_threadsafe(self._release, lane, model, True, False, raw.headers)
+            return raw.parse()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Queue depth, wait times and the adaptive limit, for the metrics endpoint."""
+        return {
+            "concurrency_limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "rate_limited": self._rate_limited,
+            "retries": self._retries,
+            "lanes": {
+                lane: {
+                    "queue_depth": len(self._queues[lane]),
+                    "submitted": stats["submitted"],
+                    "completed": stats["completed"],
+                    "failed": stats["failed"],
+                    "mean_wait_seconds": stats["wait_seconds"] / max(1, stats["completed"] + stats["failed"]),
+                    "max_wait_seconds": stats["max_wait_seconds"]
+                }
+                for lane, stats in self._stats.items()
+            },
+            "models": {
+                model: {name: {"per_minute": bucket.per_minute, "available": int(bucket.available)}
+                        for name, bucket in buckets.items()}
+                for model, buckets in self._buckets.items()
+            }
+        }
+
+
+openai_scheduler = OpenAIScheduler()
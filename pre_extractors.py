@@ -0,0 +1,160 @@
+import re
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Characters of context kept on each side of a match as its proof
+_PROOF_CONTEXT_CHARS = 80
+
+_MONTHS = r"(?:Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|June?|July?|Aug(?:ust)?|Sep(?:t(?:ember)?)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)"
+# "January 1, 2024", "1st January, 2024", "1 Jan 2024" and "2024-01-01"; numeric
+# day/month orders are left to the LLM since 01/02/2024 is ambiguous
+_DATE = (
+    rf"(?:{_MONTHS}\.?\s+\d{{1,2}}(?:st|nd|rd|th)?,?\s+\d{{4}}"
+    rf"|\d{{1,2}}(?:st|nd|rd|th)?(?:\s+day\s+of)?\s+{_MONTHS}\.?,?\s+\d{{4}}"
+    r"|\d{4}-\d{2}-\d{2})"
+)
+_IDENTIFIER = r"([A-Z0-9][A-Z0-9\-/_.]*)"
+
+
+class PatternExtractor:
+    """Regex fast path for one field, run over a document's chunks before any LLM call.
+
+    normalize turns a match into the field value, or None to ignore the match. When
+    every match agrees on one value it gets confidence, however often the document
+    repeats it (currency, payment terms and SOW numbers in page headers do). When
+    matches disagree the most frequent value gets ambiguous_confidence, which is
+    below PRE_EXTRACTION_MIN_CONFIDENCE so the LLM extracts the field instead.
+    """
+
+    def __init__(self, field: str, pattern: str, normalize: Callable[[re.Match], Any],
+                 flags: int = re.IGNORECASE, confidence: int = 9, ambiguous_confidence: int = 5):
+        self.field = field
+        self.pattern = re.compile(pattern, flags)
+        self.normalize = normalize
+        self.confidence = confidence
+        self.ambiguous_confidence = ambiguous_confidence
+
+    def candidates(self, chunks: List[Dict]) -> List[Tuple[Any, int, str]]:
+        """(value, page number, proof) for every match in the chunks."""
+        found = []
+        for chunk in chunks:
+            text = chunk["chunk"]
+            for match in self.pattern.finditer(text):
+                value = self.normalize(match)
+                if value:
+                    proof = text[max(0, match.start() - _PROOF_CONTEXT_CHARS):match.end() + _PROOF_CONTEXT_CHARS]
+                    found.append((value, chunk["page_number"], ' '.join(proof.split())))
+        return found
+
+    def extract(self, chunks: List[Dict]) -> Optional[Dict]:
+        """Result in the extraction schema's shape if the matches are unambiguous, else None."""
+        found = self.candidates(chunks)
+        if not found:
+            return None
+        counts = Counter(value for value, _, _ in found)
+        # most_common keeps first-seen order among ties, so the earliest value wins a tie
+        value, count = counts.most_common(1)[0]
+        _, page_number, proof = next(match for match in found if match[0] == value)
+        if len(counts) == 1:
+            confidence = self.confidence
+            reasoning = f"Matched the {self.field} pattern {count} time(s) with no conflicting value."
+        else:
+            confidence = self.ambiguous_confidence
+            others = ', '.join(str(other) for other in counts if other != value)
+            reasoning = f"Matched the {self.field} pattern {len(found)} time(s) with conflicting values ({value}; {others})."
+        return {
+            "field_value": value,
+            "page_number": str(page_number),
+            "confidence": confidence,
+            "reasoning": reasoning,
+            "proof": proof
+        }
+
+
+def _identifier(match: re.Match) -> Optional[str]:
+    """An id such as a SOW or PO number; it must contain a digit to rule out plain words."""
+    value = match.group(1).rstrip('.-/_')
+    return value if any(char.isdigit() for char in value) else None
+
+
+def _date(match: re.Match) -> Optional[str]:
+    """A matched date as YYYY-MM-DD."""
+    text = re.sub(r"(\d)(st|nd|rd|th)\b", r"\1", match.group(1), flags=re.IGNORECASE)
+    text = re.sub(r"\s+day\s+of", "", text, flags=re.IGNORECASE)
+    # "Sept" is not a %b abbreviation
+    text = re.sub(r"\bSept\b", "Sep", text, flags=re.IGNORECASE)
+    text = ' '.join(text.replace(',', ' ').replace('.', ' ').split())
+    for date_format in ("%B %d %Y", "%b %d %Y", "%d %B %Y", "%d %b %Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(text, date_format).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+_PRE_EXTRACTORS: Dict[str, PatternExtractor] = {}
+
+
+def register_pre_extractor(extractor: PatternExtractor) -> None:
+    """Add or replace the pre-extractor of a field."""
+    _PRE_EXTRACTORS[extractor.field] = extractor
+
+
+def pre_extract(fields: List[str], chunks: List[Dict]) -> Dict[str, Dict]:
+    """Results for the fields the pattern extractors match in the chunks, ambiguous ones included."""
+    results = {}
+    for field in fields:
+        extractor = _PRE_EXTRACTORS.get(field)
+        result = extractor.extract(chunks) if extractor and chunks else None
+        if result:
+            results[field] = result
+    return results
+
+
+register_pre_extractor(PatternExtractor(
+    "sow_no",
+    rf"\b(?:SOW|Statement\s+of\s+Work)\s*(?:No\b\.?|Number|#)\s*[:\-]?\s*(?:is\s+)?{_IDENTIFIER}",
+    _identifier
+))
+register_pre_extractor(PatternExtractor(
+    "po_number",
+    rf"\b(?:PO|Purchase\s+Order)\s*(?:No\b\.?|Number|#)\s*[:\-]?\s*(?:is\s+)?{_IDENTIFIER}",
+    _identifier
+))
+register_pre_extractor(PatternExtractor(
+    "amendment_no",
+    r"\bAmendment\s*(?:No\b\.?|Number|#)\s*[:\-]?\s*(\d+)\b",
+    lambda match: match.group(1)
+))
+register_pre_extractor(PatternExtractor(
+    "currency",
+    r"(?P<usd>\bUSD\b|\bUS\s?\$|\$\s?\d|\bU\.?S\.?\s+Dollars?\b|\bUnited\s+States\s+Dollars?\b)"
+    r"|(?P<inr>\bINR\b|₹|\bRs\b\.?\s?\d|\bIndian\s+Rupees?\b)",
+    lambda match: "USD" if match.group("usd") else "INR"
+))
+register_pre_extractor(PatternExtractor(
+    "credit_period",
+    # "days" is required so amounts such as "net 100,000" are not read as a period
+    r"\bnet[\s-]*(\d{1,3})\s*days\b"
+    r"|\bwithin\s+(\d{1,3})\s*(?:\([a-z\s-]+\)\s*)?days\s+(?:of|from)\s+(?:the\s+)?(?:date\s+of\s+)?(?:receipt\s+of\s+)?(?:the\s+)?invoice",
+    # The credit_period schema takes a number of days
+    lambda match: int(match.group(1) or match.group(2))
+))
+register_pre_extractor(PatternExtractor(
+    "start_date",
+    rf"\b(?:effective\s+(?:date|from|as\s+of)|commencement\s+date|start\s+date|commenc(?:e|es|ing)\s+(?:on|from))"
+    rf"\s*(?:is|shall\s+be)?\s*[:\-]?\s*(?:on\s+)?({_DATE})",
+    _date
+))
+# Only clauses that state the term: a bare "terminate on" is often conditional
+# ("shall terminate on ... if renewed")
+register_pre_extractor(PatternExtractor(
+    "end_date",
+    rf"\b(?:end\s+date|expiry\s+date|expiration\s+date"
+    rf"|(?:remain|be)\s+in\s+(?:full\s+)?(?:force|effect)\s+(?:until|till|through|up\s*to)"
+    rf"|(?:term|agreement|SOW|statement\s+of\s+work|contract)\b[^.;]{{0,40}}?\b(?:expire|expires|end|ends)\s+on"
+    rf"|valid\s+(?:till|until|up\s*to))"
+    rf"\s*(?:is|shall\s+be)?\s*[:\-]?\s*(?:on\s+)?({_DATE})",
+    _date
+))
@@ -0,0 +1,120 @@
+import os
+import hashlib
+import tempfile
+import threading
+import numpy as np
+from typing import Dict, List, Optional
+from openai_scheduler import openai_scheduler
+from vector_index import embeddings_to_matrix
+from config import SOW_QUERIES, MSA_QUERIES, QUERY_EMBEDDING_CACHE_PATH
+
+# Bump when the on-disk layout changes so stale files are ignored and rebuilt
+QUERY_EMBEDDING_CACHE_VERSION = 1
+
+
+class QueryEmbeddingCache:
+    """On-disk cache of embeddings for the static retrieval queries in config.py."""
+
+    def __init__(self, path: str = QUERY_EMBEDDING_CACHE_PATH, model: str = "text-embedding-3-small"):
+        self.path = path
+        self.model = model
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(model: str, text: str) -> str:
+        """Cache key for a query: hash of the embedding model and the query text."""
+        return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+    def load(self) -> int:
+        """Load cached vectors from disk. Returns the number of vectors loaded."""
+        if not os.path.exists(self.path):
+            return 0
+
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if int(data["version"]) != QUERY_EMBEDDING_CACHE_VERSION:
+                    print(f"Ignoring query embedding cache '{self.path}' with outdated version")
+                    return 0
+                vectors = dict(zip(data["keys"].tolist(), data["vectors"]))
+        except Exception as e:
+            print(f"Error loading query embedding cache '{self.path}': {str(e)}")
+            return 0
+
+        with self._lock:
+            self._vectors.update(vectors)
+        return len(vectors)
+
+    def _save(self) -> None:
+        """Atomically write all cached vectors to disk."""
+        with self._lock:
+            keys = list(self._vectors)
+            vectors = np.stack([self._vectors[key] for key in keys]) if keys else np.empty((0, 0), dtype=np.float32)
+
+        # Every worker process warms the cache at startup, so each writes its own temporary file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)),
+                                        prefix=f"{os.path.basename(self.path)}.", suffix=".tmp.npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, version=QUERY_EMBEDDING_CACHE_VERSION, keys=np.array(keys), vectors=vectors)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """Get the cached embedding for a query, or None if it is not cached."""
+        with self._lock:
+            return self._vectors.get(self._key(self.model, text))
+
+    async def warm(self, queries: List[str], async_client) -> int:
+        """Embed the queries missing from the cache in one request and persist them.
+
+        Entries for queries that are no longer in the list are dropped, so edited
+        query text is recomputed and the file does not grow without bound.
+        Returns the number of queries that had to be embedded.
+        """
+        queries = list(dict.fromkeys(queries))
+        wanted = {self._key(self.model, query): query for query in queries}
+
+        with self._lock:
+            missing = [query for key, query in wanted.items() if key not in self._vectors]
+            stale = [key for key in self._vectors if key not in wanted]
+
+        if missing:
+            response = await openai_scheduler.create(
+                async_client, "embeddings", input=missing, model=self.model, encoding_format="base64"
+            )
+            embeddings = embeddings_to_matrix(response.data)
+            with self._lock:
+                for query, embedding in zip(missing, embeddings):
+                    self._vectors[self._key(self.model, query)] = embedding
+
+        if missing or stale:
+            with self._lock:
+                for key in stale:
+                    self._vectors.pop(key, None)
+            self._save()
+
+        return len(missing)
+
+
+def static_queries() -> List[str]:
+    """All retrieval queries defined in config.py for SOW and MSA fields."""
+    queries = []
+    for field_queries in list(SOW_QUERIES.values()) + list(MSA_QUERIES.values()):
+        queries.extend(field_queries)
+    return list(dict.fromkeys(queries))
+
+
+query_embedding_cache = QueryEmbeddingCache()
+
+
+async def warm_static_query_embeddings(async_client) -> None:
+    """Load the static query embeddings at startup, computing only changed queries."""
+    loaded = query_embedding_cache.load()
+    try:
+        computed = await query_embedding_cache.warm(static_queries(), async_client)
+        print(f"Static query embeddings ready: {loaded} loaded from disk, {computed} computed.")
+    except Exception as e:
+        print(f"Error precomputing static query embeddings: {str(e)}")
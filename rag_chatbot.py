@@ -1,12 +1,16 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
 from openai import OpenAI
 import os
 import json
 import numpy as np
-import sqlite3
 import uuid
 
+from database_handler import DatabaseHandler
+from openai_scheduler import INTERACTIVE, openai_scheduler
+from sqlite_pool import get_pool
+from vector_index import embeddings_to_matrix
+
 from rag_schemas import (
     query_rewrite_schema,
     llm_response_schema,
@@ -14,50 +18,50 @@ from rag_schemas import (
 )
 
 class RAGChatbot:
-    def __init__(self, vector_db_path: str = "vector_store.db", conversation_db_path: str = "conversation.db"):
-        """Initialize RAG Chatbot with vector store and conversation management."""
+    def __init__(self, vector_db_path: str = "vector_store.db", conversation_db_path: str = "conversation.db",
+                 document_id: Optional[str] = None, scope: str = "document", client: Optional[OpenAI] = None):
+        """Initialize RAG Chatbot with vector store and conversation management.
+
+        With scope="document", retrieval is limited to document_id, or to the most
+        recently uploaded document. With scope="corpus", it searches every stored
+        contract through the ANN index. client is the app's shared OpenAI client;
+        without one the chatbot creates its own.
+        """
         load_dotenv()
         self.vector_db_path = vector_db_path
         self.conversation_db_path = conversation_db_path
-        self.client = OpenAI(
+        self.conversation_pool = get_pool(conversation_db_path)
+        self.db_handler = DatabaseHandler(vector_db_path)
+        self.document_id = document_id or self.db_handler.get_latest_document_id()
+        self.scope = scope
+        self.client = client or OpenAI(
             api_key=os.getenv("OPENAI_API_KEY"),
         )
         self._init_conversation_db()
 
     def _init_conversation_db(self):
         """Initialize the conversation database if it doesn't exist."""
-        conn = sqlite3.connect(self.conversation_db_path)
-        cursor = conn.cursor()
-        
-        # Create table only if it doesn't exist
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS conversations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT NOT NULL,
-                message TEXT NOT NULL,
-                sent_by TEXT NOT NULL,
-                context_summary TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        conn.commit()
-        conn.close()
+        with self.conversation_pool.transaction() as conn:
+            # Create table only if it doesn't exist
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    sent_by TEXT NOT NULL,
+                    context_summary TEXT,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
 
     def _delete_conversation_db(self):
         """Delete the conversation database."""
-        conn = sqlite3.connect(self.conversation_db_path)
-        cursor = conn.cursor()
-
-        cursor.execute("DROP TABLE IF EXISTS conversation")
-        conn.commit()
-        conn.close()
+        with self.conversation_pool.transaction() as conn:
+            conn.execute("DROP TABLE IF EXISTS conversation")
 
     def _get_conversation_summary(self, session_id: str) -> str:
         """Retrieve the latest conversation summary for a session."""
-        conn = sqlite3.connect(self.conversation_db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
+        result = self.conversation_pool.fetchone("""
             SELECT context_summary 
             FROM conversations 
             WHERE session_id = ? 
@@ -65,23 +69,15 @@ class RAGChatbot:
             LIMIT 1
         """, (session_id,))
         
-        result = cursor.fetchone()
-        conn.close()
-        
         return result[0] if result else ""
 
     def _store_conversation(self, session_id: str, message: str, sent_by: str, context_summary: str):
         """Store a conversation entry in the database."""
-        conn = sqlite3.connect(self.conversation_db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO conversations (session_id, message, sent_by, context_summary)
-            VALUES (?, ?, ?, ?)
-        """, (session_id, message, sent_by, context_summary))
-        
-        conn.commit()
-        conn.close()
+        with self.conversation_pool.transaction() as conn:
+            conn.execute("""
+                INSERT INTO conversations (session_id, message, sent_by, context_summary)
+                VALUES (?, ?, ?, ?)
+            """, (session_id, message, sent_by, context_summary))
 
     def _rewrite_query(self, query: str, context_summary: str = "") -> Dict[str, str]:
         """Rewrite the query for RAG search and LLM response."""
@@ -94,7 +90,8 @@ class RAGChatbot:
         
         Return the rewritten queries in the specified JSON format."""
 
-        response = self.client.chat.completions.create(
+        response = openai_scheduler.create_sync(
+            self.client, "chat.completions", INTERACTIVE,
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "You are a query optimization expert. Rewrite queries to improve search and response quality."},
@@ -105,19 +102,15 @@ class RAGChatbot:
         
         return json.loads(response.choices[0].message.content)
 
-    def _query_embedding(self, query: str) -> List[float]:
+    def _query_embedding(self, query: str) -> np.ndarray:
         """Get embedding for a query string."""
-        embedding = self.client.embeddings.create(
+        embedding = openai_scheduler.create_sync(
+            self.client, "embeddings", INTERACTIVE,
             input=query,
-            model="text-embedding-3-small"
+            model="text-embedding-3-small",
+            encoding_format="base64"
         )
-        return embedding.data[0].embedding
-
-    def _cosine_similarity(self, query_embedding: List[float], doc_embedding: np.ndarray) -> float:
-        """Calculate cosine similarity between query and document embeddings."""
-        a = np.array(query_embedding)
-        b = doc_embedding
-        return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+        return embeddings_to_matrix(embedding.data)[0]
 
     def _format_chunks_to_xml(self, chunks: List[Dict]) -> str:
         """Format chunks into XML structure for better LLM processing."""
@@ -125,14 +118,19 @@ class RAGChatbot:
         
         for i, chunk in enumerate(chunks, 1):
             # Handle both dictionary and tuple formats
+            file_name = None
             if isinstance(chunk, tuple):
                 chunk_text, page_number, _ = chunk
             else:
                 chunk_text = chunk['chunk']
                 page_number = chunk['page_number']
+                file_name = chunk.get('file_name')
             
+            xml_parts.append(f'<CHUNK_{i}>')
+            # Corpus-wide results come from several contracts, so name the source
+            if file_name:
+                xml_parts.extend(['<DOCUMENT>', str(file_name), '</DOCUMENT>'])
             xml_parts.extend([
-                f'<CHUNK_{i}>',
                 '<PAGE_NUMBER>',
                 str(page_number),
                 '</PAGE_NUMBER>',
@@ -148,32 +146,10 @@ class RAGChatbot:
     def _get_top_k_chunks(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
         """Get top-k relevant chunks for a query using cosine similarity."""
         try:
-            conn = sqlite3.connect(self.vector_db_path)
-            cursor = conn.cursor()
-
-            cursor.execute('SELECT chunk, page_number, embedding FROM document_chunks')
-            chunks = cursor.fetchall()
-            conn.close()
-
-            similarities = []
             query_embedding = self._query_embedding(query)
-
-            for chunk, page_number, embedding in chunks:
-                doc_embedding = np.frombuffer(embedding, dtype=np.float32)
-                similarity = self._cosine_similarity(query_embedding, doc_embedding)
-                similarities.append((similarity, page_number, chunk))
-
-            similarities.sort(reverse=True)
-            top_chunks = similarities[:k]
-
-            return [
-                {
-                    "chunk": chunk,
-                    "page_number": page_number,
-                    "score": float(score)
-                }
-                for score, page_number, chunk in top_chunks
-            ]
+            if self.scope == "corpus":
+                return self.db_handler.search_corpus([query_embedding], k)[0]
+            return self.db_handler.search([query_embedding], k, self.document_id)[0]
 
         except Exception as e:
             print(f"Error getting top k chunks: {str(e)}")
@@ -194,7 +170,8 @@ class RAGChatbot:
         
         Provide a detailed answer with confidence score and reasoning."""
 
-        response = self.client.chat.completions.create(
+        response = openai_scheduler.create_sync(
+            self.client, "chat.completions", INTERACTIVE,
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "You are a contract analysis expert. Answer questions accurately based only on provided context."},
@@ -218,7 +195,8 @@ class RAGChatbot:
         Conversationally, make it sound like a reported speech but very concise. 
         Keeping track of the conversation. Concentrate on very high level of conversation summary."""
 
-        response = self.client.chat.completions.create(
+        response = openai_scheduler.create_sync(
+            self.client, "chat.completions", INTERACTIVE,
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "You are a conversation summarizer. Create concise and informative summaries."},
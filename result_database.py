@@ -1,7 +1,8 @@
 import sqlite3
 import json
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 from datetime import datetime
+from sqlite_pool import get_pool
 from database_schema import (
     SOW_DETAILED_SCHEMA,
     MSA_DETAILED_SCHEMA,
@@ -13,13 +14,16 @@ from database_schema import (
     get_table_names,
     INDEX_DEFINITIONS,
     DETAILED_INDEX_DEFINITIONS,
-    DOCUMENT_METADATA_SCHEMA
+    DOCUMENT_METADATA_SCHEMA,
+    UPLOAD_JOBS_SCHEMA
 )
+from config import UPLOAD_JOBS_MAX
 
 class ResultDatabase:
     def __init__(self, db_path: str = "contract_results.db"):
         """Initialize the database with separate tables for MSA and SOW results."""
         self.db_path = db_path
+        self.pool = get_pool(db_path)
         self._init_db()
 
     def _init_db(self):
@@ -57,17 +61,17 @@ class ResultDatabase:
                 cursor.execute(INDEX_DEFINITIONS['idx_created_at'].format(table_name=table))
             cursor.execute(DETAILED_INDEX_DEFINITIONS['idx_field_name'].format(table_name=sow_tables['detailed']))
 
+            cursor.execute(get_create_table_sql('upload_jobs', UPLOAD_JOBS_SCHEMA))
+
             conn.commit()
         except Exception as e:
             conn.rollback()
             print(f"Error initializing database: {str(e)}")
             raise
-        finally:
-            conn.close()
 
     def _get_connection(self) -> sqlite3.Connection:
-        """Get a database connection with row factory."""
-        conn = sqlite3.connect(self.db_path)
+        """Get this thread's pooled database connection with row factory."""
+        conn = self.pool.connection()
         conn.row_factory = sqlite3.Row
         return conn
 
@@ -190,6 +194,48 @@ class ResultDatabase:
             'other_insurance_amount': ''
         }
 
+    def _process_results(self, results: List[Dict[str, Any]], doc_type: str) -> Dict[str, Dict[str, Any]]:
+        """Format extraction results into table rows, keyed by field name, handling special fields."""
+        processed_results = {}
+        for result in results:
+            field_name = result.get('field', '')
+            value_dict = result.get('value', {})
+            
+            # Format special fields for SOW
+            if doc_type.lower() == 'sow':
+                if field_name == 'particular_role_rate':
+                    field_value = self._format_role_rate(value_dict)
+                elif field_name == 'billing_unit_type_and_rate_cost':
+                    field_value = self._format_billing_unit(value_dict)
+                else:
+                    field_value = str(value_dict.get('field_value', ''))
+            # Format insurance fields for MSA
+            elif doc_type.lower() == 'msa' and field_name == 'insurance_required':
+                insurance_data = self._format_insurance_field(value_dict)
+                # Create entries for all insurance fields
+                for ins_field, ins_value in insurance_data.items():
+                    processed_results[ins_field] = {
+                        'field_name': ins_field,
+                        'field_value': ins_value,
+                        'page_number': str(value_dict.get('page_number', '')),
+                        'confidence': float(value_dict.get('confidence', 0)),
+                        'reasoning': str(value_dict.get('reasoning', '')),
+                        'proof': str(value_dict.get('proof', '')),
+                    }
+                continue
+            else:
+                field_value = str(value_dict.get('field_value', ''))
+
+            processed_results[field_name] = {
+                'field_name': field_name,
+                'field_value': field_value,
+                'page_number': str(value_dict.get('page_number', '')),
+                'confidence': float(value_dict.get('confidence', 0)),
+                'reasoning': str(value_dict.get('reasoning', '')),
+                'proof': str(value_dict.get('proof', '')),
+            }
+        return processed_results
+
     def store_results(self, results: List[Dict[str, Any]], doc_type: str, file_name: str) -> int:
         """Store extraction results in both detailed and simple format tables."""
         conn = self._get_connection()
@@ -213,71 +259,28 @@ class ResultDatabase:
             tables = get_table_names(doc_type)
             
             # Process results first to handle special fields
-            processed_results = {}
-            for result in results:
-                field_name = result.get('field', '')
-                value_dict = result.get('value', {})
-                
-                # Format special fields for SOW
-                if doc_type.lower() == 'sow':
-                    if field_name == 'particular_role_rate':
-                        field_value = self._format_role_rate(value_dict)
-                    elif field_name == 'billing_unit_type_and_rate_cost':
-                        field_value = self._format_billing_unit(value_dict)
-                    else:
-                        field_value = str(value_dict.get('field_value', ''))
-                # Format insurance fields for MSA
-                elif doc_type.lower() == 'msa' and field_name == 'insurance_required':
-                    insurance_data = self._format_insurance_field(value_dict)
-                    # Create entries for all insurance fields
-                    for ins_field, ins_value in insurance_data.items():
-                        processed_results[ins_field] = {
-                            'field_name': ins_field,
-                            'field_value': ins_value,
-                            'page_number': str(value_dict.get('page_number', '')),
-                            'confidence': float(value_dict.get('confidence', 0)),
-                            'reasoning': str(value_dict.get('reasoning', '')),
-                            'proof': str(value_dict.get('proof', '')),
-                        }
-                    continue
-                else:
-                    field_value = str(value_dict.get('field_value', ''))
+            processed_results = self._process_results(results, doc_type)
 
-                processed_results[field_name] = {
-                    'field_name': field_name,
-                    'field_value': field_value,
-                    'page_number': str(value_dict.get('page_number', '')),
-                    'confidence': float(value_dict.get('confidence', 0)),
-                    'reasoning': str(value_dict.get('reasoning', '')),
-                    'proof': str(value_dict.get('proof', '')),
-                }
-
-            # Store in detailed format
-            for result in processed_results.values():
-                # Base fields for insertion
-                values = {
-                    'db_id': db_id,
-                    'field_name': result['field_name'],
-                    'field_value': result['field_value'],
-                    'page_number': result['page_number'],
-                    'confidence': result['confidence'],
-                    'reasoning': result['reasoning'],
-                    'proof': result['proof'],
-                    'file_name': file_name
-                }
-
-                # Create placeholders and SQL for dynamic fields
-                placeholders = ', '.join(['?' for _ in values])
-                columns = ', '.join(values.keys())
-                
-                # Insert into detailed table
-                cursor.execute(
-                    f"""
-                    INSERT INTO {tables['detailed']} ({columns})
-                    VALUES ({placeholders})
-                    """,
-                    list(values.values())
-                )
+            # Store in detailed format, all fields in one batched insert
+            cursor.executemany(
+                f"""
+                INSERT INTO {tables['detailed']} (db_id, field_name, field_value, page_number, confidence, reasoning, proof, file_name)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        db_id,
+                        result['field_name'],
+                        result['field_value'],
+                        result['page_number'],
+                        result['confidence'],
+                        result['reasoning'],
+                        result['proof'],
+                        file_name
+                    )
+                    for result in processed_results.values()
+                ]
+            )
 
             # Store in simple format
             simple_values = {'file_name': file_name, 'db_id': db_id}
@@ -307,8 +310,79 @@ class ResultDatabase:
             conn.rollback()
             print(f"Error storing results: {str(e)}")
             raise
-        finally:
-            conn.close()
+
+    def update_results(self, db_id: int, results: List[Dict[str, Any]], doc_type: str) -> None:
+        """Overwrite stored results of some fields of a document, e.g. fields that finished after it was stored."""
+        processed_results = self._process_results(results, doc_type)
+        if not processed_results:
+            return
+        tables = get_table_names(doc_type)
+        fields = SOW_FIELDS if doc_type.lower() == 'sow' else MSA_FIELDS
+        simple_values = {field: row['field_value'] for field, row in processed_results.items() if field in fields}
+
+        with self.pool.transaction() as conn:
+            conn.executemany(
+                f"""
+                UPDATE {tables['detailed']}
+                SET field_value = ?, page_number = ?, confidence = ?, reasoning = ?, proof = ?
+                WHERE db_id = ? AND field_name = ?
+                """,
+                [
+                    (row['field_value'], row['page_number'], row['confidence'], row['reasoning'], row['proof'],
+                     db_id, row['field_name'])
+                    for row in processed_results.values()
+                ]
+            )
+            if simple_values:
+                assignments = ', '.join(f"{field} = ?" for field in simple_values)
+                conn.execute(
+                    f"UPDATE {tables['simple']} SET {assignments} WHERE db_id = ?",
+                    [*simple_values.values(), db_id]
+                )
+
+    def save_upload_job(self, job: Dict[str, Any]) -> None:
+        """Insert or replace an upload job's state, dropping the oldest finished jobs beyond UPLOAD_JOBS_MAX."""
+        with self.pool.transaction() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO upload_jobs
+                    (job_id, db_id, document_id, doc_type, file_name, status, error, pending_fields, field_values)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    job['job_id'], job['db_id'], job['document_id'], job['doc_type'], job['file_name'],
+                    job['status'], job['error'], json.dumps(job['pending_fields']),
+                    json.dumps(job['field_values'], default=str)
+                )
+            )
+            conn.execute(
+                """
+                DELETE FROM upload_jobs
+                WHERE status != 'pending' AND job_id NOT IN (
+                    SELECT job_id FROM upload_jobs ORDER BY created_at DESC, rowid DESC LIMIT ?
+                )
+                """,
+                (UPLOAD_JOBS_MAX,)
+            )
+
+    def get_upload_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """An upload job's stored state, or None if it is unknown."""
+        row = self.pool.fetchone(
+            """
+            SELECT job_id, db_id, document_id, doc_type, file_name, status, error, pending_fields, field_values
+            FROM upload_jobs WHERE job_id = ?
+            """,
+            (job_id,)
+        )
+        if row is None:
+            return None
+        job = dict(zip(
+            ('job_id', 'db_id', 'document_id', 'doc_type', 'file_name', 'status', 'error', 'pending_fields', 'field_values'),
+            row
+        ))
+        job['pending_fields'] = json.loads(job['pending_fields'] or '[]')
+        job['field_values'] = json.loads(job['field_values'] or '{}')
+        return job
 
     def get_latest_results(self, doc_type: str, detailed: bool = True) -> List[Dict]:
         """Retrieve the latest results for a specific document type."""
@@ -332,8 +406,6 @@ class ResultDatabase:
         except Exception as e:
             print(f"Error retrieving results: {str(e)}")
             raise
-        finally:
-            conn.close()
 
     def get_document_history(self, doc_type: str) -> List[Dict]:
         """Get processing history for a document type."""
@@ -355,8 +427,6 @@ class ResultDatabase:
         except Exception as e:
             print(f"Error retrieving document history: {str(e)}")
             raise
-        finally:
-            conn.close()
 
     def update_sow_msa_detailed_simple_table(self, db_id: int, field: str, value: str, page_number: str, doc_type: str) -> bool:
         """
@@ -372,8 +442,8 @@ class ResultDatabase:
         Returns:
             bool: True if update was successful, False otherwise
         """
+        conn = self._get_connection()
         try:
-            conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             
             # Normalize doc_type
@@ -411,13 +481,10 @@ class ResultDatabase:
             
             conn.commit()
             cursor.close()
-            conn.close()
             
             return True
             
         except Exception as e:
             print(f"Error updating tables: {str(e)}")
-            if conn:
-                conn.rollback()
-                conn.close()
+            conn.rollback()
             return False
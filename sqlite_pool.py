@@ -0,0 +1,123 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+from config import SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE
+
+# Per-connection cache of compiled statements, reused by PreparedStatement
+_STATEMENT_CACHE_SIZE = 256
+
+
+class PreparedStatement:
+    """SQL statement bound to a pool.
+
+    Each thread's connection compiles it on first use and reuses the compiled form
+    from its statement cache afterwards, so hot queries skip parsing and planning.
+    """
+
+    def __init__(self, pool: "SQLitePool", sql: str):
+        self.pool = pool
+        self.sql = sql
+
+    def execute(self, params: Sequence = ()) -> sqlite3.Cursor:
+        return self.pool.connection().execute(self.sql, params)
+
+    def executemany(self, rows: Iterable[Sequence]) -> sqlite3.Cursor:
+        return self.pool.connection().executemany(self.sql, rows)
+
+    def fetchone(self, params: Sequence = ()) -> Optional[Any]:
+        return self.execute(params).fetchone()
+
+    def fetchall(self, params: Sequence = ()) -> List[Any]:
+        return self.execute(params).fetchall()
+
+
+class SQLitePool:
+    """Per-thread pooled connections to one SQLite database, opened with tuned pragmas.
+
+    Connections use WAL with synchronous=NORMAL, so readers never wait for a writer
+    and commits skip an fsync, plus a busy timeout, a larger page cache and mmap
+    reads. Each thread keeps one connection, which suits the DB executor's bounded
+    worker threads. Writes go through transaction(); reads need no transaction.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+            cached_statements=_STATEMENT_CACHE_SIZE,
+            check_same_thread=False
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}')
+        # A negative cache_size is in KiB rather than pages
+        conn.execute(f'PRAGMA cache_size=-{int(SQLITE_CACHE_SIZE_KB)}')
+        conn.execute(f'PRAGMA mmap_size={int(SQLITE_MMAP_SIZE)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """This thread's connection, opened on first use (and again after a fork)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._open()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Yield this thread's connection; commit on success and roll back on error."""
+        conn = self.connection()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def prepare(self, sql: str) -> PreparedStatement:
+        return PreparedStatement(self, sql)
+
+    def execute(self, sql: str, params: Sequence = ()) -> sqlite3.Cursor:
+        return self.connection().execute(sql, params)
+
+    def fetchone(self, sql: str, params: Sequence = ()) -> Optional[Any]:
+        return self.execute(sql, params).fetchone()
+
+    def fetchall(self, sql: str, params: Sequence = ()) -> List[Any]:
+        return self.execute(sql, params).fetchall()
+
+    def close_all(self) -> None:
+        """Close every connection the pool has opened, in any thread."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+
+_pools: Dict[str, SQLitePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str) -> SQLitePool:
+    """Process-wide connection pool for a database file."""
+    path = os.path.abspath(db_path)
+    with _pools_lock:
+        if path not in _pools:
+            _pools[path] = SQLitePool(path)
+        return _pools[path]
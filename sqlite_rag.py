@@ -1,8 +1,8 @@
 import os
+import time
 import asyncio
-import sqlite3
 import json
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
 from chunking import CustomChunking
@@ -10,6 +10,12 @@ from batch_embedding import AsyncEmbeddingGenerator
 from database_handler import DatabaseHandler
 from csv_writer import CSVWriter
 from result_database import ResultDatabase
+from db_executor import run_db
+from llm_cache import LLMResponseCache
+from pre_extractors import pre_extract
+from openai_scheduler import openai_scheduler
+from hedging import hedger
+from deadline import Deadline
 import logging
 from config import (
     SOW_FIELDS_TO_EXTRACT, 
@@ -19,7 +25,18 @@ from config import (
     MSA_FIELDS_TO_EXTRACT, 
     MSA_POINTS_TO_REMEMBER, 
     MSA_QUERIES, 
-    MSA_QUERY_FOR_EACH_FIELD
+    MSA_QUERY_FOR_EACH_FIELD,
+    FIELD_KEYWORDS,
+    PRE_EXTRACTION,
+    PRE_EXTRACTION_MIN_CONFIDENCE,
+    RETRIEVAL_MODE,
+    EXTRACTION_MODE,
+    EXTRACTION_GROUP_MIN_OVERLAP,
+    EXTRACTION_GROUP_MAX_FIELDS,
+    MODEL_CASCADE,
+    HEDGING,
+    CASCADE_TIERS,
+    CASCADE_CONFIDENCE_THRESHOLDS
 )
 from schemas import (
     client_company_name_schema,
@@ -42,14 +59,164 @@ from schemas import (
     particular_role_rate_schema,
 )
 
+def field_match_query(field: str, retrieval_mode: str = RETRIEVAL_MODE) -> Optional[str]:
+    """FTS5 query for a field's keywords in hybrid mode, or None for dense-only retrieval."""
+    if retrieval_mode != "hybrid" or field not in FIELD_KEYWORDS:
+        return None
+    return DatabaseHandler.keyword_match_query(FIELD_KEYWORDS[field])
+
+
+def field_queries(field: str, doc_type: str = "MSA", retrieval_mode: str = RETRIEVAL_MODE) -> List[str]:
+    """Retrieval queries for a field.
+
+    In hybrid mode a field with keywords needs only its first query, since BM25
+    covers the literal labels the paraphrased variants were written to catch.
+    """
+    queries = MSA_QUERIES if doc_type == "MSA" else SOW_QUERIES
+    configured = queries.get(field, [f"Extract the {field} from the contract"])
+    if field_match_query(field, retrieval_mode):
+        return configured[:1]
+    return configured
+
+
+def merge_chunks(chunks_results: List[List[Dict]]) -> List[Dict]:
+    """Combine the chunks retrieved for several queries, dropping duplicates and keeping order."""
+    all_chunks = []
+    seen_chunks = set()
+    for chunks in chunks_results:
+        for chunk in chunks:
+            chunk_text = chunk["chunk"]
+            if chunk_text not in seen_chunks:
+                seen_chunks.add(chunk_text)
+                all_chunks.append(chunk)
+    return all_chunks
+
+
+def group_fields(chunks_by_field: Dict[str, List[Dict]], min_overlap: float = EXTRACTION_GROUP_MIN_OVERLAP,
+                 max_fields: int = EXTRACTION_GROUP_MAX_FIELDS) -> List[List[str]]:
+    """Cluster fields whose retrieved chunks overlap, so each group can be extracted in one call.
+
+    A field joins the first group that already holds at least min_overlap of its
+    chunks and has room for it; otherwise it starts a new group. Fields without a
+    schema or without chunks stay on their own.
+    """
+    groups = []
+    for field, chunks in chunks_by_field.items():
+        texts = {chunk["chunk"] for chunk in chunks}
+        if texts and f"{field}_schema" in globals():
+            for members, group_texts in groups:
+                if len(members) < max_fields and len(texts & group_texts) >= min_overlap * len(texts):
+                    members.append(field)
+                    group_texts |= texts
+                    break
+            else:
+                groups.append(([field], texts))
+        else:
+            groups.append(([field], set()))
+    return [fields for fields, _ in groups]
+
+
+def grouped_schema(fields: List[str]) -> Dict[str, Any]:
+    """Combined JSON schema with each field's schema from schemas.py as a property."""
+    return {
+        "name": "grouped_field_extraction",
+        "schema": {
+            "type": "object",
+            "properties": {field: globals()[f"{field}_schema"]["schema"] for field in fields},
+            "required": list(fields),
+            "additionalProperties": False
+        },
+        "strict": True
+    }
+
+
+def canonical_chunks(chunks_by_field: Dict[str, List[Dict]]) -> List[Dict]:
+    """Union of every field's chunks in stable page order, the shared context of prefix-cached extraction."""
+    chunks = merge_chunks(list(chunks_by_field.values()))
+    return sorted(chunks, key=lambda chunk: int(chunk["page_number"]) if str(chunk["page_number"]).isdigit() else 0)
+
+
+def shared_schema(fields: List[str]) -> Dict[str, Any]:
+    """One schema for every field of a document, each field's entry nullable.
+
+    The provider puts the response schema ahead of the messages, so every call has
+    to send the same schema for the cached prefix to match; a call fills in only
+    its own field and leaves the others null.
+    """
+    return {
+        "name": "contract_field_extraction",
+        "schema": {
+            "type": "object",
+            "properties": {
+                field: {"anyOf": [globals()[f"{field}_schema"]["schema"], {"type": "null"}]}
+                for field in fields
+            },
+            "required": list(fields),
+            "additionalProperties": False
+        },
+        "strict": True
+    }
+
+
+def complete_extraction(result: Any) -> Dict[str, Any]:
+    """Fill in missing keys of an extraction result and convert word confidences to numbers."""
+    if not isinstance(result, dict):
+        result = {}
+    if "field_value" not in result:
+        result["field_value"] = ""
+    if "page_number" not in result:
+        result["page_number"] = ""
+    if "confidence" not in result:
+        result["confidence"] = 1
+    if "reasoning" not in result:
+        result["reasoning"] = "No reasoning provided"
+    if "proof" not in result:
+        result["proof"] = ""
+
+    # Convert old confidence format (high/medium/low) to numeric if needed
+    if isinstance(result["confidence"], str):
+        confidence_map = {"high": 9, "medium": 6, "low": 3}
+        result["confidence"] = confidence_map.get(result["confidence"].lower(), 1)
+    return result
+
+
 class SQLiteOpenAIRAG:
-    def __init__(self, db_path: str = "vector_store.db"):
+    def __init__(self, db_path: str = "vector_store.db", document_id: Optional[str] = None,
+                 retrieval_mode: str = RETRIEVAL_MODE, extraction_mode: str = EXTRACTION_MODE,
+                 use_llm_cache: bool = True, bypass_llm_cache: bool = False, pre_extraction: bool = PRE_EXTRACTION,
+                 cascade: bool = MODEL_CASCADE, async_client: Optional[AsyncOpenAI] = None,
+                 hedging: bool = HEDGING, deadline: Optional[Deadline] = None):
         load_dotenv()
         self.db_path = db_path
-        # self._init_db()
+        # Document whose chunks retrieval is scoped to
+        self.document_id = document_id
+        # "hybrid" adds BM25 candidate pruning for fields with literal keywords
+        self.retrieval_mode = retrieval_mode
+        # "grouped" extracts fields with overlapping chunks together in one call
+        self.extraction_mode = extraction_mode
+        # Running totals of chat-completion calls and tokens, for benchmarking
+        self.usage = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        # Parsed results of earlier identical extraction prompts; bypass forces re-extraction
+        # but still stores the fresh results
+        self.llm_cache = LLMResponseCache() if use_llm_cache else None
+        self.bypass_llm_cache = bypass_llm_cache
+        # Resolve fields with regular formats by pattern matching before any LLM call
+        self.pre_extraction = pre_extraction
+        # Per-field extraction tries cheaper tiers first and escalates on low confidence;
+        # cascade_stats holds calls, escalations and seconds per tier
+        self.cascade = cascade
+        self.cascade_stats: Dict[int, Dict[str, Any]] = {}
+        # Per-field extraction and query embedding calls that run unusually long are
+        # duplicated and the first response is used, trimming the upload's tail latency
+        self.hedging = hedging
+        # Upload deadline that bounds retrieval and every extraction call
+        self.deadline = deadline
+        # Values of the fields extracted so far, recorded as each one finishes, so a
+        # caller that stops waiting can still return the fields already done
+        self.completed: Dict[str, Dict[str, Any]] = {}
         self.db_handler = DatabaseHandler(db_path)
-        self.db_handler._init_db()
-        self.async_client = AsyncOpenAI(
+        # The app's shared client when given, so connections are reused across uploads
+        self.async_client = async_client or AsyncOpenAI(
             api_key=os.getenv("OPENAI_API_KEY"),
             timeout=60.0,
             max_retries=3
@@ -74,7 +241,26 @@ class SQLiteOpenAIRAG:
         xml_parts.append('</CONTENT>')
         return '\n'.join(xml_parts)
 
-    async def extract_field_value(self, field: str, chunks: List[Dict], doc_type: str = "MSA") -> Dict[str, Any]:
+    def _record_usage(self, response) -> int:
+        """Add a chat completion's token usage to the running totals and return its cached prompt tokens."""
+        self.usage["calls"] += 1
+        if not response.usage:
+            return 0
+        details = getattr(response.usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+        self.usage["prompt_tokens"] += response.usage.prompt_tokens
+        self.usage["cached_tokens"] += cached_tokens
+        self.usage["completion_tokens"] += response.usage.completion_tokens
+        return cached_tokens
+
+    def get_field_instruction(self, field: str, doc_type: str = "MSA") -> str:
+        """The extraction question configured for a field."""
+        queries = MSA_QUERIES if doc_type == "MSA" else SOW_QUERIES
+        query_for_field = MSA_QUERY_FOR_EACH_FIELD if doc_type == "MSA" else SOW_QUERY_FOR_EACH_FIELD
+        return query_for_field.get(field, queries.get(field, [f"Extract the {field} from the contract"])[0])
+
+    async def extract_field_value(self, field: str, chunks: List[Dict], doc_type: str = "MSA",
+                                  model: str = "gpt-4o-mini") -> Dict[str, Any]:
         """Extract field value from chunks using gpt-4."""
         try:
             if not chunks:
@@ -107,6 +293,17 @@ class SQLiteOpenAIRAG:
 
                 # -----------PLACE YOUR DEFAULT SCHEMA HERE-----------
 
+            cache_key = LLMResponseCache.key(model, schema, field, doc_type, chunks_content) if self.llm_cache else None
+            if cache_key and not self.bypass_llm_cache:
+                try:
+                    cached = await run_db(self.llm_cache.get, cache_key)
+                except Exception as e:
+                    print(f"Error reading LLM cache for field {field}: {str(e)}")
+                    cached = None
+                if cached is not None:
+                    print(f"LLM cache hit for field {field}")
+                    return cached
+
             # Prepare the prompt
             context = f"""
                 You are a contract analysis expert. Extract information accurately and provide confidence levels and reasoning.
@@ -126,8 +323,9 @@ class SQLiteOpenAIRAG:
             """
             
             # Make API call with JSON mode
-            response = await self.async_client.chat.completions.create(
-                model="gpt-4o-mini",
+            response = await hedger.create(
+                self.async_client, "chat.completions", hedge=self.hedging, deadline=self.deadline,
+                model=model,
                 messages=[
                     {"role": "system", "content": """You are a contract analysis expert. Extract information accurately and provide confidence levels and reasoning.
                     Always return your response in the exact JSON format specified, with all required fields."""},
@@ -135,27 +333,12 @@ class SQLiteOpenAIRAG:
                 ],
                 response_format={"type": "json_schema", "json_schema": schema},
             )
+            self._record_usage(response)
             
             # Parse and validate the response
             try:
-                result = json.loads(response.choices[0].message.content)
-                
                 # Ensure all required fields are present with correct types
-                if "field_value" not in result:
-                    result["field_value"] = ""
-                if "page_number" not in result:
-                    result["page_number"] = ""
-                if "confidence" not in result:
-                    result["confidence"] = 1
-                if "reasoning" not in result:
-                    result["reasoning"] = "No reasoning provided"
-                if "proof" not in result:
-                    result["proof"] = ""
-                
-                # Convert old confidence format (high/medium/low) to numeric if needed
-                if isinstance(result["confidence"], str):
-                    confidence_map = {"high": 9, "medium": 6, "low": 3}
-                    result["confidence"] = confidence_map.get(result["confidence"].lower(), 1)
+                result = complete_extraction(json.loads(response.choices[0].message.content))
 
                 # make a clean separator, then for each field print field_value, page_number, confidence, reasoning, proof
                 if field == "insurance_required":
@@ -179,6 +362,12 @@ class SQLiteOpenAIRAG:
                 print(f"\n\n--- {field} ---")
                 print(f"field_value: {result['field_value']}, \npage_number: {result['page_number']}, \nconfidence: {result['confidence']}, \nreasoning: {result['reasoning']}, \nproof: {result['proof']}")
                 print(f"\n\n")
+
+                if cache_key:
+                    try:
+                        await run_db(self.llm_cache.put, cache_key, field, result)
+                    except Exception as e:
+                        print(f"Error writing LLM cache for field {field}: {str(e)}")
                 
                 return result
                 
@@ -202,37 +391,175 @@ class SQLiteOpenAIRAG:
                 "proof": ""
             }
 
-    async def process_field(self, field: str, doc_type: str = "MSA") -> Dict[str, Any]:
-        """Process a single field by getting relevant chunks and extracting value."""
+    async def extract_field_group(self, fields: List[str], chunks: List[Dict], doc_type: str = "MSA") -> Dict[str, Dict[str, Any]]:
+        """Extract several fields from their combined chunks with one call, returning each field's value.
+
+        Falls back to one call per field if the grouped call fails.
+        """
+        if len(fields) == 1:
+            return {fields[0]: await self.extract_field_value(fields[0], chunks, doc_type)}
+
+        try:
+            chunks_content = self.format_chunks_to_xml(chunks)
+            field_list = "\n".join(f"- {field}: {self.get_field_instruction(field, doc_type)}" for field in fields)
+            context = f"""
+                You are a contract analysis expert. Extract information accurately and provide confidence levels and reasoning.
+                Always return your response in the exact JSON format specified, with all required fields.
+
+                Extract each of the following fields from the contract text below:
+                {field_list}
+
+                For every field the response must include:
+                1. field_value: The extracted value
+                2. page_number: The page where the information was found
+                3. confidence: A number between 1-10 indicating confidence level
+                4. reasoning: Clear explanation of why this value was extracted
+                5. proof: The exact text from the contract supporting this extraction
+
+                Contract Text:
+                {chunks_content}
+            """
+
+            response = await openai_scheduler.create(
+                self.async_client, "chat.completions", deadline=self.deadline,
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": """You are a contract analysis expert. Extract information accurately and provide confidence levels and reasoning.
+                    Always return your response in the exact JSON format specified, with all required fields."""},
+                    {"role": "user", "content": context}
+                ],
+                response_format={"type": "json_schema", "json_schema": grouped_schema(fields)},
+            )
+            self._record_usage(response)
+            result = json.loads(response.choices[0].message.content)
+            values = {field: complete_extraction(result.get(field)) for field in fields}
+            for field, value in values.items():
+                print(f"\n\n--- {field} (grouped) ---")
+                print(f"field_value: {value['field_value']}, \npage_number: {value['page_number']}, \nconfidence: {value['confidence']}")
+            return values
+
+        except Exception as e:
+            print(f"Error during grouped extraction for fields {', '.join(fields)}: {str(e)}")
+            values = await asyncio.gather(*(self.extract_field_value(field, chunks, doc_type) for field in fields))
+            return dict(zip(fields, values))
+
+    async def extract_field_with_prefix(self, field: str, document_context: str, schema: Dict[str, Any],
+                                        doc_type: str = "MSA") -> Dict[str, Any]:
+        """Extract a field with the shared document context first and the field's instructions after it.
+
+        Every call of an upload starts with the same system message, schema and
+        document context, so the provider's automatic prompt caching serves that
+        prefix from cache after the first call.
+        """
+        try:
+            points_to_remember = MSA_POINTS_TO_REMEMBER if doc_type == "MSA" else SOW_POINTS_TO_REMEMBER
+            field_points = points_to_remember.get(field, "")
+            points = f"Points to remember:\n{field_points}\n" if field_points else ""
+            instructions = f"""
+Extract the {field} from the contract text above: {self.get_field_instruction(field, doc_type)}
+{points}Fill in only "{field}" and set every other field of the response to null.
+"""
+            response = await openai_scheduler.create(
+                self.async_client, "chat.completions", deadline=self.deadline,
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": """You are a contract analysis expert. Extract information accurately and provide confidence levels and reasoning.
+                    Always return your response in the exact JSON format specified, with all required fields."""},
+                    {"role": "user", "content": document_context + instructions}
+                ],
+                response_format={"type": "json_schema", "json_schema": schema},
+            )
+            cached_tokens = self._record_usage(response)
+            prompt_tokens = response.usage.prompt_tokens if response.usage else 0
+            print(f"{field}: {cached_tokens}/{prompt_tokens} prompt tokens served from cache")
+            return complete_extraction(json.loads(response.choices[0].message.content).get(field))
+
+        except Exception as e:
+            print(f"Error during extraction for field {field}: {str(e)}")
+            return {
+                "field_value": "",
+                "page_number": "",
+                "confidence": 1,
+                "reasoning": f"Error during extraction: {str(e)}",
+                "proof": ""
+            }
+
+    async def extract_field_cascade(self, field: str, chunks: List[Dict], doc_type: str = "MSA") -> Dict[str, Any]:
+        """Extract a field through its cascade tiers, stopping at the first confident result.
+
+        A tier that would send the same model and chunks as the previous one is skipped.
+        """
+        tiers = CASCADE_TIERS.get(field, CASCADE_TIERS["default"])
+        threshold = CASCADE_CONFIDENCE_THRESHOLDS.get(field, CASCADE_CONFIDENCE_THRESHOLDS["default"])
+        value, previous = None, None
+        for level, tier in enumerate(tiers):
+            tier_chunks = chunks[:tier["max_chunks"]] if tier["max_chunks"] else chunks
+            if (tier["model"], len(tier_chunks)) == previous:
+                continue
+            previous = (tier["model"], len(tier_chunks))
+
+            start = time.perf_counter()
+            value = await self.extract_field_value(field, tier_chunks, doc_type, model=tier["model"])
+            confidence = value.get("confidence", 0)
+            confident = isinstance(confidence, (int, float)) and confidence >= threshold
+            escalate = not confident and bool(chunks) and level < len(tiers) - 1
+            self._record_tier(level, tier["model"], time.perf_counter() - start, escalate)
+            if not escalate:
+                break
+            print(f"Escalating {field} from tier {level} ({tier['model']}): confidence {confidence} < {threshold}")
+        return value
+
+    def _record_tier(self, level: int, model: str, seconds: float, escalated: bool) -> None:
+        stats = self.cascade_stats.setdefault(level, {"model": model, "calls": 0, "escalated": 0, "seconds": 0.0})
+        stats["calls"] += 1
+        stats["escalated"] += int(escalated)
+        stats["seconds"] += seconds
+
+    def cascade_summary(self) -> str:
+        """One line per cascade tier with its calls, escalation rate and mean latency."""
+        return '\n'.join(
+            f"tier {level} ({stats['model']}): {stats['calls']} calls, "
+            f"{stats['escalated'] / stats['calls']:.0%} escalated, {stats['seconds'] / stats['calls']:.2f} s per call"
+            for level, stats in sorted(self.cascade_stats.items())
+        )
+
+    def get_field_queries(self, field: str, doc_type: str = "MSA") -> List[str]:
+        """Get the retrieval queries configured for a field."""
+        return field_queries(field, doc_type, self.retrieval_mode)
+
+    def get_field_match_query(self, field: str) -> Optional[str]:
+        """FTS5 query for a field's keywords in hybrid mode, or None for dense-only retrieval."""
+        return field_match_query(field, self.retrieval_mode)
+
+    async def process_field(self, field: str, doc_type: str = "MSA", chunks_results: Optional[List[List[Dict]]] = None) -> Dict[str, Any]:
+        """Process a single field by getting relevant chunks and extracting value.
+
+        chunks_results holds pre-retrieved chunks for each of the field's queries;
+        when omitted they are retrieved here with one batched call.
+        """
         try:
             # Get relevant chunks for all queries for this field
-            queries = MSA_QUERIES if doc_type == "MSA" else SOW_QUERIES
-            field_queries = queries.get(field, [f"Extract the {field} from the contract"])
-            
-            chunk_tasks = []
-            for query in field_queries:
-                chunk_tasks.append(self.db_handler.get_relevant_chunks (
-                    query,
+            if chunks_results is None:
+                field_queries = self.get_field_queries(field, doc_type)
+                chunks_results = await self.db_handler.get_relevant_chunks_batch(
+                    field_queries,
                     async_client=self.async_client,
-                    k=3
-                ))
-            
-            # Get all chunks in parallel
-            chunks_results = await asyncio.gather(*chunk_tasks)
+                    k=3,
+                    document_id=self.document_id,
+                    match_queries=[self.get_field_match_query(field)] * len(field_queries),
+                    hedge=self.hedging,
+                    deadline=self.deadline
+                )
             
             # Combine and deduplicate chunks
-            all_chunks = []
-            seen_chunks = set()
-            for chunks in chunks_results:
-                for chunk in chunks:
-                    chunk_text = chunk["chunk"]
-                    if chunk_text not in seen_chunks:
-                        seen_chunks.add(chunk_text)
-                        all_chunks.append(chunk)
+            all_chunks = merge_chunks(chunks_results)
             
             # Extract value from chunks
             try:
-                value = await self.extract_field_value(field, all_chunks, doc_type)
+                if self.cascade:
+                    value = await self.extract_field_cascade(field, all_chunks, doc_type)
+                else:
+                    value = await self.extract_field_value(field, all_chunks, doc_type)
                 if not isinstance(value, dict) or "field_value" not in value:
                     value = {
                         "field_value": "",
@@ -244,32 +571,150 @@ class SQLiteOpenAIRAG:
             except Exception as e:
                 print(f"Error extracting value for field {field}: {str(e)}")
 
+            self.completed[field] = value
             return {
                 "field": field,
                 "value": value,
             }
         except Exception as e:
             print(f"Error processing field '{field}': {str(e)}")
+            self.completed[field] = {
+                "field_value": "",
+                "page_number": "",
+                "confidence": 1,
+                "reasoning": f"Error: {str(e)}",
+                "proof": ""
+            }
             return {
                 "field": field,
-                "value": {
-                    "field_value": "",
-                    "page_number": "",
-                    "confidence": 1,
-                    "reasoning": f"Error: {str(e)}",
-                    "proof": ""
-                },
+                "value": self.completed[field],
                 "chunks": []
             }
 
+    async def pre_extract_fields(self, fields: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Values of the fields the pattern extractors resolve unambiguously from the document's chunks."""
+        if not self.pre_extraction or self.document_id is None:
+            return {}
+        try:
+            chunks = await run_db(self.db_handler.get_document_chunks, self.document_id)
+            values = pre_extract(fields, chunks)
+        except Exception as e:
+            print(f"Error during pre-extraction: {str(e)}")
+            return {}
+        # Values whose matches disagree come back below the threshold and are left to the LLM
+        confident = {}
+        for field, value in values.items():
+            if value["confidence"] < PRE_EXTRACTION_MIN_CONFIDENCE:
+                print(f"Ambiguous pre-extraction of {field}: {value['field_value']}; leaving it to the LLM")
+                continue
+            print(f"Pre-extracted {field}: {value['field_value']} (page {value['page_number']})")
+            confident[field] = value
+        return confident
+
     async def extract_all_fields(self, doc_type: str = "MSA") -> List[Dict[str, Any]]:
         """Extract all fields in parallel."""
         # Select fields based on document type
         fields_to_extract = MSA_FIELDS_TO_EXTRACT if doc_type == "MSA" else SOW_FIELDS_TO_EXTRACT
-        
+
+        # Fields resolved by pattern matching skip retrieval and the LLM
+        pre_extracted = await self.pre_extract_fields(fields_to_extract)
+        self.completed.update(pre_extracted)
+        remaining = [field for field in fields_to_extract if field not in pre_extracted]
+        results = {result["field"]: result for result in await self.extract_fields(remaining, doc_type)} if remaining else {}
+        return [
+            {"field": field, "value": pre_extracted[field]} if field in pre_extracted else results[field]
+            for field in fields_to_extract
+        ]
+
+    async def extract_fields(self, fields_to_extract: List[str], doc_type: str = "MSA") -> List[Dict[str, Any]]:
+        """Retrieve chunks for the fields and extract them with the LLM in the configured mode."""
+        # Retrieve chunks for every query of every field with a single batched call.
+        # A query is keyed with its field's FTS5 query, which is None for dense retrieval.
+        field_queries = {
+            field: [(query, self.get_field_match_query(field)) for query in self.get_field_queries(field, doc_type)]
+            for field in fields_to_extract
+        }
+        unique_queries = list(dict.fromkeys(query for queries in field_queries.values() for query in queries))
+        query_results = await self.db_handler.get_relevant_chunks_batch(
+            [query for query, _ in unique_queries],
+            async_client=self.async_client,
+            k=3,
+            document_id=self.document_id,
+            match_queries=[match_query for _, match_query in unique_queries],
+            hedge=self.hedging,
+            deadline=self.deadline
+        )
+        chunks_by_query = dict(zip(unique_queries, query_results))
+
+        if self.extraction_mode in ("grouped", "cached_prefix"):
+            chunks_by_field = {
+                field: merge_chunks([chunks_by_query.get(query, []) for query in field_queries[field]])
+                for field in fields_to_extract
+            }
+            if self.extraction_mode == "grouped":
+                return await self.extract_grouped_fields(chunks_by_field, doc_type)
+            return await self.extract_fields_with_prefix(chunks_by_field, doc_type)
+
         # Process all fields in parallel
-        tasks = [self.process_field(field, doc_type) for field in fields_to_extract]
-        return await asyncio.gather(*tasks)
+        tasks = [
+            self.process_field(
+                field,
+                doc_type,
+                chunks_results=[chunks_by_query.get(query, []) for query in field_queries[field]]
+            )
+            for field in fields_to_extract
+        ]
+        results = await asyncio.gather(*tasks)
+        if self.cascade:
+            print(f"Model cascade:\n{self.cascade_summary()}")
+        return results
+
+    async def extract_grouped_fields(self, chunks_by_field: Dict[str, List[Dict]], doc_type: str = "MSA") -> List[Dict[str, Any]]:
+        """Extract fields in groups of overlapping chunks, one call per group, in parallel."""
+        groups = group_fields(chunks_by_field)
+        print(f"Extracting {len(chunks_by_field)} fields in {len(groups)} grouped calls")
+
+        async def extract_group(fields: List[str]) -> Dict[str, Dict[str, Any]]:
+            values = await self.extract_field_group(fields, merge_chunks([chunks_by_field[field] for field in fields]), doc_type)
+            self.completed.update(values)
+            return values
+
+        group_values = await asyncio.gather(*(extract_group(fields) for fields in groups))
+        values = {field: value for group in group_values for field, value in group.items()}
+        return [{"field": field, "value": values[field]} for field in chunks_by_field]
+
+    async def _completing(self, field: str, extraction) -> Dict[str, Any]:
+        """Await a field's extraction and record its value in completed."""
+        value = await extraction
+        self.completed[field] = value
+        return value
+
+    async def extract_fields_with_prefix(self, chunks_by_field: Dict[str, List[Dict]], doc_type: str = "MSA") -> List[Dict[str, Any]]:
+        """Extract each field in its own call over one canonical document context shared by all calls."""
+        chunks = canonical_chunks(chunks_by_field)
+        cacheable = [field for field in chunks_by_field if f"{field}_schema" in globals()]
+        if not chunks or not cacheable:
+            values = await asyncio.gather(*(
+                self._completing(field, self.extract_field_value(field, chunks, doc_type)) for field in chunks_by_field
+            ))
+            return [{"field": field, "value": value} for field, value in zip(chunks_by_field, values)]
+
+        document_context = f"Contract Text:\n{self.format_chunks_to_xml(chunks)}\n"
+        schema = shared_schema(cacheable)
+
+        # The first call writes the prefix to the cache; the rest run in parallel and read it
+        values = {cacheable[0]: await self._completing(
+            cacheable[0], self.extract_field_with_prefix(cacheable[0], document_context, schema, doc_type)
+        )}
+        rest = [field for field in chunks_by_field if field != cacheable[0]]
+        rest_values = await asyncio.gather(*(
+            self._completing(field, self.extract_field_with_prefix(field, document_context, schema, doc_type)) if field in cacheable
+            else self._completing(field, self.extract_field_value(field, chunks_by_field[field], doc_type))
+            for field in rest
+        ))
+        values.update(zip(rest, rest_values))
+        print(f"Prompt cache: {self.usage['cached_tokens']}/{self.usage['prompt_tokens']} prompt tokens served from cache")
+        return [{"field": field, "value": values[field]} for field in chunks_by_field]
 
 async def main():
     # Set up logging
@@ -295,23 +740,20 @@ async def main():
     # Initialize the database
     db = ResultDatabase()
 
-    # Initialize the RAG system
-    rag_system = SQLiteOpenAIRAG()
-    
-    # Check if we need to store new documents
-    conn = sqlite3.connect(rag_system.db_path)
-    c = conn.cursor()
-    c.execute('SELECT COUNT(*) FROM document_chunks')
-    count = c.fetchone()[0]
-    conn.close()
+    # Initialize the RAG system, scoped to this document
+    with open(pdf_path, "rb") as f:
+        document_id = DatabaseHandler.compute_document_id(f.read())
+    rag_system = SQLiteOpenAIRAG(document_id=document_id)
     
-    if count == 0 and chunked_docs:
+    # Embed and store the document only if its vectors are not stored yet
+    if not rag_system.db_handler.has_complete_document(document_id) and chunked_docs:
         # Generate embeddings
         embedding_generator = AsyncEmbeddingGenerator()
         embedded_docs = await embedding_generator.embed_chunks(chunked_docs)
         
-        # Store documents
-        rag_system.db_handler.store_chunked_docs(embedded_docs)
+        # Store documents; an incomplete set is embedded again on the next run
+        rag_system.db_handler.replace_document(document_id, embedded_docs, file_name=file_name, doc_type=doc_type,
+                                               complete=not embedding_generator.failed_chunks)
     
     # Extract all fields in parallel
     results = await rag_system.extract_all_fields(doc_type)
@@ -0,0 +1,111 @@
+import uuid
+import asyncio
+from typing import Any, Dict, List, Optional, Set
+from deadline import Deadline
+
+# Job statuses; a field still missing from a job carries the job's status as its marker
+PENDING = "pending"
+COMPLETED = "completed"
+TIMED_OUT = "timed_out"
+FAILED = "failed"
+
+
+def status_marker(status: str, job_id: str) -> Dict[str, Any]:
+    """Stand-in value, in the extraction result shape, for a field that is not extracted yet."""
+    reasons = {
+        PENDING: f"Extraction is still running; fetch GET /upload/{job_id}/pending for the value",
+        TIMED_OUT: "Extraction did not finish before the upload deadline",
+        FAILED: "Extraction failed before this field was extracted"
+    }
+    return {
+        "field_value": "",
+        "page_number": "",
+        "confidence": 0,
+        "reasoning": reasons[status],
+        "proof": "",
+        "status": status
+    }
+
+
+class UploadJob:
+    """The extraction of one upload, which may outlive the request that started it.
+
+    values fills in as fields finish. Fields missing when the response was sent
+    are the stragglers, stored into the results database once they complete. The
+    job's state is saved there too (to_record), so any worker can report it.
+    """
+
+    def __init__(self, fields: List[str], doc_type: str, file_name: str, document_id: str,
+                 deadline: Optional[Deadline] = None, job_id: Optional[str] = None):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.fields = fields
+        self.doc_type = doc_type
+        self.file_name = file_name
+        self.document_id = document_id
+        self.deadline = deadline
+        self.values: Dict[str, Dict[str, Any]] = {}
+        self.status = PENDING
+        self.error: Optional[str] = None
+        self.db_id: Optional[int] = None
+        self.stragglers: List[str] = []
+        self.task: Optional[asyncio.Task] = None
+        self.finisher: Optional[asyncio.Task] = None
+
+    def pending_fields(self) -> List[str]:
+        return [field for field in self.fields if field not in self.values]
+
+    def results(self, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Field results in extraction order, with a status marker for each field not done."""
+        return [
+            {"field": field, "value": self.values[field]} if field in self.values
+            else {"field": field, "value": status_marker(self.status, self.job_id)}
+            for field in (self.fields if fields is None else fields)
+        ]
+
+    def finish(self, status: str, error: Optional[str] = None) -> None:
+        self.status = status
+        self.error = error
+
+    def to_record(self) -> Dict[str, Any]:
+        """State for ResultDatabase.save_upload_job: the stragglers and the values they have so far."""
+        return {
+            "job_id": self.job_id,
+            "db_id": self.db_id,
+            "document_id": self.document_id,
+            "doc_type": self.doc_type,
+            "file_name": self.file_name,
+            "status": self.status,
+            "error": self.error,
+            "pending_fields": self.stragglers,
+            "field_values": {field: self.values[field] for field in self.stragglers if field in self.values}
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "UploadJob":
+        """A read-only view of a job saved by any worker."""
+        job = cls(record["pending_fields"], record["doc_type"], record["file_name"], record["document_id"],
+                  job_id=record["job_id"])
+        job.db_id = record["db_id"]
+        job.status = record["status"]
+        job.error = record["error"]
+        job.stragglers = record["pending_fields"]
+        job.values = record["field_values"]
+        return job
+
+
+# Jobs still running in this worker; asyncio holds only weak references to their tasks
+_RUNNING_JOBS: Set[UploadJob] = set()
+
+
+def register_job(job: UploadJob) -> None:
+    """Keep a running job, and so its tasks, alive until it is released."""
+    _RUNNING_JOBS.add(job)
+
+
+def release_job(job: UploadJob) -> None:
+    _RUNNING_JOBS.discard(job)
+
+
+def get_running_job(job_id: str) -> Optional[UploadJob]:
+    """The job if it is running in this worker, with the values of fields finished so far."""
+    return next((job for job in _RUNNING_JOBS if job.job_id == job_id), None)
@@ -0,0 +1,320 @@
+import os
+import base64
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Callable, List, Dict, Optional, Sequence, Tuple
+from sqlite_pool import get_pool
+from config import VECTOR_INDEX_CACHE_MAX_BYTES, COMPACT_VECTOR_STORAGE, COMPACT_VECTOR_RESCORE_FACTOR
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scale each row to unit length so a dot product is the cosine similarity."""
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the k highest scores in each row, best first."""
+    n = scores.shape[1]
+    k = min(k, n)
+    if k < n:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.tile(np.arange(n), (len(scores), 1))
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+class VectorIndex:
+    """In-memory matrix of pre-normalized chunk embeddings for top-k cosine search."""
+
+    def __init__(self, chunks: List[str], page_numbers: List[int], embeddings: np.ndarray):
+        self.chunks = chunks
+        self.page_numbers = page_numbers
+        # Take one owned float32 copy and normalize it in place
+        self.matrix = np.array(embeddings, dtype=np.float32)
+        if self.matrix.size:
+            norms = np.linalg.norm(self.matrix, axis=-1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self.matrix /= norms
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Tuple[str, int, bytes]]) -> "VectorIndex":
+        """Build an index from (chunk, page_number, embedding_bytes) rows."""
+        if not rows:
+            return cls([], [], np.empty((0, 0), dtype=np.float32))
+
+        dim = len(rows[0][2]) // np.dtype(np.float32).itemsize
+        matrix = np.empty((len(rows), dim), dtype=np.float32)
+        chunks, page_numbers = [], []
+        for i, (chunk, page_number, embedding_bytes) in enumerate(rows):
+            matrix[i] = np.frombuffer(embedding_bytes, dtype=np.float32)
+            chunks.append(chunk)
+            page_numbers.append(page_number)
+
+        return cls(chunks, page_numbers, matrix)
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the index (matrix plus chunk text)."""
+        return self.matrix.nbytes + sum(len(chunk) for chunk in self.chunks)
+
+    def search(self, query_embedding: Sequence[float], k: int = 3) -> List[Dict]:
+        """Return the top-k chunks for a query embedding, best first."""
+        return self.search_batch([query_embedding], k)[0]
+
+    def search_batch(self, query_embeddings: Sequence[Sequence[float]], k: int = 3) -> List[List[Dict]]:
+        """Return the top-k chunks for each query embedding, scored with one matrix multiply."""
+        if len(self) == 0 or k <= 0:
+            return [[] for _ in query_embeddings]
+
+        queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32))
+        scores = queries @ self.matrix.T
+        top = top_k_indices(scores, k)
+
+        return [
+            [
+                {
+                    "chunk": self.chunks[i],
+                    "page_number": self.page_numbers[i],
+                    "score": float(row_scores[i])
+                }
+                for i in row_top
+            ]
+            for row_top, row_scores in zip(top, scores)
+        ]
+
+
+def quantize_embeddings(embeddings: np.ndarray, dimensions: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Truncate embeddings to their first `dimensions` components and int8-quantize them.
+
+    text-embedding-3 vectors are trained so that a renormalized prefix is equivalent
+    to requesting fewer `dimensions` from the API. Each row is renormalized, then
+    scaled by its own max-abs value into int8. Returns (codes, per-row scales).
+    """
+    truncated = normalize_rows(np.asarray(embeddings, dtype=np.float32)[..., :dimensions])
+    scales = np.abs(truncated).max(axis=-1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.round(truncated / scales[..., None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class CompactVectorIndex:
+    """Int8-quantized, dimension-truncated chunk embeddings with full-precision rescoring.
+
+    Candidates are ranked on the compact codes; the best k * rescore_factor of them
+    are rescored exactly against full-precision vectors fetched with full_loader,
+    which maps row positions to a float32 matrix of the original embeddings.
+    """
+
+    # Rows upcast to float32 at a time while scanning, to bound temporary memory
+    block_rows = 8192
+
+    def __init__(self, chunks: List[str], page_numbers: List[int], codes: np.ndarray, scales: np.ndarray,
+                 full_loader: Callable[[np.ndarray], np.ndarray], rescore_factor: int = COMPACT_VECTOR_RESCORE_FACTOR):
+        self.chunks = chunks
+        self.page_numbers = page_numbers
+        self.codes = np.ascontiguousarray(codes, dtype=np.int8)
+        self.scales = np.asarray(scales, dtype=np.float32)
+        self.full_loader = full_loader
+        self.rescore_factor = rescore_factor
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the index (codes, scales plus chunk text)."""
+        return self.codes.nbytes + self.scales.nbytes + sum(len(chunk) for chunk in self.chunks)
+
+    def search(self, query_embedding: Sequence[float], k: int = 3) -> List[Dict]:
+        """Return the top-k chunks for a query embedding, best first."""
+        return self.search_batch([query_embedding], k)[0]
+
+    def search_batch(self, query_embeddings: Sequence[Sequence[float]], k: int = 3) -> List[List[Dict]]:
+        """Return the top-k chunks for each query, ranked on compact codes and rescored exactly."""
+        if len(self) == 0 or k <= 0:
+            return [[] for _ in query_embeddings]
+
+        full_queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32))
+        compact_queries = normalize_rows(full_queries[:, :self.codes.shape[1]])
+
+        approx = np.empty((len(full_queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), self.block_rows):
+            block = self.codes[start:start + self.block_rows].astype(np.float32)
+            approx[:, start:start + len(block)] = (compact_queries @ block.T) * self.scales[start:start + len(block)]
+        candidates = top_k_indices(approx, k * self.rescore_factor)
+
+        # Fetch each distinct candidate's full vector once for all queries
+        positions = np.unique(candidates)
+        full = normalize_rows(self.full_loader(positions))
+        row_of = {position: row for row, position in enumerate(positions.tolist())}
+
+        results = []
+        for query, row_candidates in zip(full_queries, candidates):
+            exact = full[[row_of[position] for position in row_candidates.tolist()]] @ query
+            best = top_k_indices(exact[None, :], k)[0]
+            results.append([
+                {
+                    "chunk": self.chunks[row_candidates[i]],
+                    "page_number": self.page_numbers[row_candidates[i]],
+                    "score": float(exact[i])
+                }
+                for i in best
+            ])
+        return results
+
+
+def embeddings_to_matrix(data: Sequence) -> np.ndarray:
+    """Decode embeddings API response items into one preallocated float32 matrix.
+
+    Items requested with encoding_format="base64" are decoded straight from their
+    raw bytes; float lists are accepted as well. Rows follow each item's index.
+    """
+    items = sorted(data, key=lambda item: item.index)
+    if not items:
+        return np.empty((0, 0), dtype=np.float32)
+
+    def as_array(embedding) -> np.ndarray:
+        if isinstance(embedding, str):
+            return np.frombuffer(base64.b64decode(embedding), dtype=np.float32)
+        return np.asarray(embedding, dtype=np.float32)
+
+    first = as_array(items[0].embedding)
+    matrix = np.empty((len(items), first.shape[0]), dtype=np.float32)
+    matrix[0] = first
+    for i, item in enumerate(items[1:], start=1):
+        matrix[i] = as_array(item.embedding)
+    return matrix
+
+
+def load_vector_index(db_path: str, document_id: Optional[str] = None) -> VectorIndex:
+    """Load the chunk embeddings of a document, or of every document, into a VectorIndex."""
+    condition, params = _document_filter(document_id)
+    rows = get_pool(db_path).fetchall(
+        f'SELECT chunk, page_number, embedding FROM document_chunks WHERE {condition} ORDER BY id', params)
+    return VectorIndex.from_rows(rows)
+
+
+class VectorIndexCache:
+    """Process-wide LRU cache of VectorIndex objects, bounded by total byte size.
+
+    Entries may carry a version token; a lookup with a different version is a miss,
+    so changes written by another worker process are picked up on the next search.
+    """
+
+    def __init__(self, max_bytes: int = VECTOR_INDEX_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[Optional[str], VectorIndex]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str, version: Optional[str] = None) -> Optional[VectorIndex]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, index: VectorIndex, version: Optional[str] = None) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1].nbytes
+
+            # An index larger than the whole budget is served but never cached
+            if index.nbytes > self.max_bytes:
+                return
+
+            self._entries[key] = (version, index)
+            self._size += index.nbytes
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted.nbytes
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1].nbytes
+
+    def get_or_load(self, key: str, loader: Callable[[], VectorIndex], version: Optional[str] = None) -> VectorIndex:
+        """Return the cached index for key at this version, loading and caching it on a miss."""
+        index = self.get(key, version)
+        if index is None:
+            index = loader()
+            self.put(key, index, version)
+        return index
+
+
+vector_index_cache = VectorIndexCache()
+
+
+def _full_embedding_loader(db_path: str, ids: List[int]) -> Callable[[np.ndarray], np.ndarray]:
+    """Loader that fetches full-precision embeddings for row positions of a compact index."""
+    def load(positions: np.ndarray) -> np.ndarray:
+        wanted = [ids[position] for position in positions.tolist()]
+        placeholders = ','.join('?' * len(wanted))
+        rows = get_pool(db_path).fetchall(f'SELECT id, embedding FROM document_chunks WHERE id IN ({placeholders})', wanted)
+        by_id = {chunk_id: np.frombuffer(embedding_bytes, dtype=np.float32) for chunk_id, embedding_bytes in rows}
+        return np.stack([by_id[chunk_id] for chunk_id in wanted])
+    return load
+
+
+def _document_filter(document_id: Optional[str]) -> Tuple[str, tuple]:
+    """SQL condition and parameters restricting document_chunks to one document, or to all."""
+    if document_id is None:
+        return '1 = 1', ()
+    return 'document_id = ?', (document_id,)
+
+
+def load_compact_vector_index(db_path: str, document_id: Optional[str] = None) -> CompactVectorIndex:
+    """Load the compact (int8, truncated) chunk embeddings of a document, or of every document."""
+    condition, params = _document_filter(document_id)
+    rows = get_pool(db_path).fetchall(
+        'SELECT id, chunk, page_number, embedding_q, embedding_scale '
+        f'FROM document_chunks WHERE embedding_q IS NOT NULL AND {condition} ORDER BY id',
+        params
+    )
+
+    if not rows:
+        return CompactVectorIndex([], [], np.empty((0, 0), dtype=np.int8), np.empty(0, dtype=np.float32), lambda positions: None)
+
+    ids = [row[0] for row in rows]
+    codes = np.empty((len(rows), len(rows[0][3])), dtype=np.int8)
+    for i, row in enumerate(rows):
+        codes[i] = np.frombuffer(row[3], dtype=np.int8)
+    return CompactVectorIndex(
+        [row[1] for row in rows],
+        [row[2] for row in rows],
+        codes,
+        np.array([row[4] for row in rows], dtype=np.float32),
+        _full_embedding_loader(db_path, ids)
+    )
+
+
+def index_cache_key(db_path: str, document_id: Optional[str] = None, compact: bool = COMPACT_VECTOR_STORAGE,
+                    variant: str = "") -> str:
+    """Key of a document's index (or the whole store's, for None) in the process-wide cache."""
+    key = f"{os.path.abspath(db_path)}#{document_id or '*'}"
+    if compact:
+        key = f"{key}#compact"
+    return f"{key}#{variant}" if variant else key
+
+
+def get_vector_index(db_path: str, document_id: Optional[str] = None, compact: bool = COMPACT_VECTOR_STORAGE,
+                     version: Optional[str] = None):
+    """Get the vector index for a document, loading it from SQLite only on a cache miss."""
+    loader = load_compact_vector_index if compact else load_vector_index
+    return vector_index_cache.get_or_load(
+        index_cache_key(db_path, document_id, compact),
+        lambda: loader(db_path, document_id),
+        version
+    )